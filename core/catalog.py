@@ -0,0 +1,187 @@
+import sqlite3
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from threading import Lock
+from typing import List, Optional
+
+from core import core_configuration
+from core.core_configuration import FileManager, PICTURE_NAME_FORMAT, PLOT_NAME_FORMAT
+from core.core_log import get_logger
+from core.previews import PICTURE_SUFFIXES
+from core.startup import lazy_import
+
+log = get_logger(__name__)
+Image = lazy_import("PIL.Image")
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Catalog of the stored pictures and plots. Folders with tens of thousands of pictures are slow to list, so the files
+# are registered in a small SQLite database in the data folder when they are written.
+# - An entry holds the path relative to the data folder, kind, timestamp, size and the dimensions of pictures
+# - Timestamps are parsed once from the file name (PICTURE_NAME_FORMAT or PLOT_NAME_FORMAT), otherwise the mtime is used
+# - Entries are queried by kind and time range, e.g., for timelapses, retention or the latest picture
+# - An empty catalog is filled by scanning the folders once, e.g., for existing installations
+# Files which are deleted outside HomeTemp stay in the catalog until they are removed or the catalog is rebuilt.
+# ----------------------------------------------------------------------------------------------------------------
+
+PICTURE_TIMED = "picture_timed"
+PICTURE_COMMANDED = "picture_commanded"
+PLOT_TIMED = "plot_timed"
+PLOT_COMMANDED = "plot_commanded"
+SUPPORTED_KINDS = [PICTURE_TIMED, PICTURE_COMMANDED, PLOT_TIMED, PLOT_COMMANDED]
+# folder and file suffixes of each kind
+_KIND_FOLDERS = {PICTURE_TIMED: (FileManager.TIMED_PICTURES, PICTURE_SUFFIXES),
+                 PICTURE_COMMANDED: (FileManager.COMMANDED_PICTURES, PICTURE_SUFFIXES),
+                 PLOT_TIMED: (FileManager.TIMED_PLOTS, [".pdf"]),
+                 PLOT_COMMANDED: (FileManager.COMMANDED_PLOTS, [".pdf"])}
+
+
+@dataclass
+class CatalogEntry:
+    path: Path
+    kind: str
+    timestamp: float
+    size: int
+    width: Optional[int] = None
+    height: Optional[int] = None
+
+    @property
+    def datetime(self) -> datetime:
+        return datetime.fromtimestamp(self.timestamp)
+
+
+class PictureCatalog:
+
+    def __init__(self, db_path: str, base_path: str) -> None:
+        self.db_path = db_path
+        self.base_path = Path(base_path).resolve()
+        self._lock = Lock()
+        # the catalog is used by the capture, render and maintenance threads
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, kind TEXT NOT NULL, "
+                               "timestamp REAL NOT NULL, size INTEGER NOT NULL, width INTEGER, height INTEGER)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS files_kind_timestamp ON files (kind, timestamp)")
+
+    def __str__(self):
+        return f"PictureCatalog[{self.db_path}]"
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def kind_of(self, path: str) -> Optional[str]:
+        """Returns the kind of the file by its folder and suffix or None if it is no picture or plot."""
+        file_path = Path(path).resolve()
+        for kind, (folder, suffixes) in _KIND_FOLDERS.items():
+            if file_path.parent == self.base_path / folder and file_path.suffix in suffixes:
+                return kind
+        return None
+
+    def _relative(self, path: str) -> str:
+        return str(Path(path).resolve().relative_to(self.base_path))
+
+    def add(self, path: str, kind: Optional[str] = None) -> Optional[CatalogEntry]:
+        """Registers the written file or updates its entry. Returns None if the file is no picture or plot."""
+        file_path = Path(path)
+        kind = self.kind_of(path) if kind is None else kind
+        if kind not in SUPPORTED_KINDS:
+            log.warning(f"Not adding {path} to catalog, unsupported kind {kind}")
+            return None
+        try:
+            stat = file_path.stat()
+        except OSError as e:
+            log.error(f"Not adding {path} to catalog: {str(e)}")
+            return None
+        name_format = PICTURE_NAME_FORMAT if kind in [PICTURE_TIMED, PICTURE_COMMANDED] else PLOT_NAME_FORMAT
+        try:
+            timestamp = datetime.strptime(file_path.stem, name_format).timestamp()
+        except ValueError:
+            timestamp = stat.st_mtime
+        width, height = None, None
+        if kind in [PICTURE_TIMED, PICTURE_COMMANDED]:
+            try:
+                # only the header is read
+                with Image.open(file_path) as image:
+                    width, height = image.size
+            except Exception as e:
+                log.warning(f"Could not read dimensions of {path}: {str(e)}")
+        entry = CatalogEntry(file_path.resolve(), kind, timestamp, stat.st_size, width, height)
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                               (self._relative(path), kind, timestamp, stat.st_size, width, height))
+        return entry
+
+    def remove(self, path: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM files WHERE path = ?", (self._relative(path),))
+
+    def _entry(self, row: tuple) -> CatalogEntry:
+        return CatalogEntry(self.base_path / row[0], *row[1:])
+
+    def query(self, kind: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[CatalogEntry]:
+        """Returns the entries of a kind with start <= timestamp < end, oldest first."""
+        start_ts = float("-inf") if start is None else start.timestamp()
+        end_ts = float("inf") if end is None else end.timestamp()
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM files WHERE kind = ? AND timestamp >= ? AND timestamp < ? "
+                                      "ORDER BY timestamp, path", (kind, start_ts, end_ts)).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def latest(self, kind: str) -> Optional[CatalogEntry]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM files WHERE kind = ? ORDER BY timestamp DESC, path DESC LIMIT 1",
+                                     (kind,)).fetchone()
+        return None if row is None else self._entry(row)
+
+    def total_size(self, kind: str) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM files WHERE kind = ?", (kind,)).fetchone()[0]
+
+    def rebuild(self) -> int:
+        """Replaces the catalog by a scan of the folders. Returns the number of entries."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM files")
+        count = 0
+        for kind, (folder, suffixes) in _KIND_FOLDERS.items():
+            folder_path = self.base_path / folder
+            if not folder_path.is_dir():
+                continue
+            for file_path in folder_path.iterdir():
+                if file_path.suffix in suffixes and file_path.is_file() and self.add(str(file_path), kind) is not None:
+                    count += 1
+        log.info(f"Rebuilt {self} with {count} files")
+        return count
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Static utility methods
+# ----------------------------------------------------------------------------------------------------------------
+
+_catalog: Optional[PictureCatalog] = None
+_catalog_lock = Lock()
+
+
+def get_catalog() -> PictureCatalog:
+    """Returns the catalog in the data folder of the FileManager, which is filled by a scan if it is empty."""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            fm = core_configuration.get_file_manager()
+            _catalog = PictureCatalog(str(fm.base_path / "catalog.sqlite"), str(fm.base_path))
+            if len(_catalog) == 0:
+                _catalog.rebuild()
+        return _catalog
+
+
+def catalog_file(path: str) -> None:
+    """Adds a written picture or plot to the catalog, errors are logged and do not affect the caller."""
+    try:
+        get_catalog().add(path)
+    except Exception as e:
+        log.error(f"Error while adding {path} to catalog: {str(e)}")
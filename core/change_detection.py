@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import io
+from threading import Lock
+from typing import Optional, Tuple
+
+from core import core_configuration
+from core.catalog import PICTURE_TIMED, get_catalog
+from core.core_log import get_logger
+from core.monitoring import PrometheusManager
+from core.startup import lazy_import
+
+log = get_logger(__name__)
+Image = lazy_import("PIL.Image")
+np = lazy_import("numpy")
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Change detection for timed pictures. Most timed pictures of a room do not differ from the previous one, so storing
+# them only costs disk space and timelapse work. The ChangeDetector compares a small grayscale version of a new picture
+# with the one of the last stored picture.
+# - The signature is at most 64 pixels wide, JPEGs are decoded at reduced size. The comparison is vectorized with NumPy
+# - The mean brightness is removed from both signatures, so a small change of the exposure is not a change
+# - The score is the share of signature pixels which differ by more than pixel_threshold gray values
+# - A picture with a score below threshold is skipped. With keep_every, every keep_every-th unchanged picture is stored
+#   anyway, which thins out unchanged periods instead of leaving gaps
+# Decisions and scores are published to Prometheus. Change detection is enabled with change_detection in the optional
+# section camera and only applies to timed pictures.
+# ----------------------------------------------------------------------------------------------------------------
+
+SIGNATURE_WIDTH = 64
+
+
+class ChangeDetector:
+
+    def __init__(self, threshold: float = 0.02, pixel_threshold: int = 12, keep_every: int = 6) -> None:
+        self.threshold = threshold
+        self.pixel_threshold = pixel_threshold
+        # 0 never stores an unchanged picture
+        self.keep_every = max(0, keep_every)
+        self.skipped = 0
+        self._reference: Optional[np.ndarray] = None
+        self._lock = Lock()
+
+    def __str__(self):
+        return f"ChangeDetector[threshold: {self.threshold}, pixel threshold: {self.pixel_threshold}, " \
+               f"keep every: {self.keep_every}]"
+
+    @staticmethod
+    def signature(picture) -> Optional[np.ndarray]:
+        """Returns the small grayscale version of a picture path or encoded bytes without its mean brightness."""
+        try:
+            image = Image.open(io.BytesIO(picture) if isinstance(picture, bytes) else picture)
+            size = (SIGNATURE_WIDTH, max(1, SIGNATURE_WIDTH * image.height // image.width))
+            if image.format == "JPEG":
+                image.draft("L", size)
+            pixels = np.asarray(image.convert("L").resize(size, Image.Resampling.BOX), dtype=np.float32)
+            return pixels - pixels.mean()
+        except Exception as e:
+            log.error(f"Error while creating signature of picture: {str(e)}")
+            return None
+
+    def load_reference(self, picture_path: str) -> None:
+        """Uses a stored picture as reference, e.g., the latest one after a restart."""
+        reference = self.signature(picture_path)
+        with self._lock:
+            self._reference = reference
+
+    def score(self, signature: np.ndarray) -> Optional[float]:
+        """Returns the share of changed pixels compared to the reference or None if there is no comparable reference."""
+        with self._lock:
+            reference = self._reference
+        if reference is None or reference.shape != signature.shape:
+            return None
+        return float(np.count_nonzero(np.abs(signature - reference) > self.pixel_threshold)) / signature.size
+
+    def check(self, picture: bytes) -> Tuple[bool, str, Optional[float]]:
+        """
+        Returns whether the picture should be stored, the decision (first, changed, thinned or skipped) and the score.
+        A stored picture becomes the new reference.
+        """
+        signature = self.signature(picture)
+        if signature is None:
+            # a picture which can not be compared is stored
+            return True, "first", None
+        score = self.score(signature)
+        if score is None:
+            decision = "first"
+        elif score >= self.threshold:
+            decision = "changed"
+        elif self.keep_every > 0 and self.skipped + 1 >= self.keep_every:
+            decision = "thinned"
+        else:
+            decision = "skipped"
+        with self._lock:
+            if decision == "skipped":
+                self.skipped += 1
+            else:
+                self._reference, self.skipped = signature, 0
+        PrometheusManager().observe_picture_change(decision, score)
+        log.info(f"Picture {decision}, change score {score}")
+        return decision != "skipped", decision, score
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Static utility methods
+# ----------------------------------------------------------------------------------------------------------------
+
+_detector: Optional[ChangeDetector] = None
+_detector_lock = Lock()
+
+
+def get_change_detector() -> Optional[ChangeDetector]:
+    """
+    Returns the change detector configured by the optional section camera or None if every picture is stored.
+    The latest timed picture is the first reference.
+    """
+    global _detector
+    with _detector_lock:
+        if _detector is None:
+            cfg = None if core_configuration.config is None else core_configuration.camera_config()
+            if cfg is None or not cfg.getboolean('change_detection', False):
+                return None
+            _detector = ChangeDetector(threshold=cfg.getfloat('change_threshold', 0.02),
+                                       pixel_threshold=cfg.getint('change_pixel_threshold', 12),
+                                       keep_every=cfg.getint('change_keep_every', 6))
+            latest = get_catalog().latest(PICTURE_TIMED)
+            if latest is not None:
+                _detector.load_reference(str(latest.path))
+            log.info(f"Created {_detector}")
+        return _detector
@@ -127,6 +127,34 @@ def backend_config() -> SectionProxy:
     return config[used_key]
 
 
+def sensor_config() -> Optional[SectionProxy]:
+    used_key = 'sensor'
+    if not _validate_config(used_key, False):
+        return None
+    return config[used_key]
+
+
+def camera_config() -> Optional[SectionProxy]:
+    used_key = 'camera'
+    if not _validate_config(used_key, False):
+        return None
+    return config[used_key]
+
+
+def storage_config() -> Optional[SectionProxy]:
+    used_key = 'storage'
+    if not _validate_config(used_key, False):
+        return None
+    return config[used_key]
+
+
+def rendering_config() -> Optional[SectionProxy]:
+    used_key = 'rendering'
+    if not _validate_config(used_key, False):
+        return None
+    return config[used_key]
+
+
 def _validate_config(used_key: str, used_key_present_error: bool = True) -> None:
     """
     Validate that the configuration has been loaded and the specified section exists.
@@ -164,6 +192,7 @@ class FileManager:
     COMMANDED_PICTURES = f"{TIMED_PICTURES}/{_commanded_folder}"
     TIMED_PLOTS = "plots"
     COMMANDED_PLOTS = f"{TIMED_PLOTS}/{_commanded_folder}"
+    RENDER_CACHE = f"{TIMED_PLOTS}/cache"
     DEFAULT_STRUCTURE = [COMMANDED_PICTURES, COMMANDED_PLOTS]
 
     def __init__(self, base_path: str, permissions: int = 0o755) -> None:
@@ -286,7 +315,8 @@ class FileManager:
 
         try:
             files = list(folder_path.glob(pattern))
-            log.info(f"Listed files in {folder_path}: {files}")
+            # picture folders hold tens of thousands of files, see core.catalog
+            log.debug(f"Listed {len(files)} files in {folder_path}")
             return files
         except Exception as e:
             log.error(f"Failed to list files in {folder_path}: {e}")
@@ -1,14 +1,15 @@
 from abc import ABC, abstractmethod
-from typing import LiteralString
+from typing import List, LiteralString
 
-import pandas as pd
 from sqlalchemy import create_engine, text, select, update, insert, inspect, exc, Table, Column, MetaData, Integer, \
     DECIMAL, \
-    TIMESTAMP
+    TIMESTAMP, String
 
 from core.core_log import get_logger
+from core.startup import lazy_import
 
 log = get_logger(__name__)
+pd = lazy_import("pandas")
 
 # ----------------------------------------------------------------------------------------------------------------
 # Database connection module. Defines an abstract class PostgresHandler. Every handler for a database table
@@ -46,6 +47,10 @@ class PostgresHandler(ABC):
     def _create_table(self):
         pass
 
+    def _upgrade_table(self):
+        """Adds columns to an existing table which were added to _create_table later. Does nothing on default."""
+        pass
+
     def is_db_ready(self) -> bool:
         """Checks if the database is ready for transactions."""
 
@@ -83,6 +88,8 @@ class PostgresHandler(ABC):
             log.debug("Connected to the database!")
             if check_table and not self._check_table_existence():
                 self._create_table()
+            elif check_table:
+                self._upgrade_table()
             return True
         except exc.SQLAlchemyError as e:
             log.error("Problem with database " + str(e))
@@ -154,6 +161,43 @@ class PostgresHandler(ABC):
 
         return False
 
+    def _insert_many_in_table(self, rows: List[dict]) -> bool:
+        """Inserts all rows in one transaction, i.e., either all rows are inserted or none."""
+        # an executemany requires the same columns in every row
+        columns = set().union(*rows)
+        rows = [{column: row.get(column) for column in columns} for row in rows]
+        try:
+            table = Table(self.table, MetaData(), autoload_with=self.connection, extend_existing=True)
+            with self.connection.begin() as con:
+                con.execute(insert(table), rows)
+                return True
+
+        except exc.SQLAlchemyError as e:
+            log.error("Problem while inserting data into table " + str(e))
+
+        return False
+
+    def _get_column_names(self) -> List[str]:
+        try:
+            return [c['name'] for c in inspect(self.connection).get_columns(self.table)]
+        except exc.SQLAlchemyError as e:
+            log.error("Problem with database " + str(e))
+            return []
+
+    def _add_column_if_missing(self, column: Column) -> bool:
+        """Adds the column to the table if it does not exist. Returns True if the column was added."""
+        if column.name in self._get_column_names():
+            return False
+        try:
+            column_type = column.type.compile(dialect=self.connection.dialect)
+            with self.connection.begin() as con:
+                con.execute(text(f"ALTER TABLE {self.table} ADD COLUMN {column.name} {column_type}"))
+            log.info(f"Added column '{column.name}' to table '{self.table}'")
+            return True
+        except exc.SQLAlchemyError as e:
+            log.error("Problem with database " + str(e))
+            return False
+
     def _rename_column(self, old_column_name, new_column_name):
         try:
             table = Table(self.table, MetaData(), autoload_with=self.connection)
@@ -187,7 +231,8 @@ class SensorDataHandler(PostgresHandler):
                              Column('timestamp', TIMESTAMP(timezone=True), nullable=False),
                              Column('humidity', DECIMAL, nullable=False),
                              Column('room_temp', DECIMAL, nullable=False),
-                             Column('cpu_temp', DECIMAL, nullable=False))
+                             Column('cpu_temp', DECIMAL, nullable=False),
+                             *SensorDataHandler._added_columns())
         try:
             metadata.create_all(self.connection)
             log.info(f"Table '{self.table}' created successfully.")
@@ -195,17 +240,62 @@ class SensorDataHandler(PostgresHandler):
         except exc.SQLAlchemyError as e:
             log.error("Problem with database " + str(e))
 
-    def insert_measurements_into_db(self, timestamp, humidity, room_temp, cpu_temp):
+    @staticmethod
+    def _added_columns() -> List[Column]:
+        """Columns added after the first release, existing tables are upgraded on startup."""
+        return [
+            # rows written before multiple sensors were supported have no sensor id and belong to the primary sensor
+            Column('sensor_id', String(64), nullable=True),
+            # humidity and room_temp are filtered, these are the values read from the sensor
+            Column('humidity_raw', DECIMAL, nullable=True),
+            Column('room_temp_raw', DECIMAL, nullable=True),
+            # in high frequency mode, a row aggregates the readings of a period and humidity/room_temp are their mean
+            Column('humidity_min', DECIMAL, nullable=True),
+            Column('humidity_max', DECIMAL, nullable=True),
+            Column('room_temp_min', DECIMAL, nullable=True),
+            Column('room_temp_max', DECIMAL, nullable=True),
+            Column('sample_count', Integer, nullable=True)
+        ]
+
+    def _upgrade_table(self):
+        for column in SensorDataHandler._added_columns():
+            self._add_column_if_missing(column)
+
+    def insert_measurements_into_db(self, timestamp, humidity, room_temp, cpu_temp, sensor_id=None):
         insert_successful = self._insert_in_table({
             'timestamp': timestamp,
             'humidity': humidity,
             'room_temp': room_temp,
-            'cpu_temp': cpu_temp
+            'cpu_temp': cpu_temp,
+            'sensor_id': sensor_id
         })
 
         if insert_successful:
             log.info("Sensor data inserted successfully.")
 
+    def insert_measurements_batch(self, rows: List[dict]) -> bool:
+        """Inserts the measurements of all sensors of one cycle in one transaction."""
+        insert_successful = self._insert_many_in_table(rows)
+        if insert_successful:
+            log.info(f"Sensor data of {len(rows)} rows inserted successfully.")
+        return insert_successful
+
+    def read_sensor_data_into_dataframe(self, sensor_id: str, primary: bool = False):
+        """
+        Reads the rows of one sensor. Rows without sensor id belong to the primary sensor, see _added_columns, so they
+        are only returned for the primary sensor.
+        """
+        if 'sensor_id' not in self._get_column_names():
+            return self.read_data_into_dataframe()
+        condition = "sensor_id IS NULL OR sensor_id = :sensor_id" if primary else "sensor_id = :sensor_id"
+        try:
+            return pd.read_sql(text(f"SELECT * FROM {self.table} WHERE {condition}"),
+                               self.connection, params={'sensor_id': sensor_id})
+
+        except exc.SQLAlchemyError as e:
+            log.error("Problem with database " + str(e))
+            return None
+
 
 class DwDDataHandler(PostgresHandler):
     """
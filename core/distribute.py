@@ -123,12 +123,24 @@ class EmailDistributor:
 # Util methods
 # ----------------------------------------------------------------------------------------------------------------
 
-def create_message(subject: str, content: str, attachment_paths=None) -> MIMEMultipart:
+def _attachment_part(file_name: str, attachment_content: bytes) -> MIMEBase:
+    part = MIMEBase("application", "octet-stream")
+    part.set_payload(attachment_content)
+    encoders.encode_base64(part)
+    part.add_header("Content-Disposition", f"attachment; filename= {file_name}")
+    return part
+
+
+def create_message(subject: str, content: str, attachment_paths=None,
+                   attachments: Optional[List[Tuple[str, bytes]]] = None) -> MIMEMultipart:
     """
     from and to email have to be added by the receiving logic.
+    attachments are tuples of file name and content which are attached without reading a file.
     """
     if attachment_paths is None:
         attachment_paths = []
+    if attachments is None:
+        attachments = []
     message = MIMEMultipart()
     message["Subject"] = subject
 
@@ -141,17 +153,15 @@ def create_message(subject: str, content: str, attachment_paths=None) -> MIMEMul
             attachment.close()
 
             file_name = os.path.basename(attachment_path)
-
-            part = MIMEBase("application", "octet-stream")
-            part.set_payload(attachment_content)
-            encoders.encode_base64(part)
-            part.add_header("Content-Disposition", f"attachment; filename= {file_name}")
-            message.attach(part)
+            message.attach(_attachment_part(file_name, attachment_content))
 
         except FileNotFoundError:
             log.warning(f"No file to attach found in {attachment_path}")
             continue
 
+    for file_name, attachment_content in attachments:
+        message.attach(_attachment_part(file_name, attachment_content))
+
     return message
 
 
@@ -225,7 +235,8 @@ def _send_home_temp_vis_email(df, google_df, dwd_df, ulmde_df, wettercom_df, pat
         _ = distributor.send_email(from_email=from_email, to_email=receiver, message=msg)
 
 
-def send_picture_email(picture_path, df, receiver) -> None:
+def send_picture_email(picture_path, df, receiver, picture: Optional[Tuple[str, bytes]] = None) -> None:
+    """picture is a tuple of file name and content, which is attached instead of the file in picture_path."""
     today = datetime.now().strftime(PICTURE_NAME_FORMAT)
     log.info(f"Sending picture to {receiver}")
     subject = f"BaseTemp v{core_config()['version']} Live Picture of {today}"
@@ -235,7 +246,10 @@ def send_picture_email(picture_path, df, receiver) -> None:
     if email_config:
         from_email = email_config["from_email"]
         distributor = EmailDistributor(email_config)
-        msg = create_message(subject=subject, content=message, attachment_paths=[picture_path])
+        if picture is None:
+            msg = create_message(subject=subject, content=message, attachment_paths=[picture_path])
+        else:
+            msg = create_message(subject=subject, content=message, attachments=[picture])
         msg["From"] = from_email
         msg["To"] = receiver
 
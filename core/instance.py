@@ -2,8 +2,10 @@ from configparser import SectionProxy
 
 from core.core_log import get_logger
 import time
+from concurrent.futures import Future
 from datetime import datetime
-from typing import List, Optional, Tuple, Type
+from threading import Thread
+from typing import Dict, List, Optional, Tuple, Type
 from pathlib import Path
 
 import schedule
@@ -11,15 +13,26 @@ import schedule
 from abc import ABC, abstractmethod
 from core.command import CommandService
 from core.monitoring import PrometheusManager
-from core.sensors.dht import SUPPORTED_SENSORS
-from core.core_configuration import database_config, core_config, distribution_config, get_sensor_type, basetemp_config, \
-    update_active_schedule, PICTURE_NAME_FORMAT, get_file_manager, FileManager
+from core.sensors.dht import SensorDefinition, get_sensor_definitions
+from core.sensors.camera import get_camera_session, get_capture_queue
+from core.sensors.filtering import ReadingFilter, create_filters
+from core.sensors.reader import get_sensor_reader
+from core.sensors.sampler import SensorSampler, create_samplers, start_samplers
+from core.core_configuration import database_config, core_config, distribution_config, basetemp_config, \
+    update_active_schedule, PICTURE_NAME_FORMAT, get_file_manager, FileManager, camera_config, storage_config
 
 from core.database import DwDDataHandler, GoogleDataHandler, UlmDeHandler, SensorDataHandler, WetterComHandler
 
 from core.distribute import send_picture_email, send_visualization_email, send_heat_warning_email
-from core.plotting import PlotData, SupportedDataFrames, draw_complete_summary
-from core.usage_util import init_database, get_data_for_plotting, retrieve_and_save_sensor_data, retrieve_temp_data, take_picture
+from core.catalog import PICTURE_COMMANDED, PICTURE_TIMED, catalog_file, get_catalog
+from core.change_detection import get_change_detector
+from core.plotting import PlotData, SupportedDataFrames
+from core.previews import get_preview_pyramid
+from core.rendering import RenderCache, RenderPool, get_render_cache, get_render_pool, get_report_ranges
+from core.startup import startup_report
+from core.storage import get_storage_manager
+from core.usage_util import init_database, get_data_for_plotting, retrieve_and_save_sensor_data, retrieve_temp_data, \
+    take_picture, take_picture_to_memory, email_picture, archive_picture
 from core.util import require_web_access
 
 log = get_logger(__name__)
@@ -48,6 +61,12 @@ class CoreSkeleton(ABC):
         self.fm: FileManager = get_file_manager()
         self.scheduler = schedule.Scheduler()
         self.prometheus_publisher:PrometheusManager = PrometheusManager()
+        self.render_pool: RenderPool = get_render_pool()
+        self.render_cache: RenderCache = get_render_cache()
+        self.sensors: List[SensorDefinition] = []
+        self.samplers: Dict[str, SensorSampler] = {}
+        self.filters: Dict[str, ReadingFilter] = {}
+        self._init_sensors()
 
     ## --- Initialization Part ---
     def init(self) -> None:
@@ -59,15 +78,29 @@ class CoreSkeleton(ABC):
     def start(self, with_init=True) -> None:
         if with_init:
             self.init()
-        self._methods_after_init()
+        with startup_report.phase("methods after init"):
+            self._methods_after_init()
         time.sleep(1)
-        self.run_received_commands()
+        with startup_report.phase("received commands"):
+            self.run_received_commands()
+        self._report_startup()
         log.info("entering main loop")
         self.main_loop()
         return None
 
     def shutdown(self) -> None:
         self.scheduler.clear()
+        for sampler in self.samplers.values():
+            sampler.stop()
+        if any(sampler.aggregator is not None for sampler in self.samplers.values()):
+            # the open and pending buckets would be lost otherwise
+            retrieve_and_save_sensor_data(database_config(), self.sensors, self.samplers, self.filters, flush=True)
+        if get_sensor_reader() is not None:
+            get_sensor_reader().stop()
+        get_capture_queue().stop()
+        if get_preview_pyramid() is not None:
+            get_preview_pyramid().close()
+        self.render_pool.close()
         return None
 
     def generate_metadata(self) -> Optional[dict]:
@@ -80,10 +113,28 @@ class CoreSkeleton(ABC):
         return {"instance_name": self.instance_name, v:cfg[v], dp: cfg[dp], sp:cfg[sp], st:cfg[st], cmd_prefixes:cfg[cmd_prefixes]}
 
     def _init_components(self) -> None:
-        self._init_database()
+        with startup_report.phase("init database"):
+            self._init_database()
+        self._init_sampler()
         self._add_commands()
         self._setup_scheduling()
 
+    def _report_startup(self) -> None:
+        budget_s = core_config().getfloat('startup_budget_s', 0)
+        total_s = startup_report.log_report(budget_s)
+        self.prometheus_publisher.publish_startup_report(startup_report.phases, total_s)
+
+    def _init_sensors(self) -> None:
+        self.sensors = get_sensor_definitions()
+        self.filters = create_filters(self.sensors)
+
+    def _init_sampler(self) -> None:
+        if get_sensor_reader() is not None:
+            # started before the first read, so the first measurement does not wait for the process
+            get_sensor_reader().start()
+        self.samplers = create_samplers(self.sensors, self.filters)
+        start_samplers(self.samplers)
+
     def _init_database(self):
         init_database(SensorDataHandler, database_config(), SupportedDataFrames.Main.table_name)
 
@@ -132,10 +183,24 @@ class CoreSkeleton(ABC):
         pass
 
     def _create_visualization(self, mode: str, email_receiver: Optional[str] = None) -> None:
+        # Loading and rendering runs besides the main loop, so the scheduler keeps sampling while plots are rendered
+        Thread(target=self._render_and_send_visualization, args=(mode, email_receiver), daemon=True).start()
+
+    def _render_and_send_visualization(self, mode: str, email_receiver: Optional[str] = None) -> None:
         log.info(f"{mode}: Creating Measurement Data Visualization")
         plots, merge_subplots_for = self._get_visualization_data()
         save_path = self.fm.plot_file_name(mode.lower() == "timed")
-        draw_complete_summary(plots, merge_subplots_for=merge_subplots_for, save_path=save_path)
+        report_ranges = get_report_ranges()
+        report = "complete_summary" if len(report_ranges) == 0 else f"ranges:{','.join(r.name for r in report_ranges)}"
+        cache_key = self.render_cache.key_for(plots, merge_subplots_for, report=report)
+        if self.render_cache.restore(cache_key, save_path):
+            log.info(f"{mode}: No new data since last visualization, reusing it")
+        elif self.render_pool.render_summary(plots, merge_subplots_for, save_path, report_ranges) is None:
+            log.error(f"{mode}: Creating Measurement Data Visualization failed")
+            return None
+        else:
+            self.render_cache.store(cache_key, save_path)
+        catalog_file(save_path)
         log.info(f"{mode}: Done")
         self._send_visualization_email(plots, save_path, email_receiver)
 
@@ -145,21 +210,36 @@ class CoreSkeleton(ABC):
     def create_visualization_timed(self) -> None:
         self._create_visualization(mode="Timed")
 
+    @property
+    def primary_sensor(self) -> SensorDefinition:
+        return self.sensors[0]
+
     def collect_data(self) -> Optional[Tuple]:
-        is_dht11 = get_sensor_type(SUPPORTED_SENSORS) == SUPPORTED_SENSORS[0]
-        sensor_pin = int(core_config()["sensor_pin"])
-        out = retrieve_temp_data(sensor_pin, is_dht11)
+        """Returns temperature and humidity of the primary sensor."""
+        sampler = self.samplers.get(self.primary_sensor.sensor_id)
+        if sampler is not None:
+            # latest reading from memory, the sampler owns the sensor
+            latest = sampler.latest()
+            return (None, None) if latest is None else latest[1:]
+        out = retrieve_temp_data(self.primary_sensor.pin, self.primary_sensor.is_dht11, self.primary_sensor)
         log.info("Done")
         return out
 
     def collect_and_save_to_db(self) -> Optional[Tuple]:
-        is_dht11 = get_sensor_type(SUPPORTED_SENSORS) == SUPPORTED_SENSORS[0]
         auth = database_config()
-        sensor_pin = int(core_config()["sensor_pin"])
-        out = retrieve_and_save_sensor_data(auth, sensor_pin, is_dht11)
+        out = retrieve_and_save_sensor_data(auth, self.sensors, self.samplers, self.filters)
         log.info("Done")
         return out
 
+    def _schedule_storage_maintenance(self, scheduler: schedule.Scheduler, tag: Optional[str] = None) -> None:
+        """Schedules the daily storage maintenance if the optional section storage is configured."""
+        if get_storage_manager() is None:
+            return None
+        at = storage_config().get('maintenance_time', '04:30')
+        job = scheduler.every().day.at(at).do(lambda: get_storage_manager().start())
+        if tag is not None:
+            job.tag(tag)
+
 
 class HomeTemp(CoreSkeleton):
 
@@ -176,6 +256,7 @@ class HomeTemp(CoreSkeleton):
         self.scheduler.every(10).minutes.do(lambda: self.collect_and_save_to_db())
         self.scheduler.every().day.at("06:00").do(lambda: self.create_visualization_timed())
         self.scheduler.every(10).minutes.do(lambda: self.run_received_commands())
+        self._schedule_storage_maintenance(self.scheduler)
         pass
 
     def _methods_after_init(self) -> None:
@@ -186,7 +267,8 @@ class HomeTemp(CoreSkeleton):
 
     def _get_visualization_data(self) -> Tuple[List[PlotData], List[PlotData]]:
         auth = database_config()
-        df = get_data_for_plotting(auth, SensorDataHandler, SupportedDataFrames.Main)
+        df = get_data_for_plotting(auth, SensorDataHandler, SupportedDataFrames.Main, self.primary_sensor.sensor_id,
+                                   primary=True)
         google_df = get_data_for_plotting(auth, GoogleDataHandler, SupportedDataFrames.GOOGLE_COM)
         dwd_df = get_data_for_plotting(auth, DwDDataHandler, SupportedDataFrames.DWD_DE)
         wettercom_df = get_data_for_plotting(auth, WetterComHandler, SupportedDataFrames.WETTER_COM)
@@ -260,6 +342,7 @@ class BaseTemp(CoreSkeleton):
         new_scheduler = schedule.Scheduler()
         new_scheduler.every(10).minutes.do(lambda: self.run_received_commands()).tag(self.active_schedule)
         new_scheduler.every(10).minutes.do(lambda: self.collect_and_save_to_db()).tag(self.active_schedule)
+        self._schedule_storage_maintenance(new_scheduler, self.active_schedule)
         if self.active_schedule == 'common':
             new_scheduler.every().day.at("08:00").do(lambda: self.create_visualization_timed()).tag(
                 self.active_schedule)
@@ -310,6 +393,11 @@ class BaseTemp(CoreSkeleton):
 
     def _methods_after_init(self) -> None:
         super()._methods_after_init()
+        if get_camera_session() is not None:
+            get_camera_session().warm_up()
+        if get_preview_pyramid() is not None:
+            pictures = [str(e.path) for kind in [PICTURE_TIMED, PICTURE_COMMANDED] for e in get_catalog().query(kind)]
+            get_preview_pyramid().start_backfill(pictures)
         self.create_visualization_timed()
         pass
 
@@ -317,7 +405,8 @@ class BaseTemp(CoreSkeleton):
 
     def _get_visualization_data(self) -> Tuple[List[PlotData], List[PlotData]]:
         auth = database_config()
-        df = get_data_for_plotting(auth, SensorDataHandler, SupportedDataFrames.Main)
+        df = get_data_for_plotting(auth, SensorDataHandler, SupportedDataFrames.Main, self.primary_sensor.sensor_id,
+                                   primary=True)
         return [PlotData(SupportedDataFrames.Main, df, True)], []
 
     def _send_visualization_email(self, data: List[PlotData], save_path: str,
@@ -327,27 +416,87 @@ class BaseTemp(CoreSkeleton):
     ## --- Instance Specific Features Part ---
 
     def take_picture_timed(self) -> None:
+        # pictures are taken by the worker of the capture queue, so the scheduler does not wait for the camera
+        get_capture_queue().submit("timed", self._take_picture_timed)
+
+    def take_picture_commanded(self, commander: Optional[str]) -> None:
+        future = get_capture_queue().submit("commanded", self._take_picture_commanded)
+        if future is not None:
+            # the callback runs in the camera worker, so data loading and email must not block the next capture
+            future.add_done_callback(lambda f: Thread(target=self._deliver_picture_commanded, args=(f, commander),
+                                                      name="picture-delivery", daemon=True).start())
+
+    def _publish_picture(self, picture_path: str, timed: bool, content: Optional[bytes] = None) -> None:
+        """Publishes the picture and, once its previews are created, the variant for the dashboard."""
+        self.prometheus_publisher.publish_latest_picture_name(Path(picture_path).name, timed)
+        pyramid = get_preview_pyramid()
+        if pyramid is None:
+            # the dashboard shows the picture itself
+            pictures_path = self.fm.base_path / FileManager.TIMED_PICTURES
+            self.prometheus_publisher.publish_latest_preview_name(
+                str(Path(picture_path).resolve().relative_to(pictures_path)), timed)
+            return None
+        camera_cfg = camera_config()
+        min_width = 1280 if camera_cfg is None else camera_cfg.getint('preview_dashboard_width', 1280)
+        publish = lambda _: self.prometheus_publisher.publish_latest_preview_name(
+            pyramid.relative_name(pyramid.best_variant(picture_path, min_width)), timed)
+        future = pyramid.submit(picture_path, content)
+        if future is None:
+            publish(None)
+        else:
+            future.add_done_callback(publish)
+
+    def _archive_and_publish(self, picture_path: str, timed: bool, content: bytes) -> None:
+        """Archives the picture in the background and publishes it once it is written."""
+        archive_picture(picture_path, content).add_done_callback(
+            lambda f: self._publish_picture(picture_path, timed, content) if f.result() else None)
+
+    def _take_picture_timed(self) -> bool:
         log.info("Timed: Taking picture")
         name, encoding = self.fm.picture_file_name(True)
+        detector = get_change_detector()
+        if detector is not None:
+            # the picture is compared in memory and only archived if it changed
+            picture = take_picture_to_memory(encoding)
+            if picture is None:
+                log.info("Timed: Taking picture was not successful")
+                return False
+            stored, decision, _ = detector.check(picture)
+            if stored:
+                self._archive_and_publish(f"{name}.{encoding}", True, picture)
+            log.info(f"Timed: Taking picture done, {decision}")
+            return True
         if take_picture(name, encoding):
             log.info("Timed: Taking picture done")
-            self.prometheus_publisher.publish_latest_picture_name(Path(f"{name}.{encoding}").name, True)
-        else:
-            log.info("Timed: Taking picture was not successful")
+            self._publish_picture(f"{name}.{encoding}", True)
+            return True
+        log.info("Timed: Taking picture was not successful")
+        return False
 
-    def take_picture_commanded(self, commander: Optional[str]) -> None:
+    def _take_picture_commanded(self) -> Optional[Tuple[str, bytes]]:
+        """Capture job of a commanded picture. Returns path and content of the picture or None."""
         log.info("Command: Taking picture")
         name, encoding = self.fm.picture_file_name(False)
-        if take_picture(name, encoding=encoding):
-            log.info("Command: Taking picture done")
-            self.prometheus_publisher.publish_latest_picture_name(Path(f"{name}.{encoding}").name, False)
-            if commander is not None:
-                plots, _ = self._get_visualization_data()
-                sensor_data = plots[0].data
-                send_picture_email(picture_path=f"{name}.{encoding}", df=sensor_data, receiver=commander)
-            log.info("Command: Done")
-        else:
+        picture = take_picture_to_memory(encoding)
+        return None if picture is None else (f"{name}.{encoding}", picture)
+
+    def _deliver_picture_commanded(self, future: Future, commander: Optional[str]) -> None:
+        """Archives and publishes the captured picture and emails it from memory to the commander."""
+        result = None if future.cancelled() else future.result()
+        if result is None:
             log.info("Command: Taking picture was not successful")
+            return None
+        log.info("Command: Taking picture done")
+        picture_path, picture = result
+        self._archive_and_publish(picture_path, False, picture)
+        if commander is not None:
+            plots, _ = self._get_visualization_data()
+            sensor_data = plots[0].data
+            camera_cfg = camera_config()
+            max_width = 0 if camera_cfg is None else camera_cfg.getint('email_max_width', 0)
+            send_picture_email(picture_path=picture_path, df=sensor_data, receiver=commander,
+                               picture=email_picture(Path(picture_path).name, picture, max_width))
+        log.info("Command: Done")
 
     def collect_and_save_to_db(self) -> Optional[Tuple]:
         t = super().collect_and_save_to_db()
@@ -29,14 +29,30 @@ class PrometheusManager:
     USAGE_CPU:str = "cpu_usage_percent"
     USAGE_RAM:str = "ram_usage_percent"
     USAGE_DISK:str = "disk_usage_percent"
+    STORAGE_USED:str = "storage_used_bytes"
+    STORAGE_RECLAIMED:str = "storage_reclaimed_bytes_total"
     SENT_MAILS:str = "emails_sent_total"
+    STARTUP_TIME:str = "startup_duration_seconds"
     #HomeTemp
     ROOM_TEMP:str = "temperature_room"
     ROOM_TEMP_READ_FAILS:str = "sensor_read_errors_total"
     ROOM_HUM:str ="humidity_room"
+    SENSOR_TEMP:str = "temperature_sensor"
+    SENSOR_HUM:str = "humidity_sensor"
+    SENSOR_ATTEMPT_TIME:str = "sensor_read_attempt_duration_seconds"
+    SENSOR_READ_TIME:str = "sensor_read_duration_seconds"
+    SENSOR_ERRORS:str = "sensor_read_errors_by_code_total"
+    SENSOR_PULL_UPS:str = "sensor_pull_ups"
+    SENSOR_RETRIES:str = "sensor_retries_per_success"
     #BaseTemp
     LATEST_PICTURE_TIMED:str = "latest_picture_timed"
     LATEST_PICTURE_COMMANDED:str = "latest_picture_commanded"
+    LATEST_PREVIEW_TIMED:str = "latest_preview_timed"
+    LATEST_PREVIEW_COMMANDED:str = "latest_preview_commanded"
+    PICTURE_CAPTURE_TIME:str = "picture_capture_duration_seconds"
+    PICTURE_CAPTURE_JOBS:str = "picture_capture_jobs_total"
+    PICTURE_CHANGE_SCORE:str = "picture_change_score"
+    PICTURE_CHANGE_DECISIONS:str = "picture_change_decisions_total"
     #Fetcher
     ALL_WEATHER_TIME:str = "weather_fetch_duration_seconds"
     All_OUTSIDE_TEMP:str = "current_weather_data"
@@ -63,6 +79,13 @@ class PrometheusManager:
         self.start_time = time.time()
         self.label_instance = ['instance']
         self.label_fetcher_for_instance =   self.label_instance  + ['fetcher_id']
+        self.label_phase_for_instance = self.label_instance + ['phase']
+        self.label_sensor_for_instance = self.label_instance + ['sensor_id']
+        self.label_error_for_sensor = self.label_sensor_for_instance + ['error']
+        self.label_capture_for_instance = self.label_instance + ['kind', 'result']
+        self.label_decision_for_instance = self.label_instance + ['decision']
+        self.label_kind_for_instance = self.label_instance + ['kind']
+        self.label_step_for_instance = self.label_instance + ['step']
 
         self.metrics: Dict[str, MetricWrapperBase] = {
             # General
@@ -72,14 +95,52 @@ class PrometheusManager:
             self.USAGE_CPU: Gauge(self.USAGE_CPU, "Current CPU usage in percent", self.label_instance),
             self.USAGE_RAM: Gauge(self.USAGE_RAM, "Current RAM usage in percent", self.label_instance),
             self.USAGE_DISK: Gauge(self.USAGE_DISK, "Current Disk usage in percent", self.label_instance),
+            # pictures and plots by kind of the catalog, see core.storage
+            self.STORAGE_USED: Gauge(self.STORAGE_USED, "Bytes used by pictures and plots", self.label_kind_for_instance),
+            self.STORAGE_RECLAIMED: Counter(self.STORAGE_RECLAIMED, "Bytes reclaimed by storage maintenance",
+                                            self.label_step_for_instance),
             self.SENT_MAILS: Counter(self.SENT_MAILS, "Number of sent emails", self.label_instance),
+            self.STARTUP_TIME: Gauge(self.STARTUP_TIME, "Duration of startup phases in seconds", self.label_phase_for_instance),
             # HomeTemp
             self.ROOM_TEMP: Gauge(self.ROOM_TEMP, 'Current room temperature', self.label_instance),
             self.ROOM_TEMP_READ_FAILS: Counter(self.ROOM_TEMP_READ_FAILS, 'Number of failed sensor readings', self.label_instance),
             self.ROOM_HUM: Gauge(self.ROOM_HUM, 'Current room humidity', self.label_instance),
+            self.SENSOR_TEMP: Gauge(self.SENSOR_TEMP, 'Current temperature per sensor', self.label_sensor_for_instance),
+            self.SENSOR_HUM: Gauge(self.SENSOR_HUM, 'Current humidity per sensor', self.label_sensor_for_instance),
+            # a single attempt is the start signal (70ms) plus the capture of the answer (5ms)
+            self.SENSOR_ATTEMPT_TIME: Histogram(self.SENSOR_ATTEMPT_TIME, 'Duration of a single sensor read attempt',
+                                                self.label_error_for_sensor,
+                                                buckets=(0.075, 0.08, 0.09, 0.1, 0.125, 0.15, 0.25, 0.5, 1, 5)),
+            # a read includes the waits of the retry policy between attempts
+            self.SENSOR_READ_TIME: Histogram(self.SENSOR_READ_TIME, 'Duration of a successful sensor read including retries',
+                                             self.label_sensor_for_instance,
+                                             buckets=(0.1, 0.25, 0.5, 1, 2, 3, 5, 10, 20, 30)),
+            self.SENSOR_ERRORS: Counter(self.SENSOR_ERRORS, 'Number of failed sensor read attempts by error',
+                                        self.label_error_for_sensor),
+            # 0 pull ups indicate wiring or power problems, a few missing ones indicate a delayed polling loop
+            self.SENSOR_PULL_UPS: Histogram(self.SENSOR_PULL_UPS, 'Number of data pull ups seen in a sensor answer',
+                                            self.label_sensor_for_instance,
+                                            buckets=(0, 1, 10, 20, 30, 35, 38, 39, 40, 41)),
+            self.SENSOR_RETRIES: Histogram(self.SENSOR_RETRIES, 'Number of failed attempts before a successful read',
+                                           self.label_sensor_for_instance, buckets=(0, 1, 2, 3, 5, 8, 13)),
             # BaseTemp
             self.LATEST_PICTURE_TIMED: Info(self.LATEST_PICTURE_TIMED, "Filename of latest timed picture", self.label_instance),
             self.LATEST_PICTURE_COMMANDED: Info(self.LATEST_PICTURE_COMMANDED, "Filename of latest commandedf picture", self.label_instance),
+            # path relative to the pictures folder of the smallest variant which fits the dashboard, see core.previews
+            self.LATEST_PREVIEW_TIMED: Info(self.LATEST_PREVIEW_TIMED, "Preview of latest timed picture", self.label_instance),
+            self.LATEST_PREVIEW_COMMANDED: Info(self.LATEST_PREVIEW_COMMANDED, "Preview of latest commanded picture", self.label_instance),
+            self.PICTURE_CAPTURE_TIME: Histogram(self.PICTURE_CAPTURE_TIME, 'Duration of a picture capture job',
+                                                 self.label_capture_for_instance,
+                                                 buckets=(0.5, 1, 2, 3, 5, 10, 20, 30, 60, 120)),
+            # results are success, failure, cancelled and rejected if the queue was full
+            self.PICTURE_CAPTURE_JOBS: Counter(self.PICTURE_CAPTURE_JOBS, 'Number of picture capture jobs by result',
+                                               self.label_capture_for_instance),
+            # share of changed pixels compared to the last stored picture, see core.change_detection
+            self.PICTURE_CHANGE_SCORE: Gauge(self.PICTURE_CHANGE_SCORE, 'Change score of the latest timed picture',
+                                             self.label_instance),
+            self.PICTURE_CHANGE_DECISIONS: Counter(self.PICTURE_CHANGE_DECISIONS,
+                                                   'Number of timed pictures by change decision',
+                                                   self.label_decision_for_instance),
             # Weather
             # TODO: Summary instead of histogram
             self.ALL_WEATHER_TIME: Histogram(self.ALL_WEATHER_TIME, 'Time to fetch online weather data', self.label_instance),
@@ -122,6 +183,30 @@ class PrometheusManager:
             metric.info({"latest_picture_name": latest_picture_name})
         return None
 
+    def publish_latest_preview_name(self, latest_preview_name:str, timed:bool) -> None:
+        metric = self._get_instance_metric(self.LATEST_PREVIEW_TIMED if timed else self.LATEST_PREVIEW_COMMANDED)
+        if metric is not None and latest_preview_name is not None:
+            metric.info({"latest_preview_name": latest_preview_name})
+        return None
+
+    def observe_picture_capture(self, kind: str, result: str, duration: Optional[float] = None) -> None:
+        """Counts a capture job by result. Jobs which ran are observed with their duration."""
+        if kind is None or result is None:
+            log.warning("Unable to observe picture capture because at least one parameter is None")
+            return None
+        self.__get_metric(self.PICTURE_CAPTURE_JOBS).labels(self.instance_name, kind, result).inc()
+        if duration is not None:
+            self.__get_metric(self.PICTURE_CAPTURE_TIME).labels(self.instance_name, kind, result).observe(duration)
+
+    def observe_picture_change(self, decision: str, score: Optional[float]) -> None:
+        """Counts the decision of the change detection. The score is None if there was no picture to compare with."""
+        if decision is None:
+            log.warning("Unable to observe picture change because decision is None")
+            return None
+        self.__get_metric(self.PICTURE_CHANGE_DECISIONS).labels(self.instance_name, decision).inc()
+        if score is not None:
+            self.__get_metric(self.PICTURE_CHANGE_SCORE).labels(self.instance_name).set(score)
+
     def publish_metdata(self, meta_data:dict) -> None:
         metric = self._get_instance_metric(self.META)
         if metric is not None and meta_data is not None:
@@ -130,6 +215,15 @@ class PrometheusManager:
             metric.info(meta_data)
         return None
 
+    def publish_startup_report(self, phases: List[tuple], total_s: float) -> None:
+        m = self.__get_metric(self.STARTUP_TIME)
+        if m is None:
+            return None
+        for phase, duration in phases:
+            m.labels(self.instance_name, phase).set(duration)
+        m.labels(self.instance_name, "total").set(total_s)
+        return None
+
     def update_general_system_metrics(self) -> None:
         """Update uptime gauge."""
         metric = self._get_instance_metric(self.UPTIME)
@@ -146,17 +240,43 @@ class PrometheusManager:
         self._get_instance_metric(self.USAGE_RAM).set(psutil.virtual_memory().percent)
         self._get_instance_metric(self.USAGE_DISK).set(psutil.disk_usage('/').percent)
 
-    def measure_room_values(self, room_temp:float, humidity:float) -> None:
+    def measure_room_values(self, room_temp:float, humidity:float, sensor_id: Optional[str] = None,
+                            primary: bool = True) -> None:
+        """Room values are the values of the primary sensor. With a sensor id, the values are published per sensor too."""
         if room_temp is not None and humidity is not None:
-            m_temp = self._get_instance_metric(self.ROOM_TEMP)
-            m_hum = self._get_instance_metric(self.ROOM_HUM)
-            if m_temp is not None and m_hum is not None:
-                m_temp.set(room_temp)
-                m_hum.set(humidity)
+            if primary:
+                m_temp = self._get_instance_metric(self.ROOM_TEMP)
+                m_hum = self._get_instance_metric(self.ROOM_HUM)
+                if m_temp is not None and m_hum is not None:
+                    m_temp.set(room_temp)
+                    m_hum.set(humidity)
+            if sensor_id is not None:
+                self.__get_metric(self.SENSOR_TEMP).labels(self.instance_name, sensor_id).set(room_temp)
+                self.__get_metric(self.SENSOR_HUM).labels(self.instance_name, sensor_id).set(humidity)
         else:
             log.warning("Unable to publish room temp and humidtiy because at least one is None")
         return None 
     
+    def observe_sensor_attempt(self, sensor_id: str, error: str, pull_ups: int, duration: float) -> None:
+        """Observes a single read attempt, error is the name of the DHTResult error code, i.e., none on success."""
+        if sensor_id is None or error is None or duration is None:
+            log.warning("Unable to observe sensor attempt because at least one parameter is None")
+            return None
+        self.__get_metric(self.SENSOR_ATTEMPT_TIME).labels(self.instance_name, sensor_id, error).observe(duration)
+        self.__get_metric(self.SENSOR_PULL_UPS).labels(self.instance_name, sensor_id).observe(pull_ups)
+        if error != "none":
+            self.__get_metric(self.SENSOR_ERRORS).labels(self.instance_name, sensor_id, error).inc()
+        return None
+
+    def observe_sensor_read(self, sensor_id: str, duration: float, retries: int) -> None:
+        """Observes a successful read including all retries."""
+        if sensor_id is None or duration is None:
+            log.warning("Unable to observe sensor read because at least one parameter is None")
+            return None
+        self.__get_metric(self.SENSOR_READ_TIME).labels(self.instance_name, sensor_id).observe(duration)
+        self.__get_metric(self.SENSOR_RETRIES).labels(self.instance_name, sensor_id).observe(retries)
+        return None
+
     def measure_outside_temperature(self, fechter_id:str, temperature:float) -> None:
         if fechter_id is not None and temperature is not None:
             m_temp = self._get_fetcher_metric(self.All_OUTSIDE_TEMP, fechter_id)
@@ -174,6 +294,9 @@ class PrometheusManager:
         if m is not None:
             m.observe(duration)
 
+    def set_storage_used(self, kind: str, used_bytes: int) -> None:
+        self.__get_metric(self.STORAGE_USED).labels(self.instance_name, kind).set(used_bytes)
+
     def set_web_available(self, available: bool) -> None:
         metric = self._get_instance_metric(self.WEB_ACCESS)
         if metric is not None:
@@ -187,6 +310,9 @@ class PrometheusManager:
             metric.inc()
         return None
     
+    def inc_storage_reclaimed(self, step: str, reclaimed_bytes: int) -> None:
+        self.__get_metric(self.STORAGE_RECLAIMED).labels(self.instance_name, step).inc(max(0, reclaimed_bytes))
+
     def inc_sent_email(self) -> None:
         metric = self._get_instance_metric(self.SENT_MAILS)
         if metric is not None:
@@ -1,16 +1,22 @@
+from __future__ import annotations
+
 import re
 from datetime import datetime, timedelta
 from enum import Enum
-from typing import Callable, Tuple, List, Optional
-
-import matplotlib.pyplot as plt
-import numpy as np
-import pandas as pd
-import seaborn as sns
-from matplotlib.axes import Axes
+from typing import Callable, Tuple, List, Optional, TYPE_CHECKING
 
 from core.core_log import get_logger
 from core.database import TIME_FORMAT
+from core.startup import lazy_import
+
+if TYPE_CHECKING:
+    from matplotlib.axes import Axes
+
+plt = lazy_import("matplotlib.pyplot")
+backend_pdf = lazy_import("matplotlib.backends.backend_pdf")
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+sns = lazy_import("seaborn")
 
 log = get_logger(__name__)
 
@@ -27,6 +33,8 @@ log = get_logger(__name__)
 # - Use DefaultPlotCategory.MERGED for lineplots with merged subplots. Currently, only supports temperature!
 # - Use DefaultPlotCategory.MERGED24 for 24h-lineplots with merged subplots. Currently, only supports temperature!
 # - Use DefaultPlotCategory for combining DefaultPlotCategory with the main plot parameter configuration
+# - Use DefaultPlotCategory.AGGREGATED for min/mean/max lineplots of a ReportRange, e.g., the last 7 days. The data is
+#   bucketed to at most MAX_BUCKETS_PER_PAGE buckets, so the cost of a page does not grow with the table size
 # ----------------------------------------------------------------------------------------------------------------
 
 
@@ -49,6 +57,11 @@ MINIMAL_MAIN = lambda title, ylabel, y: {"title": title, "xlabel": "Time", "ylab
 MINIMAL_MAIN_24 = lambda title, ylabel, y: {"title": title, "xlabel": "Time", "ylabel": ylabel, "label": "Home", "x": "timestamp", "y": y, "marker": "o", "markersize": 6}
 # @formatter:on
 
+# Bucket sizes for aggregated report pages from fine to coarse. A page uses the finest one with at most MAX_BUCKETS_PER_PAGE buckets
+BUCKET_FREQUENCIES = ["10min", "30min", "1h", "3h", "6h", "12h", "1D", "2D", "7D", "14D", "30D"]
+MAX_BUCKETS_PER_PAGE = 400
+
+
 class SupportedDataFrames(Enum):
     # enumIdx, name, temperature keys list of tuple (df key, plot label with None for default see _label) , humidity key, database table name
     Main = 1, "Room", [("room_temp", None)], "humidity", "sensor_data"
@@ -323,6 +336,53 @@ class DefaultPlotCategory:
 
         return fig, ax
 
+    @staticmethod
+    def AGGREGATED(selector: PlotDataSelector, plot_data: List[PlotData], merge_subplots_for: Optional[List[PlotData]],
+                   report_range: ReportRange, ax_in_subplot: Axes, main_cfg: dict) -> Axes:
+        """
+        Draws the bucketed mean of the main plot with its min/max as shaded band. For temperature, the outside
+        temperatures of merge_subplots_for are merged into one band, otherwise the mean of every inner plot is drawn.
+        """
+        is_humidity = selector in (PlotDataSelector.HUMIDITYALL, PlotDataSelector.HUMIDITY24)
+        main = DefaultPlotCategory._get_main(plot_data)
+        main_data = report_range.select(main.data)
+        freq = report_range.bucket_frequency(main_data)
+        main_key = main.support.humidity_key if is_humidity else main.support.get_temperature_keys()[0]
+        DefaultPlotCategory._plot_band(ax_in_subplot, aggregate_by_bucket(main_data, [main_key], freq), main_key,
+                                       main_cfg.get('label', 'Home'), main_cfg.get('color'))
+
+        inner_plots = [d for d in plot_data if not d.main]
+        if not is_humidity and merge_subplots_for:
+            outside = [report_range.select(p.get_temperatures(['timestamp'])).melt(id_vars='timestamp').drop(
+                columns='variable') for p in merge_subplots_for if not p.main and len(p.data) > 0]
+            if len(outside) > 0:
+                merged = aggregate_by_bucket(pd.concat(outside, ignore_index=True), ['value'], freq)
+                DefaultPlotCategory._plot_band(ax_in_subplot, merged, 'value', 'Outside', 'lightblue')
+            return ax_in_subplot
+
+        for inner_plot in inner_plots:
+            if is_humidity:
+                keys = [] if inner_plot.support.humidity_key is None else [(inner_plot.support.humidity_key, None)]
+            else:
+                keys = inner_plot.support.temperature_keys
+            for key, label in keys:
+                aggregated = aggregate_by_bucket(report_range.select(inner_plot.data), [key], freq)
+                if len(aggregated) == 0:
+                    log.info(f"Skipping empty INNER dataframe {inner_plot.support.display_name} for {report_range}")
+                    continue
+                ax_in_subplot.plot(aggregated['timestamp'], aggregated[f"{key}_mean"], alpha=0.6,
+                                   label=inner_plot.support._label(label))
+        return ax_in_subplot
+
+    @staticmethod
+    def _plot_band(ax: Axes, aggregated: pd.DataFrame, key: str, label: str, color: Optional[str] = None) -> None:
+        if len(aggregated) == 0:
+            log.info(f"Skipping empty aggregated data for {label}")
+            return None
+        line, = ax.plot(aggregated['timestamp'], aggregated[f"{key}_mean"], label=f"{label} Mean", color=color)
+        ax.fill_between(aggregated['timestamp'], aggregated[f"{key}_min"], aggregated[f"{key}_max"],
+                        color=line.get_color(), alpha=0.3, label=f"{label} Min/Max")
+
     @staticmethod
     def DISTINCT(selector: PlotDataSelector, plot_data: List[PlotData], ax_in_subplot: plt.Axes,
                  main_cfg: dict) -> plt.Axes:
@@ -358,6 +418,46 @@ class DefaultPlotCategory:
         return ax
 
 
+class ReportRange:
+    """Time range of an aggregated report page, e.g., 24h, 7d, 30d, 1y or all. The span is None for all data."""
+    _units = {"h": timedelta(hours=1), "d": timedelta(days=1), "w": timedelta(weeks=1), "m": timedelta(days=30),
+              "y": timedelta(days=365)}
+
+    def __init__(self, name: str, span: Optional[timedelta]):
+        self.name = name
+        self.span = span
+
+    def __repr__(self):
+        return f"ReportRange({self.name})"
+
+    @staticmethod
+    def parse(value: str) -> ReportRange:
+        value = value.strip().lower()
+        if value == "all":
+            return ReportRange(value, None)
+        match = re.fullmatch(r"(\d+)([hdwmy])", value)
+        if match is None:
+            raise ValueError(f"Unsupported report range '{value}'. Use e.g. 24h, 7d, 4w, 6m, 1y or all")
+        return ReportRange(value, int(match.group(1)) * ReportRange._units[match.group(2)])
+
+    def title(self) -> str:
+        return "Over Time" if self.span is None else f"Last {self.name}"
+
+    def select(self, data: pd.DataFrame, end: Optional[datetime] = None) -> pd.DataFrame:
+        if self.span is None or len(data) == 0:
+            return data
+        return data[data['timestamp'] >= (datetime.now() if end is None else end) - self.span]
+
+    def bucket_frequency(self, data: pd.DataFrame) -> str:
+        span = self.span
+        if span is None:
+            span = data['timestamp'].max() - data['timestamp'].min() if len(data) > 1 else timedelta(days=1)
+        for freq in BUCKET_FREQUENCIES:
+            if span / pd.Timedelta(freq) <= MAX_BUCKETS_PER_PAGE:
+                return freq
+        return BUCKET_FREQUENCIES[-1]
+
+
 class PlotsConfiguration:
     def __init__(self, category: Callable, main_plot: dict):
         self.category = category
@@ -392,20 +492,39 @@ def last_24h_df(_df: pd.DataFrame, start_time=None) -> pd.DataFrame:
     return _df[_df['timestamp'] >= last_24h]
 
 
+def aggregate_by_bucket(_df: pd.DataFrame, columns: List[str], freq: str) -> pd.DataFrame:
+    """Aggregates the columns to min, mean and max per time bucket, e.g., room_temp to room_temp_min, ... """
+    if len(_df) == 0:
+        return pd.DataFrame(columns=['timestamp'] + [f"{c}_{s}" for c in columns for s in ("min", "mean", "max")])
+    values = _df[columns].apply(pd.to_numeric, errors='coerce')
+    values.index = pd.DatetimeIndex(_df['timestamp'])
+    out = values.resample(freq).agg(['min', 'mean', 'max'])
+    out.columns = [f"{column}_{stat}" for column, stat in out.columns]
+    return out.dropna(how='all').reset_index(names='timestamp')
+
+
 def _direct_seaborn_only(main_plot: dict) -> dict:
     keys_to_remove = NOT_DIRECT_PARAMS
     return {key: main_plot[key] for key in {*main_plot} - set(keys_to_remove)}
 
 
-def _save_to_pdf(fig: plt.Figure, save_path: str):
-    if fig is None or save_path is None:
-        return
-    expected_file_type = ".pdf"
-    if not save_path.lower().endswith(expected_file_type):
-        log.info(f"Cannot save plot because file does not end with {expected_file_type}")
-        return
-    fig.savefig(save_path)
-    log.info(f"Saved plots to {save_path}")
+def _save_to_pdf(figures: List[plt.Figure], save_path: str):
+    """Saves the figures as pages of one pdf. The figures are closed, the render workers are reused."""
+    figures = [f for f in figures if f is not None]
+    try:
+        if len(figures) == 0 or save_path is None:
+            return
+        expected_file_type = ".pdf"
+        if not save_path.lower().endswith(expected_file_type):
+            log.info(f"Cannot save plots because file does not end with {expected_file_type}")
+            return
+        with backend_pdf.PdfPages(save_path) as pdf:
+            for fig in figures:
+                pdf.savefig(fig)
+        log.info(f"Saved {len(figures)} pages of plots to {save_path}")
+    finally:
+        for fig in figures:
+            plt.close(fig)
 
 
 def _create_lineplots(plot_configs: List[PlotsConfiguration],
@@ -472,5 +591,28 @@ def draw_complete_summary(plot_data: List[PlotData], merge_subplots_for: List[Pl
     ]
     # @formatter:on
     fig, _ = _create_lineplots(complete_summary, rows=2, cols=2, theme=custom_theme)
-    _save_to_pdf(fig, save_path)
+    _save_to_pdf([fig], save_path)
     return fig
+
+
+def draw_range_report(plot_data: List[PlotData], report_ranges: List[ReportRange],
+                      merge_subplots_for: List[PlotData] = None, save_path: str = None) -> List[plt.Figure]:
+    """Draws one page with temperature and humidity per report range and saves all pages into one pdf."""
+    figures = []
+    for report_range in report_ranges:
+        #@formatter:off
+        page = [
+            PlotsConfiguration(
+                lambda ax, main_plot_cfg, r=report_range: DefaultPlotCategory.AGGREGATED(PlotDataSelector.TEMPALL, plot_data, merge_subplots_for, r, ax, main_plot_cfg),
+                MINIMAL_MAIN(f"Temperature {report_range.title()}", "Temp (°C)", "room_temp")
+            ),
+            PlotsConfiguration(
+                lambda ax, main_plot_cfg, r=report_range: DefaultPlotCategory.AGGREGATED(PlotDataSelector.HUMIDITYALL, plot_data, merge_subplots_for, r, ax, main_plot_cfg),
+                MINIMAL_MAIN(f"Humidity {report_range.title()}", "Humidity (%)", "humidity") | {"color": "purple"}
+            )
+        ]
+        # @formatter:on
+        fig, _ = _create_lineplots(page, rows=2, cols=1, theme=custom_theme)
+        figures.append(fig)
+    _save_to_pdf(figures, save_path)
+    return figures
@@ -0,0 +1,196 @@
+import io
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from threading import BoundedSemaphore, Lock, Thread
+from typing import List, Optional
+
+from core import core_configuration
+from core.core_configuration import FileManager
+from core.core_log import get_logger
+from core.startup import lazy_import
+
+log = get_logger(__name__)
+Image = lazy_import("PIL.Image")
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Previews of the pictures. Pictures are stored in full resolution, but the Grafana panels show them a few hundred
+# pixels wide. The PreviewPyramid creates downscaled JPEG or WebP variants of every picture in the background.
+# - A picture is decoded once and scaled down from the largest to the smallest width, JPEGs are decoded at reduced size
+# - Previews are created by a bounded thread pool. If the pool is busy, submit() does not wait and the preview is
+#   created by the next backfill, so taking pictures is never blocked
+# - The backfill creates the missing previews of all timed and commanded pictures, e.g., after a restart. It uses at
+#   most half of the pending slots, so new pictures still get their previews during a long backfill
+# - best_variant() returns the smallest preview which is at least as wide as required, otherwise the picture itself
+# Previews are stored in pictures/previews/<width>/ with the folder structure of the pictures, e.g., commanded/.
+# They are enabled with previews in the optional section camera.
+# ----------------------------------------------------------------------------------------------------------------
+
+PREVIEW_FOLDER = "previews"
+# PIL formats of the supported preview encodings
+PREVIEW_FORMATS = {"jpg": "JPEG", "webp": "WEBP"}
+PICTURE_SUFFIXES = [".png", ".jpg", ".bmp", ".webp"]
+
+
+class PreviewPyramid:
+
+    def __init__(self, pictures_path: str, widths: Optional[List[int]] = None, encoding: str = "jpg",
+                 quality: int = 80, workers: int = 2, max_pending: int = 8) -> None:
+        if encoding not in PREVIEW_FORMATS:
+            log.error(f"Unsupported preview encoding {encoding}, using jpg")
+            encoding = "jpg"
+        self.pictures_path = Path(pictures_path)
+        self.widths = sorted({w for w in ([1280, 320] if widths is None else widths) if w > 0}, reverse=True)
+        self.encoding = encoding
+        self.quality = quality
+        self.workers = max(1, workers)
+        self._pending = BoundedSemaphore(max(1, max_pending))
+        self._backfill_pending = BoundedSemaphore(max(1, max_pending // 2))
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._closed = False
+        self._lock = Lock()
+
+    def __str__(self):
+        return f"PreviewPyramid[widths: {self.widths}, {self.encoding}, workers: {self.workers}]"
+
+    def preview_path(self, picture_path: str, width: int) -> Path:
+        relative = Path(picture_path).resolve().relative_to(self.pictures_path.resolve())
+        return self.pictures_path / PREVIEW_FOLDER / str(width) / relative.with_suffix(f".{self.encoding}")
+
+    def relative_name(self, path: Path) -> str:
+        """Returns the path relative to the pictures folder, e.g., for the Grafana panels."""
+        return str(Path(path).resolve().relative_to(self.pictures_path.resolve()))
+
+    def has_previews(self, picture_path: str) -> bool:
+        return all(self.preview_path(picture_path, w).exists() for w in self.widths)
+
+    def best_variant(self, picture_path: str, min_width: int) -> Path:
+        """Returns the smallest preview at least min_width wide or the picture if there is no such preview."""
+        for width in reversed(self.widths):
+            preview = self.preview_path(picture_path, width)
+            if width >= min_width and preview.exists():
+                return preview
+        return Path(picture_path)
+
+    def _release(self, backfill: bool) -> None:
+        self._pending.release()
+        if backfill:
+            self._backfill_pending.release()
+
+    def _submit(self, picture_path: str, content: Optional[bytes], backfill: bool = False) -> Optional[Future]:
+        """Submits the picture with acquired slots, which are released when done. Returns None after close()."""
+        with self._lock:
+            if self._closed:
+                self._release(backfill)
+                log.info(f"{self} is closed, no previews of {picture_path} are created")
+                return None
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="preview")
+            future = self._executor.submit(self.create, picture_path, content)
+        future.add_done_callback(lambda _: self._release(backfill))
+        return future
+
+    def submit(self, picture_path: str, content: Optional[bytes] = None) -> Optional[Future]:
+        """
+        Creates the previews in the background, from content if the encoded picture is still in memory. Returns the
+        future of the created previews or None if the pool is busy or closed.
+        """
+        if not self._pending.acquire(blocking=False):
+            log.warning(f"Preview pool is busy, previews of {picture_path} are created by the next backfill")
+            return None
+        return self._submit(picture_path, content)
+
+    def create(self, picture_path: str, content: Optional[bytes] = None) -> List[Path]:
+        """Creates the previews of the picture and returns their paths, an empty list if the picture is broken."""
+        created = []
+        try:
+            image = Image.open(io.BytesIO(content) if content is not None else picture_path)
+            if image.format == "JPEG":
+                # the decoder scales down by powers of two, which is much faster than decoding the full picture
+                image.draft("RGB", (self.widths[0], self.widths[0] * image.height // image.width))
+            image = image.convert("RGB")
+            for width in self.widths:
+                if image.width > width:
+                    image.thumbnail((width, width * image.height // image.width), reducing_gap=2.0)
+                path = self.preview_path(picture_path, width)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                # written next to the preview and renamed, so a reader never sees a partial preview
+                tmp_path = path.with_name(f".{path.name}.tmp")
+                image.save(tmp_path, format=PREVIEW_FORMATS[self.encoding], quality=self.quality)
+                os.replace(tmp_path, path)
+                created.append(path)
+            log.debug(f"Created previews of {picture_path}")
+        except Exception as e:
+            log.error(f"Error while creating previews of {picture_path}: {str(e)}")
+        return created
+
+    def missing(self, pictures: Optional[List[str]] = None) -> List[str]:
+        """
+        Returns the pictures without all previews. Without pictures, e.g., from the catalog, the timed and commanded
+        pictures are listed, oldest first.
+        """
+        if pictures is None:
+            folders = [self.pictures_path, self.pictures_path / Path(FileManager.COMMANDED_PICTURES).name]
+            paths = [p for folder in folders if folder.is_dir() for p in folder.iterdir()
+                     if p.suffix in PICTURE_SUFFIXES and p.is_file()]
+            pictures = [str(p) for p in sorted(paths, key=lambda p: p.name)]
+        return [p for p in pictures if not self.has_previews(p)]
+
+    def backfill(self, pictures: Optional[List[str]] = None) -> int:
+        """
+        Creates the missing previews and waits for free workers until close() is called. Returns the number of submitted
+        pictures.
+        """
+        submitted = 0
+        for picture in self.missing(pictures):
+            self._backfill_pending.acquire()
+            self._pending.acquire()
+            if self._submit(picture, None, backfill=True) is None:
+                break
+            submitted += 1
+        if submitted > 0:
+            log.info(f"Submitted previews of {submitted} pictures")
+        return submitted
+
+    def start_backfill(self, pictures: Optional[List[str]] = None) -> Thread:
+        thread = Thread(target=self.backfill, args=(pictures,), name="preview-backfill", daemon=True)
+        thread.start()
+        return thread
+
+    def close(self) -> None:
+        """Stops the backfill and waits for the submitted previews. Later submits are refused."""
+        with self._lock:
+            self._closed = True
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Static utility methods
+# ----------------------------------------------------------------------------------------------------------------
+
+_pyramid: Optional[PreviewPyramid] = None
+_pyramid_lock = Lock()
+
+
+def get_preview_pyramid() -> Optional[PreviewPyramid]:
+    """Returns the preview pyramid configured by the optional section camera or None if previews are disabled."""
+    global _pyramid
+    with _pyramid_lock:
+        if _pyramid is None:
+            cfg = None if core_configuration.config is None else core_configuration.camera_config()
+            if cfg is None or not cfg.getboolean('previews', False):
+                return None
+            try:
+                widths = [int(w) for w in cfg.get('preview_widths', '1280, 320').split(',') if w.strip() != '']
+            except ValueError:
+                log.error(f"Invalid preview widths {cfg.get('preview_widths')}, using 1280 and 320")
+                widths = None
+            fm = core_configuration.get_file_manager()
+            _pyramid = PreviewPyramid(str(fm.base_path / FileManager.TIMED_PICTURES), widths=widths,
+                                      encoding=cfg.get('preview_encoding', 'jpg').lower().strip(),
+                                      quality=cfg.getint('preview_quality', 80),
+                                      workers=cfg.getint('preview_workers', 2))
+        return _pyramid
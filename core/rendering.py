@@ -0,0 +1,297 @@
+import hashlib
+import json
+import multiprocessing
+import shutil
+import time
+from multiprocessing.pool import AsyncResult, Pool
+from pathlib import Path
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from core.core_configuration import rendering_config, get_file_manager, FileManager
+from core.core_log import get_logger, setup_logging
+from core.plotting import PlotData, ReportRange, SupportedDataFrames, draw_complete_summary, draw_range_report, \
+    custom_theme, last_24h_df
+from core.startup import lazy_import
+
+log = get_logger(__name__)
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# The rendering module. Moves the creation of plots out of the long-running instance process into a small pool of
+# worker processes, so the memory used by matplotlib is not kept in the instance forever.
+# - PlotData is packed into compact NumPy arrays (timestamps + plotted float columns) before it is sent to a worker
+# - A worker rebuilds the dataframes, renders the report to pdf and returns the path of the pdf
+# - Workers are recycled after `jobs_per_worker` jobs which returns their memory to the OS
+# - Several reports, e.g., a timed and a commanded one, are rendered in parallel if more than one worker is configured
+# - RenderCache keeps copies of rendered pdfs addressed by a hash of their input, so unchanged data is not rendered again
+# - If report ranges are configured, a page per range with aggregated data is rendered instead of the complete summary
+# ----------------------------------------------------------------------------------------------------------------
+
+class RenderPool:
+
+    def __init__(self, workers: int = 1, jobs_per_worker: int = 4, timeout_s: int = 600) -> None:
+        self.workers = max(1, workers)
+        self.jobs_per_worker = max(1, jobs_per_worker)
+        self.timeout_s = timeout_s
+        self._pool: Optional[Pool] = None
+        self._lock = Lock()
+
+    def __str__(self):
+        return f"RenderPool[workers: {self.workers}, jobs_per_worker: {self.jobs_per_worker}, timeout: {self.timeout_s}s]"
+
+    def _get_pool(self) -> Pool:
+        """Worker processes are started with the first job. Spawn is used because the instance process is threaded."""
+        with self._lock:
+            if self._pool is None:
+                ctx = multiprocessing.get_context("spawn")
+                self._pool = ctx.Pool(processes=self.workers, initializer=_init_worker,
+                                      maxtasksperchild=self.jobs_per_worker)
+                log.info(f"Started {self}")
+            return self._pool
+
+    def submit_summary(self, plot_data: List[PlotData], merge_subplots_for: Optional[List[PlotData]],
+                       save_path: str, report_ranges: Optional[List[ReportRange]] = None) -> AsyncResult:
+        """
+        Hands the rendering of draw_complete_summary, or draw_range_report if report ranges are given, to a worker
+        and returns immediately.
+        """
+        packed, merge_indices = pack_plot_data(plot_data, merge_subplots_for)
+        return self._get_pool().apply_async(_render_summary_job, (packed, merge_indices, save_path, report_ranges))
+
+    def render_summary(self, plot_data: List[PlotData], merge_subplots_for: Optional[List[PlotData]],
+                       save_path: str, report_ranges: Optional[List[ReportRange]] = None) -> Optional[str]:
+        """
+        Renders the report in a worker and blocks the calling thread until it is done.
+        Returns the path to the pdf or None if rendering failed or timed out.
+        """
+        try:
+            return self.submit_summary(plot_data, merge_subplots_for, save_path, report_ranges).get(self.timeout_s)
+        except multiprocessing.TimeoutError:
+            log.error(f"Rendering {save_path} did not finish within {self.timeout_s}s")
+        except Exception as e:
+            log.error(f"Error while rendering {save_path}: {str(e)}")
+        return None
+
+    def close(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
+                self._pool = None
+                log.info("Render workers stopped")
+
+
+class RenderCache:
+    """
+    Content-addressed cache of rendered pdfs. The key is a hash of the data watermark of every used table, the report
+    and the plot theme. The cache folder is bounded by size and number of entries, the least recently used renders
+    are evicted first.
+    """
+    _index_file = "index.json"
+
+    def __init__(self, cache_path: str, max_mb: int = 50, max_entries: int = 20) -> None:
+        self.cache_path = Path(cache_path)
+        self.max_bytes = max_mb * 1024 * 1024
+        self.max_entries = max_entries
+        self._lock = Lock()
+        self._index: Dict[str, dict] = self._load_index()
+
+    def is_enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def _load_index(self) -> Dict[str, dict]:
+        try:
+            return json.loads((self.cache_path / self._index_file).read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self) -> None:
+        try:
+            self.cache_path.mkdir(parents=True, exist_ok=True)
+            (self.cache_path / self._index_file).write_text(json.dumps(self._index))
+        except OSError as e:
+            log.error(f"Failed to save render cache index: {e}")
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_path / f"{key}.pdf"
+
+    @staticmethod
+    def key_for(plot_data: List[PlotData], merge_subplots_for: Optional[List[PlotData]] = None,
+                report: str = "complete_summary", theme: Optional[dict] = None) -> str:
+        """
+        The watermark of a table consists of its number of rows, its latest timestamp, the number of rows of the last
+        24 hours and a hash over the plotted columns. The latter detects updated rows, e.g., corrected DWD forecasts.
+        """
+        key = {
+            'report': report,
+            'theme': custom_theme if theme is None else theme,
+            'tables': [_watermark(p) for p in plot_data],
+            'merged': None if merge_subplots_for is None else [p.support.table_name for p in merge_subplots_for],
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+
+    def restore(self, key: str, save_path: str) -> bool:
+        """Copies the cached render to save_path. Returns False if there is no render for the key."""
+        if not self.is_enabled():
+            return False
+        with self._lock:
+            entry = self._entry_path(key)
+            if key not in self._index or not entry.exists():
+                return False
+            try:
+                if Path(save_path).resolve() != entry.resolve():
+                    shutil.copyfile(entry, save_path)
+            except OSError as e:
+                log.error(f"Failed to restore cached render {entry} to {save_path}: {e}")
+                return False
+            self._index[key]['last_used'] = time.time()
+            self._save_index()
+            return True
+
+    def store(self, key: str, save_path: str) -> None:
+        if not self.is_enabled():
+            return None
+        with self._lock:
+            entry = self._entry_path(key)
+            try:
+                self.cache_path.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(save_path, entry)
+            except OSError as e:
+                log.error(f"Failed to cache render {save_path}: {e}")
+                return None
+            self._index[key] = {'size': entry.stat().st_size, 'last_used': time.time()}
+            self._evict()
+            self._save_index()
+
+    def _evict(self) -> None:
+        """Removes least recently used renders until the cache is within its bounds."""
+        by_last_use = sorted(self._index, key=lambda k: self._index[k]['last_used'])
+        used_bytes = sum(e['size'] for e in self._index.values())
+        while by_last_use and (len(self._index) > self.max_entries or used_bytes > self.max_bytes):
+            key = by_last_use.pop(0)
+            used_bytes -= self._index.pop(key)['size']
+            self._entry_path(key).unlink(missing_ok=True)
+            log.debug(f"Evicted render {key} from cache")
+
+
+def _watermark(p: PlotData) -> list:
+    columns = [c for c in _plotted_columns(p.support) if c in p.data.columns]
+    rows = len(p.data)
+    if rows == 0:
+        return [p.support.table_name, p.main, 0]
+    content = int(pd.util.hash_pandas_object(p.data[['timestamp'] + columns], index=False).sum())
+    return [p.support.table_name, p.main, rows, str(p.data['timestamp'].max()), len(last_24h_df(p.data)), content]
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Packing of plot data. Only the columns which are plotted are sent to the workers.
+# ----------------------------------------------------------------------------------------------------------------
+
+def _plotted_columns(support: SupportedDataFrames) -> List[str]:
+    humidity = [] if support.humidity_key is None else [support.humidity_key]
+    return support.get_temperature_keys() + humidity
+
+
+def pack_plot_data(plot_data: List[PlotData],
+                   merge_subplots_for: Optional[List[PlotData]] = None) -> Tuple[List[dict], Optional[List[int]]]:
+    """
+    Packs PlotData into a list of dictionaries holding NumPy arrays. PlotData contained in both lists is only packed
+    once, the merge list is returned as indices into the packed list.
+    """
+    to_pack = list(plot_data)
+    merge_indices = None
+    if merge_subplots_for is not None:
+        merge_indices = []
+        for merge_data in merge_subplots_for:
+            idx = next((i for i, p in enumerate(to_pack) if p is merge_data), None)
+            if idx is None:
+                to_pack.append(merge_data)
+                idx = len(to_pack) - 1
+            merge_indices.append(idx)
+
+    packed = []
+    for p in to_pack:
+        columns = {'timestamp': p.data['timestamp'].to_numpy(dtype='datetime64[ns]')}
+        for key in _plotted_columns(p.support):
+            if key in p.data.columns:
+                columns[key] = pd.to_numeric(p.data[key], errors='coerce').to_numpy(dtype=np.float64)
+        packed.append({'support': p.support.name, 'main': p.main, 'columns': columns})
+    return packed, merge_indices
+
+
+def unpack_plot_data(packed: List[dict]) -> List[PlotData]:
+    return [PlotData(SupportedDataFrames[p['support']], pd.DataFrame(p['columns']), p['main']) for p in packed]
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Worker side. These functions are executed inside the worker processes.
+# ----------------------------------------------------------------------------------------------------------------
+
+def _init_worker() -> None:
+    setup_logging()
+
+
+def _render_summary_job(packed: List[dict], merge_indices: Optional[List[int]], save_path: str,
+                        report_ranges: Optional[List[ReportRange]] = None) -> Optional[str]:
+    plot_data = unpack_plot_data(packed)
+    merge_subplots_for = None if merge_indices is None else [plot_data[i] for i in merge_indices]
+    if report_ranges:
+        figures = draw_range_report(plot_data, report_ranges, merge_subplots_for=merge_subplots_for,
+                                    save_path=save_path)
+        return None if len(figures) == 0 or any(f is None for f in figures) else save_path
+    fig = draw_complete_summary(plot_data, merge_subplots_for=merge_subplots_for, save_path=save_path)
+    return None if fig is None else save_path
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Static utility methods
+# ----------------------------------------------------------------------------------------------------------------
+
+_render_pool: Optional[RenderPool] = None
+_render_cache: Optional[RenderCache] = None
+
+
+def get_render_pool() -> RenderPool:
+    """Returns the render pool of this process which is configured by the optional rendering section."""
+    global _render_pool
+    if _render_pool is None:
+        cfg = rendering_config()
+        if cfg is None:
+            _render_pool = RenderPool()
+        else:
+            _render_pool = RenderPool(workers=cfg.getint('workers', 1),
+                                      jobs_per_worker=cfg.getint('jobs_per_worker', 4),
+                                      timeout_s=cfg.getint('timeout_s', 600))
+    return _render_pool
+
+
+def get_render_cache() -> RenderCache:
+    """Returns the render cache of this process which is stored in the plots folder of the FileManager."""
+    global _render_cache
+    if _render_cache is None:
+        cfg = rendering_config()
+        cache_path = str(get_file_manager().base_path / FileManager.RENDER_CACHE)
+        if cfg is None:
+            _render_cache = RenderCache(cache_path)
+        else:
+            _render_cache = RenderCache(cache_path, max_mb=cfg.getint('cache_max_mb', 50),
+                                        max_entries=cfg.getint('cache_max_entries', 20))
+    return _render_cache
+
+
+def get_report_ranges() -> List[ReportRange]:
+    """
+    Returns the report ranges of the optional rendering section, e.g., 'report_ranges = 24h, 7d, 30d, 1y'.
+    An empty list means that the complete summary is rendered.
+    """
+    cfg = rendering_config()
+    if cfg is None:
+        return []
+    try:
+        return [ReportRange.parse(r) for r in cfg.get('report_ranges', '').split(',') if r.strip() != '']
+    except ValueError as e:
+        log.error(f"Ignoring report ranges: {e}")
+        return []
@@ -1,13 +1,35 @@
 from core.core_log import get_logger
-from PIL import Image
+from core.startup import lazy_import
+import atexit
+import io
+import shutil
 import subprocess
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from threading import Lock
+from typing import Any, BinaryIO, Callable, List, Optional, Set, Tuple, Union
+
+from core import core_configuration
+from core.monitoring import PrometheusManager
 
 log = get_logger(__name__)
+Image = lazy_import("PIL.Image")
+np = lazy_import("numpy")
 
 # ----------------------------------------------------------------------------------------------------------------
 # This module is responsible for communication with a camera connected to the Raspberry Pi.
 # It supports the 5MP Raspberry Pi camera module with an OV5647 sensor which is accessed via the 
 # bash command rpicam-apps.
+# - Without session, every picture starts rpicam-still which initializes the camera and settles the auto exposure
+# - A CameraSession keeps rpicam-still running in keypress mode, so the camera stays warm and a picture is triggered
+#   by writing a newline to its stdin. If the session fails, the picture is taken the one-shot way
+# The session is enabled with persistent_session in the optional section camera.
+# Every picture is encoded and written once. Rotations by 180 degree are done by the camera pipeline. Other rotations
+# capture raw RGB into memory, which is rotated with NumPy before it is encoded into the picture file.
+# capture_image_bytes returns the encoded picture from the stdout of the camera without writing a file.
+# Every rpicam-still is killed after command_timeout_s. Scheduled and commanded pictures are taken as jobs of the
+# CaptureQueue, so a slow camera does not delay the scheduler, see get_capture_queue.
 # ----------------------------------------------------------------------------------------------------------------
 
 # Dimension for 5MP Raspberry Pi camera module static image resolution default
@@ -20,6 +42,143 @@ DIMENSION_FULL_HD = (1920, 1080)
 DIMENSION_HD = (1280, 720)
 # Dimension for 480 pixel, SD
 DIMENSION_SD = (854, 480)
+# PIL formats of the encodings which can be encoded in memory
+PIL_FORMATS = {"jpg": "JPEG", "png": "PNG", "bmp": "BMP"}
+
+
+class CameraSession:
+    """
+    Long-lived rpicam-still in keypress mode. Every newline on its stdin writes the next numbered frame into session_dir,
+    which is then moved to its target path. session_dir should be on the same file system as the pictures.
+    Unlike signals, a newline sent while the camera is still starting is not lost but read once it is ready.
+    """
+
+    def __init__(self, session_dir: str, capture_timeout_s: float = 10) -> None:
+        self.session_dir = Path(session_dir)
+        self.capture_timeout_s = capture_timeout_s
+        self.encoding: Optional[str] = None
+        self.dimension: Optional[tuple] = None
+        self.rotation = 0
+        self.captures = 0
+        self._process: Optional[subprocess.Popen] = None
+        self._lock = Lock()
+
+    def __str__(self):
+        return (f"CameraSession[encoding: {self.encoding}, dimension: {self.dimension}, rotation: {self.rotation}, "
+                f"captures: {self.captures}]")
+
+    def is_alive(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    def _frame_path(self, index: int) -> Path:
+        return self.session_dir / f"frame{index:06d}.{self.encoding}"
+
+    def _command(self) -> List[str]:
+        command = ['rpicam-still', '--nopreview', '--timeout', '0', '--keypress', '--verbose', '0',
+                   '--encoding', self.encoding,
+                   '--output', str(self.session_dir / f"frame%06d.{self.encoding}")]
+        return command + _capture_options(self.dimension, self.rotation)
+
+    def _start(self, encoding: str, dimension: Optional[tuple], rotation: int = 0) -> bool:
+        if self.is_alive() and (encoding, dimension, rotation) == (self.encoding, self.dimension, self.rotation):
+            return True
+        self._stop()
+        self.encoding, self.dimension, self.rotation, self.captures = encoding, dimension, rotation, 0
+        try:
+            self.session_dir.mkdir(parents=True, exist_ok=True)
+            for frame in self.session_dir.glob("frame*"):
+                frame.unlink()
+            # a file instead of a pipe, which would block the process once it is full
+            with open(self.session_dir / "session.log", "wb") as session_log:
+                self._process = subprocess.Popen(self._command(), stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                                 stderr=session_log)
+            log.info(f"Started {self}")
+            return True
+        except OSError as e:
+            log.error(f"Could not start camera session: {str(e)}")
+            self._process = None
+            return False
+
+    def warm_up(self, encoding: str = "png", dimension: Optional[tuple] = None) -> bool:
+        """Starts the camera before the first picture is requested."""
+        with self._lock:
+            return self._start(encoding, dimension)
+
+    def stop(self) -> None:
+        with self._lock:
+            self._stop()
+
+    def _stop(self) -> None:
+        if self._process is None:
+            return None
+        if self._process.poll() is None:
+            # x ends rpicam-still in keypress mode
+            self._send_key(b"x\n")
+            try:
+                self._process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+        else:
+            session_log = (self.session_dir / "session.log").read_text(errors='replace')
+            log.warning(f"Camera session exited with code {self._process.returncode}: {session_log[-500:]}")
+        self._process.stdin.close()
+        self._process = None
+        log.info(f"Stopped {self}")
+
+    def _send_key(self, key: bytes) -> bool:
+        try:
+            self._process.stdin.write(key)
+            self._process.stdin.flush()
+            return True
+        except OSError:
+            return False
+
+    def _wait_for_frame(self, frame: Path) -> bool:
+        """The frame is complete when it exists and its size did not change between two polls."""
+        deadline = time.monotonic() + self.capture_timeout_s
+        last_size = -1
+        while time.monotonic() < deadline and self.is_alive():
+            size = frame.stat().st_size if frame.exists() else -1
+            if size > 0 and size == last_size:
+                return True
+            last_size = size
+            time.sleep(0.05)
+        return False
+
+    def _capture_frame(self, encoding: str, dimension: Optional[tuple], rotation: int) -> Optional[Path]:
+        if not self._start(encoding, dimension, rotation):
+            return None
+        frame = self._frame_path(self.captures)
+        if not self._send_key(b"\n") or not self._wait_for_frame(frame):
+            log.error(f"Camera session did not capture a picture within {self.capture_timeout_s}s")
+            self._stop()
+            return None
+        self.captures += 1
+        return frame
+
+    def capture(self, file_name: str, encoding: str, dimension: Optional[tuple] = None, rotation: int = 0) -> bool:
+        """
+        Takes a picture and stores it in file_name. The session is (re)started if needed. Rotation must be supported
+        by the camera, i.e., 0 or 180.
+        """
+        with self._lock:
+            frame = self._capture_frame(encoding, dimension, rotation)
+            if frame is None:
+                return False
+            # the session dir may be a tmpfs, then this is the only write to the sd card
+            shutil.move(frame, file_name)
+            return True
+
+    def capture_bytes(self, encoding: str, dimension: Optional[tuple] = None, rotation: int = 0) -> Optional[bytes]:
+        """Takes a picture and returns its content, see capture."""
+        with self._lock:
+            frame = self._capture_frame(encoding, dimension, rotation)
+            if frame is None:
+                return None
+            content = frame.read_bytes()
+            frame.unlink()
+            return content
 
 
 class RpiCamController:
@@ -29,15 +188,20 @@ class RpiCamController:
     https://www.raspberrypi.com/documentation/computers/camera_software.html#rpicam-apps
     """
 
-    def __init__(self) -> None:
+    def __init__(self, timeout_s: Optional[float] = None) -> None:
         # https://www.raspberrypi.com/documentation/computers/camera_software.html#encoding
         self.supported_image_endcodings = ["jpg", "png", "bmp", "rgb", "yuv420"]
-        pass
+        if timeout_s is None:
+            cfg = None if core_configuration.config is None else core_configuration.camera_config()
+            timeout_s = 30.0 if cfg is None else cfg.getfloat('command_timeout_s', 30.0)
+        self.timeout_s = timeout_s
 
     def _run_command(self,
                      command,
                      on_success=None,
-                     on_failure=None):
+                     on_failure=None,
+                     binary_output: bool = False,
+                     timeout_s: Optional[float] = None):
         """
         Runs a command and executes custom actions based on the return code.
         
@@ -45,73 +209,309 @@ class RpiCamController:
         - command: List of command parts to be executed.
         - on_success: Callback function to execute on successful completion (return code 0).
         - on_failure: Callback function to execute on failure (non-zero return code).
+        - binary_output: Whether the output is passed as bytes instead of text, e.g., an image written to stdout.
+        - timeout_s: The command is killed and treated as failed after this many seconds, default is self.timeout_s.
         
         Returns:
         if no callback is given then a dictionary with output, return code, and error (if any).
         Otherwise, it returns the output of the used on_success or on_failure function.
         """
-        result = subprocess.run(
-            command,
-            # No exception on return-code != 0 to handle them by calling methods
-            check=False,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
+        timeout_s = self.timeout_s if timeout_s is None else timeout_s
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        with _running_lock:
+            _running.add(process)
+        try:
+            stdout, stderr = process.communicate(timeout=timeout_s)
+            error = stderr.decode()
+        except subprocess.TimeoutExpired:
+            process.kill()
+            stdout, _ = process.communicate()
+            error = f"{command[0]} did not finish within {timeout_s}s and was killed"
+        finally:
+            with _running_lock:
+                _running.discard(process)
+        if process.returncode < 0 and error == "":
+            error = f"{command[0]} was killed by signal {-process.returncode}"
 
         # Check the return code and call appropriate callbacks if provided
-        if result.returncode == 0:
+        if process.returncode == 0:
+            output = stdout if binary_output else stdout.decode()
             if on_success:
-                return on_success(result.stdout.decode())
+                return on_success(output)
             return {
-                'output': result.stdout.decode(),
-                'returncode': result.returncode,
+                'output': output,
+                'returncode': process.returncode,
                 'error': None
             }
         else:
             if on_failure:
-                return on_failure(result.stderr.decode())
+                return on_failure(error)
             return {
                 'output': None,
-                'returncode': result.returncode,
-                'error': result.stderr.decode()
+                'returncode': process.returncode,
+                'error': error
             }
 
-    def _rotate_and_save(self, image_path: str, rotation: int) -> bool:
-        if rotation != 0:
-            image = Image.open(image_path)
+    def _save_rotated(self, raw: bytes, dimension: tuple, rotation: int, image_path: Union[str, BinaryIO],
+                      encoding: str = "png") -> bool:
+        """Rotates a raw RGB capture counterclockwise and encodes it once into image_path, a path or a buffer."""
+        width, height = dimension
+        if raw is None or len(raw) < width * height * 3:
+            log.error(f"Raw capture has {0 if raw is None else len(raw)} bytes, expected {width}x{height} RGB")
+            return False
+        # rows of the raw capture may be padded
+        stride = len(raw) // height
+        pixels = np.frombuffer(raw, dtype=np.uint8, count=stride * height).reshape(height, stride)[:, :width * 3]
+        pixels = pixels.reshape(height, width, 3)
+        if rotation % 90 == 0:
+            image = Image.fromarray(np.ascontiguousarray(np.rot90(pixels, rotation // 90)))
+        else:
             # 'expand' to resize for the whole image
-            rotated_image = image.rotate(rotation, expand=True)
-            rotated_image.save(image_path)
+            image = Image.fromarray(pixels).rotate(rotation, expand=True)
+        image.save(image_path, format=PIL_FORMATS[encoding])
         return True
 
+    def _validate(self, encoding: str, rotation: int, dimension) -> Optional[Tuple[Optional[tuple], int, int]]:
+        """Returns the valid dimension, the rotation done by the camera and the rotation done in memory."""
+        if rotation < 0 or rotation > 360:
+            log.error(f"Unsupported image rotation {rotation} found. Supported range is [0, 360]")
+        if encoding not in self.supported_image_endcodings:
+            log.error(f"Unsupported image encoding {encoding} found. Supported are {self.supported_image_endcodings}")
+            return None
+        if dimension is not None and len(dimension) == 2:
+            if dimension[0] >= 0 and dimension[1] >= 0:
+                log.info(f"Using dimension {dimension}")
+                dimension = tuple(dimension)
+            else:
+                log.error(f"Unsupported dimension {dimension}.")
+                dimension = None
+        else:
+            dimension = None
+        camera_rotation, memory_rotation = split_rotation(rotation)
+        if memory_rotation != 0 and encoding not in PIL_FORMATS:
+            log.error(f"Rotation {rotation} is not supported for raw encoding {encoding}")
+            return None
+        return dimension, camera_rotation, memory_rotation
+
     def capture_image(self, file_path: str = "test", encoding: str = "png", rotation: int = 0,
                       dimension: tuple[int] = None) -> bool:
         """
         file_path must be the path to the image without encoding, e.g., /path/to/image and set encoding to "png"
         results in internal usage of /path/to/image.png
         """
-        if rotation < 0 or rotation > 360:
-            log.error(f"Unsupported image rotation {rotation} found. Supported range is [0, 360]")
-        if encoding not in self.supported_image_endcodings:
-            log.error(f"Unsupported image encoding {encoding} found. Supported are {self.supported_image_endcodings}")
+        validated = self._validate(encoding, rotation, dimension)
+        if validated is None:
             return False
+        dimension, camera_rotation, memory_rotation = validated
         file_name = f"{file_path}.{encoding}"
-        command = ['rpicam-still',
-                   '--encoding', encoding,
-                   '--output', file_name]
-        if dimension is not None and len(dimension) == 2:
-            if (width := dimension[0]) >= 0 and (height := dimension[1]) >= 0:
-                log.info(f"Using dimension {dimension}")
-                command += ['--width', str(width),
-                            '--height', str(height)]
+        # the raw capture must have a known size to be rotated
+        raw_dimension = DIMENSION_CAMERA_DEFAULT if dimension is None else dimension
+
+        session = get_camera_session()
+        if session is not None:
+            if memory_rotation == 0 and session.capture(file_name, encoding, dimension, camera_rotation):
+                return True
+            if memory_rotation != 0:
+                raw = session.capture_bytes("rgb", raw_dimension, camera_rotation)
+                if raw is not None:
+                    return self._save_rotated(raw, raw_dimension, memory_rotation, file_name, encoding)
+            # the session was stopped, so the camera is free for rpicam-still
+            log.warning("Camera session could not take the picture, taking it one-shot")
+
+        on_failure = lambda error_msg: (log.error(f"Error while capturing picture: {error_msg}"), False)[1]
+        if memory_rotation == 0:
+            command = ['rpicam-still', '--encoding', encoding, '--output', file_name]
+            return self._run_command(command + _capture_options(dimension, camera_rotation),
+                                     on_success=lambda _: True, on_failure=on_failure)
+        # raw RGB to stdout, so the picture is only written after the rotation
+        command = ['rpicam-still', '--encoding', 'rgb', '--output', '-']
+        return self._run_command(command + _capture_options(raw_dimension, camera_rotation),
+                                 on_success=lambda raw: self._save_rotated(raw, raw_dimension, memory_rotation,
+                                                                           file_name, encoding),
+                                 on_failure=on_failure, binary_output=True)
+
+    def capture_image_bytes(self, encoding: str = "png", rotation: int = 0,
+                            dimension: tuple[int] = None) -> Optional[bytes]:
+        """Returns the encoded picture or None, the camera writes it to stdout instead of a file."""
+        validated = self._validate(encoding, rotation, dimension)
+        if validated is None:
+            return None
+        dimension, camera_rotation, memory_rotation = validated
+        raw_dimension = DIMENSION_CAMERA_DEFAULT if dimension is None else dimension
+
+        def encode_rotated(raw: Optional[bytes]) -> Optional[bytes]:
+            buffer = io.BytesIO()
+            return buffer.getvalue() if self._save_rotated(raw, raw_dimension, memory_rotation, buffer, encoding) \
+                else None
+
+        session = get_camera_session()
+        if session is not None:
+            if memory_rotation == 0:
+                content = session.capture_bytes(encoding, dimension, camera_rotation)
+                if content is not None:
+                    return content
             else:
-                log.error(f"Unsupported dimension {dimension}.")
+                raw = session.capture_bytes("rgb", raw_dimension, camera_rotation)
+                if raw is not None:
+                    return encode_rotated(raw)
+            log.warning("Camera session could not take the picture, taking it one-shot")
 
-        return self._run_command(command,
-                                 on_success=lambda _: self._rotate_and_save(file_name, rotation),
-                                 on_failure=lambda error_msg:
-                                 (log.error(f"Error while capturing picture: {error_msg}"), False)[1])
+        on_failure = lambda error_msg: (log.error(f"Error while capturing picture: {error_msg}"), None)[1]
+        if memory_rotation == 0:
+            command = ['rpicam-still', '--encoding', encoding, '--output', '-']
+            return self._run_command(command + _capture_options(dimension, camera_rotation),
+                                     on_success=lambda content: content if len(content) > 0 else None,
+                                     on_failure=on_failure, binary_output=True)
+        command = ['rpicam-still', '--encoding', 'rgb', '--output', '-']
+        return self._run_command(command + _capture_options(raw_dimension, camera_rotation),
+                                 on_success=encode_rotated, on_failure=on_failure, binary_output=True)
 
     def get_version(self) -> str:
         command = ['rpicam-hello', '--version']
         return self._run_command(command)
+
+
+class CaptureQueue:
+    """
+    Runs capture jobs one after another in a worker thread. At most max_jobs are queued or running, further jobs are
+    rejected, e.g., if the camera hangs until the timeout of rpicam-still. A job only captures, its result is passed to
+    the future and a result of None or False is a failure.
+    """
+
+    def __init__(self, max_jobs: int = 2) -> None:
+        self.max_jobs = max(1, max_jobs)
+        self._jobs: Set[Future] = set()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = Lock()
+
+    def __str__(self):
+        return f"CaptureQueue[jobs: {len(self._jobs)}/{self.max_jobs}]"
+
+    def submit(self, kind: str, job: Callable[[], Any]) -> Optional[Future]:
+        """Queues the job and returns its future or None if the queue is full."""
+        with self._lock:
+            if len(self._jobs) >= self.max_jobs:
+                log.warning(f"Rejected {kind} capture job, {self} is full")
+                PrometheusManager().observe_picture_capture(kind, "rejected")
+                return None
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="camera")
+            future = self._executor.submit(_run_capture_job, kind, job)
+            self._jobs.add(future)
+        future.add_done_callback(lambda f: self._done(kind, f))
+        return future
+
+    def _done(self, kind: str, future: Future) -> None:
+        with self._lock:
+            self._jobs.discard(future)
+        if future.cancelled():
+            log.info(f"Cancelled {kind} capture job")
+            PrometheusManager().observe_picture_capture(kind, "cancelled")
+
+    def cancel(self) -> None:
+        """Cancels the queued jobs and kills the rpicam-still of the running job."""
+        with self._lock:
+            jobs = list(self._jobs)
+        for future in jobs:
+            future.cancel()
+        kill_running_commands()
+
+    def stop(self) -> None:
+        self.cancel()
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Static utility methods
+# ----------------------------------------------------------------------------------------------------------------
+
+_session: Optional[CameraSession] = None
+_session_lock = Lock()
+_queue: Optional[CaptureQueue] = None
+_queue_lock = Lock()
+_running: Set[subprocess.Popen] = set()
+_running_lock = Lock()
+
+
+def _run_capture_job(kind: str, job: Callable[[], Any]) -> Any:
+    started = time.monotonic()
+    try:
+        result = job()
+    except Exception as e:
+        log.error(f"Error in {kind} capture job: {str(e)}")
+        result = None
+    successful = result is not None and result is not False
+    PrometheusManager().observe_picture_capture(kind, "success" if successful else "failure",
+                                                time.monotonic() - started)
+    return result
+
+
+def kill_running_commands() -> None:
+    """Kills the running one-shot rpicam-still commands, they fail with the signal."""
+    with _running_lock:
+        for process in _running:
+            process.kill()
+
+
+def get_capture_queue() -> CaptureQueue:
+    """Returns the capture queue of this process, its size is max_capture_jobs of the optional section camera."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            cfg = None if core_configuration.config is None else core_configuration.camera_config()
+            _queue = CaptureQueue(2 if cfg is None else cfg.getint('max_capture_jobs', 2))
+        return _queue
+
+
+def split_rotation(rotation: int) -> Tuple[int, int]:
+    """Returns the part of the counterclockwise rotation done by the camera (0 or 180) and the part done in memory."""
+    rotation = rotation % 360
+    if rotation in [0, 180]:
+        return rotation, 0
+    return 0, rotation
+
+
+def _capture_options(dimension: Optional[tuple], rotation: int) -> List[str]:
+    options = []
+    if dimension is not None:
+        options += ['--width', str(dimension[0]), '--height', str(dimension[1])]
+    if rotation != 0:
+        options += ['--rotation', str(rotation)]
+    return options
+
+
+def downscale_picture(content: bytes, max_width: int, quality: int = 85) -> Optional[bytes]:
+    """Returns the picture scaled down to max_width as JPEG or None if it is not wider than max_width."""
+    try:
+        image = Image.open(io.BytesIO(content))
+        if image.width <= max_width:
+            return None
+        image.thumbnail((max_width, max_width * image.height // image.width))
+        buffer = io.BytesIO()
+        image.convert("RGB").save(buffer, format="JPEG", quality=quality)
+        return buffer.getvalue()
+    except Exception as e:
+        log.error(f"Error while scaling down picture: {str(e)}")
+        return None
+
+
+def get_camera_session() -> Optional[CameraSession]:
+    """Returns the camera session configured by the optional section camera or None if pictures are taken one-shot."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            cfg = None if core_configuration.config is None else core_configuration.camera_config()
+            if cfg is None or not cfg.getboolean('persistent_session', False):
+                return None
+            session_dir = cfg.get('session_dir', '').strip()
+            if session_dir == '':
+                fm = core_configuration.get_file_manager()
+                # frames in memory are only written once, when they are moved to the pictures
+                shm = Path("/dev/shm")
+                session_dir = str(shm / "hometemp-camera" if shm.is_dir() else fm.base_path / fm.TIMED_PICTURES / ".session")
+            _session = CameraSession(session_dir, capture_timeout_s=cfg.getfloat('capture_timeout_s', 10))
+            atexit.register(_session.stop)
+        return _session
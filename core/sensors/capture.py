@@ -0,0 +1,129 @@
+import atexit
+import time
+from array import array
+from threading import Lock
+from typing import Dict, List, Tuple
+
+from core.core_log import get_logger
+from core.sensors.gpio import get_clock, get_gpio
+
+log = get_logger(__name__)
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Capture engine for single wire sensors like the DHT family. Instead of storing every polled sample, only the level
+# changes (edges) are recorded together with their perf_counter_ns timestamp. The length of a period is therefore
+# measured in real time and does not depend on how fast the Python loop was scheduled.
+# - Use get_edge_capture(pin) to get the engine of a pin. Engines are reused, so the buffers are allocated once
+# - GPIO mode and warnings are set once per process and the pins are cleaned up at exit, not after every read
+# - The GPIO backend and its clock are taken from core.sensors.gpio, so captures can be simulated off-device
+# - Use EdgeCapture.frame() to hand the edges to a decoder, see core.sensors.dht_decoder
+# ----------------------------------------------------------------------------------------------------------------
+
+class EdgeCapture:
+
+    def __init__(self, pin: int, max_edges: int = 128, idle_timeout_us: int = 2000, deadline_ms: int = 20) -> None:
+        self.pin = pin
+        self.max_edges = max_edges
+        self.idle_timeout_ns = idle_timeout_us * 1000
+        self.deadline_ns = deadline_ms * 1_000_000
+        # preallocated, the capture loop only writes into these buffers
+        self.timestamps = array('q', bytes(8 * max_edges))
+        self.levels = bytearray(max_edges)
+        self.count = 0
+        self.gpio = get_gpio()
+        self._clock = get_clock(self.gpio)
+        _setup_gpio(self.gpio)
+
+    def __str__(self):
+        return f"EdgeCapture[pin: {self.pin}, edges: {self.count}/{self.max_edges}]"
+
+    def send_start_signal(self, high_s: float = 0.05, low_s: float = 0.02) -> None:
+        """Wakes the sensor up by pulling the line low and switches the pin to input with pull up afterwards."""
+        gpio = self.gpio
+        gpio.setup(self.pin, gpio.OUT)
+        gpio.output(self.pin, gpio.HIGH)
+        time.sleep(high_s)
+        gpio.output(self.pin, gpio.LOW)
+        time.sleep(low_s)
+        gpio.setup(self.pin, gpio.IN, gpio.PUD_UP)
+
+    def capture(self) -> int:
+        """
+        Records the edges of the pin until the level did not change for idle_timeout_us, the deadline is reached or the
+        buffer is full. The first entry is the level when capturing started. Returns the number of recorded entries.
+        """
+        # local names keep the polling loop as short as possible
+        read, now, pin = self.gpio.input, self._clock, self.pin
+        timestamps, levels, max_edges = self.timestamps, self.levels, self.max_edges
+        last_level = read(pin)
+        start = last_change = now()
+        timestamps[0], levels[0] = start, last_level
+        count = 1
+        deadline, idle_timeout = start + self.deadline_ns, self.idle_timeout_ns
+        while count < max_edges:
+            level = read(pin)
+            t = now()
+            if level != last_level:
+                timestamps[count], levels[count] = t, level
+                count += 1
+                last_level, last_change = level, t
+            elif t - last_change > idle_timeout or t > deadline:
+                break
+        self.count = count
+        return count
+
+    def read_edges(self) -> Tuple[memoryview, memoryview]:
+        """Sends the start signal and returns the captured edges, see frame()."""
+        # captures of different pins never overlap, so one capture does not delay the polling of another
+        with _capture_lock:
+            self.send_start_signal()
+            self.capture()
+            return self.frame()
+
+    def edges(self) -> List[Tuple[int, int]]:
+        return list(zip(self.timestamps[:self.count], self.levels[:self.count]))
+
+    def frame(self) -> Tuple[memoryview, memoryview]:
+        """Returns views of the timestamps and levels of the last capture without copying them."""
+        return memoryview(self.timestamps)[:self.count], memoryview(self.levels)[:self.count]
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Static utility methods
+# ----------------------------------------------------------------------------------------------------------------
+
+_gpio_ready = []
+_gpio_lock = Lock()
+_capture_lock = Lock()
+_captures: Dict[int, EdgeCapture] = {}
+
+
+def _setup_gpio(gpio) -> None:
+    with _gpio_lock:
+        if any(g is gpio for g in _gpio_ready):
+            return
+        gpio.setwarnings(False)
+        gpio.setmode(gpio.BCM)
+        if len(_gpio_ready) == 0:
+            atexit.register(_cleanup_gpio)
+        _gpio_ready.append(gpio)
+        log.info("GPIO set up in BCM mode")
+
+
+def _cleanup_gpio() -> None:
+    with _gpio_lock:
+        for gpio in _gpio_ready:
+            gpio.cleanup()
+        _gpio_ready.clear()
+
+
+def get_edge_capture(pin: int) -> EdgeCapture:
+    """Returns the capture engine of the pin which is created on first use or if the GPIO backend changed."""
+    with _gpio_lock:
+        capture = _captures.get(pin)
+    if capture is None or capture.gpio is not get_gpio():
+        capture = EdgeCapture(pin)
+        with _gpio_lock:
+            _captures[pin] = capture
+    return capture
@@ -13,39 +13,46 @@
 # This module is responsible for communication with temperature + humidity sensors DHT11, DHT22 or AM2302.
 # ----------------------------------------------------------------------------------------------------------------
 
+from __future__ import annotations
+
+from core import core_configuration
 from core.core_log import get_logger
 import time
-
-import RPi.GPIO as GPIO
+import re
+from typing import Dict, List, Optional
 
 from core.monitoring import PrometheusManager
+from core.sensors.capture import get_edge_capture
+# DHTResult is part of the interface of this module
+from core.sensors.dht_decoder import DHTResult, decode_edges
+from core.sensors.reader import get_sensor_reader
 
 # Do not change order, only append!
 SUPPORTED_SENSORS = ["dht11", "dht22", "am2302"]
+# id of the sensor configured in section core, i.e., if no sensors are configured in section sensor
+DEFAULT_SENSOR_ID = "room"
 
 log = get_logger(__name__)
-GPIO.setwarnings(False)
-GPIO.setmode(GPIO.BCM)
 
 
-# DHTxx sensor result returned by DHT.read() method'
-class DHTResult:
-    ERR_NO_ERROR = 0
-    ERR_MISSING_DATA = 1
-    ERR_CRC = 2
-    ERR_NOT_FOUND = 3
+class SensorDefinition:
+    """A sensor of an instance. The primary sensor is used for plots, emails and heat warnings."""
+
+    def __init__(self, sensor_id: str, sensor_type: str, pin: int, primary: bool = False) -> None:
+        self.sensor_id = sensor_id
+        self.sensor_type = sensor_type
+        self.pin = pin
+        self.primary = primary
 
-    error_code = ERR_NO_ERROR
-    temperature = -1
-    humidity = -1
+    def __str__(self):
+        return f"{self.sensor_id}:{self.sensor_type}:{self.pin}"
 
-    def __init__(self, error_code, temperature, humidity):
-        self.error_code = error_code
-        self.temperature = temperature
-        self.humidity = humidity
+    def __repr__(self):
+        return f"SensorDefinition({self}{', primary' if self.primary else ''})"
 
-    def is_valid(self):
-        return self.error_code == DHTResult.ERR_NO_ERROR
+    @property
+    def is_dht11(self) -> bool:
+        return self.sensor_type == SUPPORTED_SENSORS[0]
 
 
 # DHTxx sensor reader class for Raspberry'
@@ -56,238 +63,130 @@ class DHT:
     def __init__(self, pin, isDht11):
         self.__pin = pin
         self.__isDht11 = isDht11
+        # GPIO is set up once per process by the capture engine and cleaned up at exit
+        self.__capture = get_edge_capture(pin)
 
     def read(self):
-        GPIO.setwarnings(False)
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(self.__pin, GPIO.OUT)
-
-        # send initial high
-        self.__send_and_sleep(GPIO.HIGH, 0.05)
-
-        # pull down to low
-        self.__send_and_sleep(GPIO.LOW, 0.02)
-
-        # change to input using pull up
-        GPIO.setup(self.__pin, GPIO.IN, GPIO.PUD_UP)
-
-        # collect data into an array
-        data = self.__collect_input()
-
-        # parse lengths of all data pull up periods
-        pull_up_lengths = self.__parse_data_pull_up_lengths(data)
-
-        if len(pull_up_lengths) == 0:
-            return DHTResult(DHTResult.ERR_NOT_FOUND, 0, 0)
-
-        # if bit count mismatch, return error (4 byte data + 1 byte checksum)
-        if len(pull_up_lengths) != 40:
-            return DHTResult(DHTResult.ERR_MISSING_DATA, 0, 0)
-
-        # calculate bits from lengths of the pull up periods
-        bits = self.__calculate_bits(pull_up_lengths)
-
-        # we have the bits, calculate bytes
-        the_bytes = self.__bits_to_bytes(bits)
-
-        # calculate checksum and check
-        checksum = self.__calculate_checksum(the_bytes)
-        if the_bytes[4] != checksum:
-            return DHTResult(DHTResult.ERR_CRC, 0, 0)
-
-        # ok, we have valid data
-        # The meaning of the return sensor values
-        # the_bytes[0]: humidity int
-        # the_bytes[1]: humidity decimal
-        # the_bytes[2]: temperature int
-        # the_bytes[3]: temperature decimal
-        temperature = -1
-        humidity = -1
-        if (self.__isDht11):
-            # DHT11
-            # return 1 in MSB of the_bytes[3] when sub-zero temperature.
-            if not bits[24]:
-                temperature = the_bytes[2] + float(the_bytes[3]) / 10
-            else:
-                temperature = 0.0 - the_bytes[2] - float(the_bytes[3] - 128) / 10
-            
-            humidity = the_bytes[0] + float(the_bytes[1]) / 10
-        else:
-            # DHT22
-            temperature = (the_bytes[2] * 256 + float(the_bytes[3])) / 10
-            humidity = (the_bytes[0] * 256 + float(the_bytes[1])) / 10
-            c = (float)(((the_bytes[2] & 0x7F) << 8) + the_bytes[3]) / 10
-
-            if (c > 125):
-                c = the_bytes[2]
-
-            if (the_bytes[2] & 0x80):
-                c = -c
-
-            temperature = c
-            humidity = ((the_bytes[0] << 8) + the_bytes[1]) / 10.00
-
-        GPIO.cleanup()
-        return DHTResult(DHTResult.ERR_NO_ERROR, temperature, humidity)
-
-    def __send_and_sleep(self, output, sleep):
-        GPIO.output(self.__pin, output)
-        time.sleep(sleep)
-
-    def __collect_input(self):
-        # collect the data while unchanged found
-        unchanged_count = 0
-
-        # this is used to determine where is the end of the data
-        max_unchanged_count = 100
-
-        last = -1
-        data = []
-        while True:
-            current = GPIO.input(self.__pin)
-            data.append(current)
-            if last != current:
-                unchanged_count = 0
-                last = current
-            else:
-                unchanged_count += 1
-                if unchanged_count > max_unchanged_count:
-                    break
-
-        return data
-
-    def __parse_data_pull_up_lengths(self, data):
-        STATE_INIT_PULL_DOWN = 1
-        STATE_INIT_PULL_UP = 2
-        STATE_DATA_FIRST_PULL_DOWN = 3
-        STATE_DATA_PULL_UP = 4
-        STATE_DATA_PULL_DOWN = 5
-
-        state = STATE_INIT_PULL_DOWN
-
-        lengths = []  # will contain the lengths of data pull up periods
-        current_length = 0  # will contain the length of the previous period
-
-        for i in range(len(data)):
-
-            current = data[i]
-            current_length += 1
-
-            if state == STATE_INIT_PULL_DOWN:
-                if current == GPIO.LOW:
-                    # ok, we got the initial pull down
-                    state = STATE_INIT_PULL_UP
-                    continue
-                else:
-                    continue
-            if state == STATE_INIT_PULL_UP:
-                if current == GPIO.HIGH:
-                    # ok, we got the initial pull up
-                    state = STATE_DATA_FIRST_PULL_DOWN
-                    continue
-                else:
-                    continue
-            if state == STATE_DATA_FIRST_PULL_DOWN:
-                if current == GPIO.LOW:
-                    # we have the initial pull down, the next will be the data pull up
-                    state = STATE_DATA_PULL_UP
-                    continue
-                else:
-                    continue
-            if state == STATE_DATA_PULL_UP:
-                if current == GPIO.HIGH:
-                    # data pulled up, the length of this pull up will determine whether it is 0 or 1
-                    current_length = 0
-                    state = STATE_DATA_PULL_DOWN
-                    continue
-                else:
-                    continue
-            if state == STATE_DATA_PULL_DOWN:
-                if current == GPIO.LOW:
-                    # pulled down, we store the length of the previous pull up period
-                    lengths.append(current_length)
-                    state = STATE_DATA_PULL_UP
-                    continue
-                else:
-                    continue
-
-        return lengths
-
-    def __calculate_bits(self, pull_up_lengths):
-        # find shortest and longest period
-        shortest_pull_up = 1000
-        longest_pull_up = 0
-
-        for i in range(0, len(pull_up_lengths)):
-            length = pull_up_lengths[i]
-            if length < shortest_pull_up:
-                shortest_pull_up = length
-            if length > longest_pull_up:
-                longest_pull_up = length
-
-        # use the halfway to determine whether the period it is long or short
-        halfway = shortest_pull_up + (longest_pull_up - shortest_pull_up) / 2
-        bits = []
-
-        for i in range(0, len(pull_up_lengths)):
-            bit = False
-            if pull_up_lengths[i] > halfway:
-                bit = True
-            bits.append(bit)
-
-        return bits
-
-    def __bits_to_bytes(self, bits):
-        the_bytes = []
-        byte = 0
-
-        for i in range(0, len(bits)):
-            byte = byte << 1
-            if (bits[i]):
-                byte = byte | 1
-            else:
-                byte = byte | 0
-            if ((i + 1) % 8 == 0):
-                the_bytes.append(byte)
-                byte = 0
-
-        return the_bytes
-
-    def __calculate_checksum(self, the_bytes):
-        return the_bytes[0] + the_bytes[1] + the_bytes[2] + the_bytes[3] & 255
+        # send start signal and record the edge timestamps of the answer
+        timestamps, levels = self.__capture.read_edges()
+        return decode_edges(timestamps, levels, self.__isDht11)
 
 
 # ----------------------------------------------------------------------------------------------------------------
 # Static utility methods
 # ----------------------------------------------------------------------------------------------------------------
 
-def get_sensor_data(used_pin, is_dht11_sensor):
+class RetryPolicy:
     """
-    Returns temperature and humidity data measures by AM2302 Sensor.
+    Decides when a sensor may be read next. Two reads are at least the minimum interval of the datasheet apart, which
+    is measured from the last attempt, so the first attempt of a cycle does not wait if the sensor was idle long enough.
+    After a failed read, corrupted data (missing bits, crc, low confidence) is retried after the minimum interval,
+    while a sensor not answering is backed off exponentially. All attempts of a read end within deadline_s.
     """
-    max_tries = 15
-    tries = 0
-    used_sensor = DHT(used_pin, is_dht11_sensor)
+
+    def __init__(self, is_dht11: bool, deadline_s: float = 20.0, max_backoff_s: float = 8.0) -> None:
+        self.min_interval_s = 1.0 if is_dht11 else 2.0
+        self.deadline_s = deadline_s
+        self.max_backoff_s = max(max_backoff_s, self.min_interval_s)
+
+    def __str__(self):
+        return f"RetryPolicy[min_interval: {self.min_interval_s}s, deadline: {self.deadline_s}s, max_backoff: {self.max_backoff_s}s]"
+
+    @staticmethod
+    def from_config(is_dht11: bool) -> RetryPolicy:
+        cfg = None if core_configuration.config is None else core_configuration.sensor_config()
+        if cfg is None:
+            return RetryPolicy(is_dht11)
+        return RetryPolicy(is_dht11, deadline_s=cfg.getfloat('retry_deadline_s', 20.0),
+                           max_backoff_s=cfg.getfloat('retry_max_backoff_s', 8.0))
+
+    def backoff_s(self, error_code: int, consecutive_failures: int) -> float:
+        """Seconds between the failed attempt and the next one."""
+        if error_code == DHTResult.ERR_NOT_FOUND:
+            return min(self.max_backoff_s, self.min_interval_s * 2 ** (consecutive_failures - 1))
+        return self.min_interval_s
+
+
+# monotonic time of the last attempt and last successful read per pin
+_last_attempt: Dict[int, float] = {}
+_last_success: Dict[int, float] = {}
+
+
+def parse_sensor_definitions(value: str) -> List[SensorDefinition]:
+    """Parses a comma separated list of id:type:pin, e.g., 'living:dht22:4, shelf:dht22:17'. The first one is primary."""
+    sensors = []
+    for definition in [d.strip() for d in value.split(',') if d.strip() != '']:
+        parts = [p.strip() for p in definition.split(':')]
+        if len(parts) != 3 or re.fullmatch(r"[A-Za-z0-9_-]+", parts[0]) is None or not parts[2].isdigit():
+            raise ValueError(f"Invalid sensor definition '{definition}'. Use id:type:pin, e.g., living:dht22:4")
+        if parts[1].lower() not in SUPPORTED_SENSORS:
+            raise TypeError(f"Sensor {parts[0]} is configured with unsupported sensor type {parts[1]}")
+        if parts[0] in [s.sensor_id for s in sensors]:
+            raise ValueError(f"Sensor id {parts[0]} is configured more than once")
+        sensors.append(SensorDefinition(parts[0], parts[1].lower(), int(parts[2]), primary=len(sensors) == 0))
+    return sensors
+
+
+def get_sensor_definitions() -> List[SensorDefinition]:
+    """Returns the sensors of the optional section sensor or the sensor of section core if there are none."""
+    cfg = core_configuration.sensor_config()
+    sensors = parse_sensor_definitions(cfg.get('sensors', '')) if cfg is not None else []
+    if len(sensors) == 0:
+        sensor_type = core_configuration.get_sensor_type(SUPPORTED_SENSORS)
+        sensors = [SensorDefinition(DEFAULT_SENSOR_ID, sensor_type, int(core_configuration.core_config()['sensor_pin']),
+                                    primary=True)]
+    return sensors
+
+
+def get_sensor_data(used_pin, is_dht11_sensor, policy: Optional[RetryPolicy] = None,
+                    sensor: Optional[SensorDefinition] = None):
+    """
+    Returns temperature and humidity data measured by the DHT sensor or None, None if the sensor could not be read
+    within the deadline of the retry policy. Without sensor definition, the values are published as room values.
+    """
+    policy = RetryPolicy.from_config(is_dht11_sensor) if policy is None else policy
+    # with a reader process, the capture runs isolated from the threads of this process
+    reader = get_sensor_reader()
+    used_sensor = DHT(used_pin, is_dht11_sensor) if reader is None else None
     metric_publisher = PrometheusManager()
+    sensor_id = f"pin{used_pin}" if sensor is None else sensor.sensor_id
+    started = time.monotonic()
+    deadline = started + policy.deadline_s
+    wait_s = policy.min_interval_s
+    tries = 0
+    consecutive_failures = 0
+    last_error = None
     while True:
-        if tries >= max_tries:
-            log.error(f"Failed to retrieve data from AM2302 sensor: Maximum retries reached.")
-            break
-        else:
-            time.sleep(2)
-            result = used_sensor.read()
-            # Different errors while reading the sensor data can happen often, just retry.
-            if result.error_code == DHTResult.ERR_NOT_FOUND:
-                tries += 1
-                metric_publisher.inc_failed_temp_senor_read()
-                log.warning(f"({tries}/{max_tries}) Sensor could not be found. Using correct pin?")
-                continue
-            elif not result.is_valid():
-                tries += 1
-                metric_publisher.inc_failed_temp_senor_read()
-                log.warning(f"({tries}/{max_tries}) Sensor data invalid")
-                continue
-            elif result.is_valid() and result.error_code == DHTResult.ERR_NO_ERROR:
+        next_attempt = _last_attempt.get(used_pin, float('-inf')) + wait_s
+        now = time.monotonic()
+        if max(now, next_attempt) > deadline:
+            since_success = now - _last_success[used_pin] if used_pin in _last_success else None
+            log.error(f"Failed to retrieve data from sensor after {tries} tries within {policy.deadline_s}s. "
+                      f"Last successful read: {'never' if since_success is None else f'{since_success:.0f}s ago'}")
+            return None, None
+        if next_attempt > now:
+            time.sleep(next_attempt - now)
+        _last_attempt[used_pin] = time.monotonic()
+        result = used_sensor.read() if reader is None else reader.read(used_pin, is_dht11_sensor)
+        tries += 1
+        metric_publisher.observe_sensor_attempt(sensor_id, result.error_name(), result.pull_ups,
+                                                time.monotonic() - _last_attempt[used_pin])
+        if result.is_valid():
+            _last_success[used_pin] = _last_attempt[used_pin]
+            metric_publisher.observe_sensor_read(sensor_id, time.monotonic() - started, tries - 1)
+            if sensor is None:
                 metric_publisher.measure_room_values(result.temperature, result.humidity)
-                return result.temperature, result.humidity
-    return None, None
+            else:
+                metric_publisher.measure_room_values(result.temperature, result.humidity, sensor.sensor_id,
+                                                     sensor.primary)
+            return result.temperature, result.humidity
+
+        # Different errors while reading the sensor data can happen often, just retry.
+        metric_publisher.inc_failed_temp_senor_read()
+        consecutive_failures = consecutive_failures + 1 if result.error_code == last_error else 1
+        last_error = result.error_code
+        wait_s = policy.backoff_s(result.error_code, consecutive_failures)
+        if result.error_code == DHTResult.ERR_NOT_FOUND:
+            log.warning(f"({tries}) Sensor could not be found. Using correct pin? Retrying in {wait_s:.1f}s")
+        else:
+            log.warning(f"({tries}) Sensor data invalid ({result.error_code}). Retrying in {wait_s:.1f}s")
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+from typing import Sequence
+
+from core.startup import lazy_import
+
+np = lazy_import("numpy")
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Decoder for the answer of DHT11, DHT22 and AM2302 sensors. Works on the edges recorded by core.sensors.capture and
+# has no side effects, so it can be tested and benchmarked with recorded traces.
+# - The edges are run-length encoded into periods with level and duration in microseconds
+# - A data bit is 1 if its pull up is longer than BIT_THRESHOLD_US, which lies between the datasheet timings
+# - The confidence of a frame is the smallest distance of a pull up to the threshold relative to the distance of the
+#   datasheet timings. Frames below min_confidence are rejected before the checksum is even considered
+# ----------------------------------------------------------------------------------------------------------------
+
+# datasheet timings of the data pull up periods in microseconds
+BIT_ZERO_US = 27
+BIT_ONE_US = 70
+BIT_THRESHOLD_US = (BIT_ZERO_US + BIT_ONE_US) / 2
+FRAME_BITS = 40
+DEFAULT_MIN_CONFIDENCE = 0.25
+
+
+# DHTxx sensor result returned by DHT.read() method'
+class DHTResult:
+    ERR_NO_ERROR = 0
+    ERR_MISSING_DATA = 1
+    ERR_CRC = 2
+    ERR_NOT_FOUND = 3
+    ERR_LOW_CONFIDENCE = 4
+    ERROR_NAMES = ["none", "missing_data", "crc", "not_found", "low_confidence"]
+
+    error_code = ERR_NO_ERROR
+    temperature = -1
+    humidity = -1
+    confidence = 0.0
+    pull_ups = 0
+
+    def __init__(self, error_code, temperature, humidity, confidence=0.0, pull_ups=0):
+        self.error_code = error_code
+        self.temperature = temperature
+        self.humidity = humidity
+        self.confidence = confidence
+        # number of data pull ups seen in the answer, a complete frame has FRAME_BITS
+        self.pull_ups = pull_ups
+
+    def __repr__(self):
+        return (f"DHTResult(error_code={self.error_code}, temperature={self.temperature}, humidity={self.humidity}, "
+                f"confidence={self.confidence:.2f}, pull_ups={self.pull_ups})")
+
+    def is_valid(self):
+        return self.error_code == DHTResult.ERR_NO_ERROR
+
+    def error_name(self) -> str:
+        return DHTResult.ERROR_NAMES[self.error_code]
+
+
+def pull_up_lengths_us(timestamps_ns: Sequence[int], levels: Sequence[int]) -> np.ndarray:
+    """
+    Returns the lengths of the data pull up periods in microseconds. The sensor answers with an initial pull down and
+    pull up, followed by a pull down before every bit. The length of the pull up after it encodes the bit.
+    """
+    timestamps = np.asarray(timestamps_ns, dtype=np.int64)
+    run_levels = np.asarray(levels, dtype=np.uint8)[:-1]
+    run_lengths = np.diff(timestamps) / 1000
+    lows = np.flatnonzero(run_levels == 0)
+    if len(lows) == 0:
+        return np.empty(0)
+    # skip the initial pull down + pull up and the pull down of the first bit, the last pull up has no end
+    data_start = lows[0] + 3
+    is_pull_up = run_levels[data_start:] == 1
+    return run_lengths[data_start:][is_pull_up]
+
+
+def frame_confidence(pull_ups_us: np.ndarray) -> float:
+    margin = np.abs(pull_ups_us - BIT_THRESHOLD_US) / (BIT_THRESHOLD_US - BIT_ZERO_US)
+    return float(np.clip(margin, 0, 1).min())
+
+
+def decode_pull_ups(pull_ups_us: Sequence[float], is_dht11: bool,
+                    min_confidence: float = DEFAULT_MIN_CONFIDENCE) -> DHTResult:
+    pull_ups = np.asarray(pull_ups_us, dtype=np.float64)
+    if len(pull_ups) == 0:
+        return DHTResult(DHTResult.ERR_NOT_FOUND, 0, 0)
+    # if bit count mismatch, return error (4 byte data + 1 byte checksum)
+    if len(pull_ups) != FRAME_BITS:
+        return DHTResult(DHTResult.ERR_MISSING_DATA, 0, 0, pull_ups=len(pull_ups))
+
+    confidence = frame_confidence(pull_ups)
+    if confidence < min_confidence:
+        return DHTResult(DHTResult.ERR_LOW_CONFIDENCE, 0, 0, confidence, FRAME_BITS)
+
+    the_bytes = np.packbits(pull_ups > BIT_THRESHOLD_US).tolist()
+    if the_bytes[4] != sum(the_bytes[:4]) & 255:
+        return DHTResult(DHTResult.ERR_CRC, 0, 0, confidence, FRAME_BITS)
+
+    # the_bytes[0]: humidity int, the_bytes[1]: humidity decimal
+    # the_bytes[2]: temperature int, the_bytes[3]: temperature decimal
+    if is_dht11:
+        # DHT11 returns 1 in MSB of the_bytes[3] when sub-zero temperature
+        temperature = the_bytes[2] + float(the_bytes[3] & 0x7F) / 10
+        if the_bytes[3] & 0x80:
+            temperature = -temperature
+        humidity = the_bytes[0] + float(the_bytes[1]) / 10
+    else:
+        # DHT22 returns 1 in MSB of the_bytes[2] when sub-zero temperature
+        temperature = float(((the_bytes[2] & 0x7F) << 8) + the_bytes[3]) / 10
+        if temperature > 125:
+            temperature = the_bytes[2]
+        if the_bytes[2] & 0x80:
+            temperature = -temperature
+        humidity = ((the_bytes[0] << 8) + the_bytes[1]) / 10.00
+    return DHTResult(DHTResult.ERR_NO_ERROR, temperature, humidity, confidence, FRAME_BITS)
+
+
+def decode_edges(timestamps_ns: Sequence[int], levels: Sequence[int], is_dht11: bool,
+                 min_confidence: float = DEFAULT_MIN_CONFIDENCE) -> DHTResult:
+    """Decodes the edges of a sensor answer, i.e., timestamps in nanoseconds and the level after each edge."""
+    if len(timestamps_ns) < 2:
+        return DHTResult(DHTResult.ERR_NOT_FOUND, 0, 0)
+    return decode_pull_ups(pull_up_lengths_us(timestamps_ns, levels), is_dht11, min_confidence)
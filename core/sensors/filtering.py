@@ -0,0 +1,129 @@
+import copy
+from collections import deque
+from statistics import median
+from typing import Dict, List, Optional, Tuple
+
+from core import core_configuration
+from core.core_log import get_logger
+from core.sensors.dht import SensorDefinition
+
+log = get_logger(__name__)
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Streaming filters for the stored readings. DHT sensors occasionally answer with plausible values which pass the
+# checksum but are wrong, e.g., a single 35*C between 21*C readings. Such spikes distort the statistics of the emails
+# and trigger false heat warnings, so every reading passes a filter before it is stored.
+# - HampelFilter replaces a value by the median of the last window if it deviates more than n_sigmas times the
+#   scaled median absolute deviation. It does not smooth, regular readings are stored unchanged
+# - KalmanFilter is a scalar Kalman filter with constant state, which smooths every reading
+# Both need constant time per reading. The raw readings are stored besides the filtered ones, see SensorDataHandler.
+# The filter is configured in the optional section sensor, the default is no filter.
+# ----------------------------------------------------------------------------------------------------------------
+
+SUPPORTED_FILTERS = ["none", "hampel", "kalman"]
+# scales the median absolute deviation to the standard deviation of normal distributed values
+MAD_SCALE = 1.4826
+
+
+class HampelFilter:
+
+    def __init__(self, window: int = 7, n_sigmas: float = 3.0, min_deviation: float = 1.0) -> None:
+        self.window = deque(maxlen=max(3, window))
+        self.n_sigmas = n_sigmas
+        # readings of a DHT sensor are often equal, so the deviation is 0 and every change would be an outlier
+        self.min_deviation = min_deviation
+
+    def update(self, value: float) -> Tuple[float, bool]:
+        """Returns the filtered value and whether the value was an outlier."""
+        self.window.append(value)
+        if len(self.window) < 3:
+            return value, False
+        window_median = median(self.window)
+        mad = median([abs(v - window_median) for v in self.window])
+        if abs(value - window_median) > max(self.n_sigmas * MAD_SCALE * mad, self.min_deviation):
+            return window_median, True
+        return value, False
+
+
+class KalmanFilter:
+
+    def __init__(self, process_variance: float = 0.01, measurement_variance: float = 0.25) -> None:
+        self.process_variance = process_variance
+        self.measurement_variance = measurement_variance
+        self.estimate: Optional[float] = None
+        self.error = 1.0
+
+    def update(self, value: float) -> Tuple[float, bool]:
+        """Returns the new estimate. Readings are smoothed and never rejected."""
+        if self.estimate is None:
+            self.estimate = value
+            return value, False
+        self.error += self.process_variance
+        gain = self.error / (self.error + self.measurement_variance)
+        self.estimate += gain * (value - self.estimate)
+        self.error *= 1 - gain
+        return self.estimate, False
+
+
+class ReadingFilter:
+    """Filters temperature and humidity of a sensor independently."""
+
+    def __init__(self, temperature_filter, humidity_filter) -> None:
+        self.temperature_filter = temperature_filter
+        self.humidity_filter = humidity_filter
+        self.outliers = 0
+
+    def __str__(self):
+        return f"ReadingFilter[{type(self.temperature_filter).__name__}, outliers: {self.outliers}]"
+
+    def update(self, temperature: float, humidity: float) -> Tuple[float, float]:
+        filtered_temperature, temperature_outlier = self.temperature_filter.update(temperature)
+        filtered_humidity, humidity_outlier = self.humidity_filter.update(humidity)
+        if temperature_outlier or humidity_outlier:
+            self.outliers += 1
+            log.warning(f"Replaced outlier {temperature}*C, {humidity}% with {filtered_temperature}*C, "
+                        f"{filtered_humidity}%")
+        return round(filtered_temperature, 1), round(filtered_humidity, 1)
+
+    def snapshot(self) -> Tuple:
+        """Returns a copy of the filter state, e.g., to undo the updates of a reading which could not be stored."""
+        return copy.deepcopy((self.temperature_filter, self.humidity_filter, self.outliers))
+
+    def restore(self, snapshot: Tuple) -> None:
+        self.temperature_filter, self.humidity_filter, self.outliers = snapshot
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Static utility methods
+# ----------------------------------------------------------------------------------------------------------------
+
+def create_filter(name: str, window: int = 7, n_sigmas: float = 3.0, min_deviation: float = 1.0,
+                  process_variance: float = 0.01, measurement_variance: float = 0.25) -> Optional[ReadingFilter]:
+    """Returns a filter for temperature and humidity or None for filter none."""
+    if name == "hampel":
+        return ReadingFilter(HampelFilter(window, n_sigmas, min_deviation), HampelFilter(window, n_sigmas, min_deviation))
+    if name == "kalman":
+        return ReadingFilter(KalmanFilter(process_variance, measurement_variance),
+                             KalmanFilter(process_variance, measurement_variance))
+    if name != "none":
+        log.error(f"Unsupported filter {name}, readings are stored unfiltered")
+    return None
+
+
+def create_filters(sensors: List[SensorDefinition]) -> Dict[str, ReadingFilter]:
+    """Returns a filter per sensor id configured by the optional section sensor or an empty dict without filter."""
+    cfg = core_configuration.sensor_config()
+    if cfg is None:
+        return {}
+    filters = {}
+    for sensor in sensors:
+        reading_filter = create_filter(cfg.get('filter', 'none').lower().strip(),
+                                       window=cfg.getint('filter_window', 7),
+                                       n_sigmas=cfg.getfloat('filter_sigmas', 3.0),
+                                       min_deviation=cfg.getfloat('filter_min_deviation', 1.0),
+                                       process_variance=cfg.getfloat('filter_process_variance', 0.01),
+                                       measurement_variance=cfg.getfloat('filter_measurement_variance', 0.25))
+        if reading_filter is not None:
+            filters[sensor.sensor_id] = reading_filter
+    return filters
@@ -0,0 +1,204 @@
+import bisect
+import json
+import os
+import random
+import time
+from threading import Lock
+from typing import Callable, List, Optional, Tuple
+
+from core import core_configuration
+from core.core_log import get_logger
+from core.startup import lazy_import
+
+log = get_logger(__name__)
+
+# ----------------------------------------------------------------------------------------------------------------
+# GPIO backends. The sensor modules never import RPi.GPIO directly but use get_gpio(), which returns either
+# - RPi.GPIO on the Raspberry Pi (default) or
+# - SimulatedGPIO which replays DHT11/DHT22 answers, so the sensor code and the instances run on plain Linux.
+# The backend is chosen by the environment variable HOMETEMP_GPIO_BACKEND or gpio_backend in the optional section
+# sensor of the config.ini. Both support rpi and simulator.
+# Traces are lists of edges (timestamp in ns, level), as recorded by EdgeCapture.edges(). They are either loaded from
+# a file with one json object {"timestamps_ns": [...], "levels": [...]} per line or synthesized.
+# A backend provides the clock used for timing edges. The simulator clock runs at the replay speed, i.e., with a speed
+# of 0.1 a trace is replayed ten times slower, which is useful on slow machines or with a profiler attached.
+# ----------------------------------------------------------------------------------------------------------------
+
+BACKEND_ENV = "HOMETEMP_GPIO_BACKEND"
+SUPPORTED_BACKENDS = ["rpi", "simulator"]
+
+Trace = Tuple[List[int], List[int]]
+
+
+class SimulatedGPIO:
+    # same values as RPi.GPIO
+    BCM = 11
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_UP = 22
+
+    def __init__(self, traces: List[Trace], speed: float = 1.0, shuffle: bool = False) -> None:
+        if len(traces) == 0:
+            raise ValueError("Simulator requires at least one trace")
+        self.traces = [_relative(t) for t in traces]
+        self.speed = speed
+        self.shuffle = shuffle
+        self.replays = 0
+        self._next = 0
+        self._offsets: List[int] = [0]
+        self._levels: List[int] = [SimulatedGPIO.HIGH]
+        self._start_ns = time.perf_counter_ns()
+        self._lock = Lock()
+
+    def __str__(self):
+        return f"SimulatedGPIO[traces: {len(self.traces)}, speed: {self.speed}]"
+
+    def clock_ns(self) -> int:
+        return int(time.perf_counter_ns() * self.speed)
+
+    def setwarnings(self, flag: bool) -> None:
+        pass
+
+    def setmode(self, mode: int) -> None:
+        log.info(f"Using {self}")
+
+    def cleanup(self) -> None:
+        pass
+
+    def output(self, pin: int, value: int) -> None:
+        pass
+
+    def setup(self, pin: int, mode: int, pull_up_down: Optional[int] = None) -> None:
+        """Switching to input is the end of the start signal, the sensor answers with the next trace."""
+        if mode != SimulatedGPIO.IN:
+            return
+        with self._lock:
+            idx = random.randrange(len(self.traces)) if self.shuffle else self._next % len(self.traces)
+            self._next += 1
+            self.replays += 1
+            self._offsets, self._levels = self.traces[idx]
+            self._start_ns = self.clock_ns()
+
+    def input(self, pin: int) -> int:
+        elapsed = self.clock_ns() - self._start_ns
+        return self._levels[max(0, bisect.bisect_right(self._offsets, elapsed) - 1)]
+
+
+def _relative(trace: Trace) -> Trace:
+    timestamps, levels = trace
+    return [t - timestamps[0] for t in timestamps], list(levels)
+
+
+def synthesize_trace(temperature: float, humidity: float, is_dht11: bool, jitter_us: float = 0,
+                     truncate_bits: Optional[int] = None, seed: int = 0) -> Trace:
+    """
+    Synthesizes the answer of a sensor with the datasheet timings. jitter_us adds gaussian noise to every period,
+    truncate_bits stops the answer after this number of bits.
+    """
+    if is_dht11:
+        t = int(round(abs(temperature) * 10))
+        data = [int(humidity), int(round(humidity * 10)) % 10, t // 10, (t % 10) | (0x80 if temperature < 0 else 0)]
+    else:
+        t, h = int(round(abs(temperature) * 10)), int(round(humidity * 10))
+        data = [h >> 8, h & 255, (t >> 8) | (0x80 if temperature < 0 else 0), t & 255]
+    data.append(sum(data) & 255)
+    bits = [(byte >> (7 - i)) & 1 for byte in data for i in range(8)][:truncate_bits]
+
+    rng = random.Random(seed)
+    # pull up when capturing starts, answer of the sensor and release of the line at the end
+    periods = [(1, 20), (0, 80), (1, 80)]
+    for bit in bits:
+        periods += [(0, 50), (1, 70 if bit else 27)]
+    periods += [(0, 50), (1, 0)]
+    timestamps, levels, now = [], [], 0
+    for level, length_us in periods:
+        timestamps.append(now)
+        levels.append(level)
+        now += max(1, int((length_us + rng.gauss(0, jitter_us)) * 1000))
+    return timestamps, levels
+
+
+def default_traces(is_dht11: bool) -> List[Trace]:
+    """Clean, noisy and truncated answers of a sensor in a room with slowly changing values."""
+    traces = []
+    for i in range(20):
+        temperature, humidity = 21.0 + (i % 5) / 10, 50.0 + i % 7
+        if i % 10 == 3:
+            traces.append(synthesize_trace(temperature, humidity, is_dht11, truncate_bits=31, seed=i))
+        elif i % 4 == 1:
+            traces.append(synthesize_trace(temperature, humidity, is_dht11, jitter_us=6, seed=i))
+        else:
+            traces.append(synthesize_trace(temperature, humidity, is_dht11, jitter_us=1, seed=i))
+    return traces
+
+
+def save_traces(path: str, traces: List[Trace]) -> None:
+    with open(path, "a") as f:
+        for timestamps, levels in traces:
+            f.write(json.dumps({"timestamps_ns": list(timestamps), "levels": list(levels)}) + "\n")
+
+
+def load_traces(path: str) -> List[Trace]:
+    traces = []
+    with open(path) as f:
+        for line in f:
+            if line.strip() != "":
+                trace = json.loads(line)
+                traces.append((trace["timestamps_ns"], trace["levels"]))
+    return traces
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Static utility methods
+# ----------------------------------------------------------------------------------------------------------------
+
+_gpio = None
+_gpio_lock = Lock()
+
+
+def get_backend_name() -> str:
+    name = os.environ.get(BACKEND_ENV)
+    if name is None and core_configuration.config is not None:
+        cfg = core_configuration.sensor_config()
+        name = None if cfg is None else cfg.get('gpio_backend')
+    name = (name or SUPPORTED_BACKENDS[0]).lower().strip()
+    if name not in SUPPORTED_BACKENDS:
+        log.error(f"Unsupported GPIO backend {name}, using {SUPPORTED_BACKENDS[0]}")
+        return SUPPORTED_BACKENDS[0]
+    return name
+
+
+def _create_simulator() -> SimulatedGPIO:
+    cfg = None if core_configuration.config is None else core_configuration.sensor_config()
+    speed = 1.0 if cfg is None else cfg.getfloat('simulator_speed', 1.0)
+    traces_path = None if cfg is None else cfg.get('simulator_traces', '').strip()
+    if traces_path:
+        traces = load_traces(traces_path)
+        log.info(f"Loaded {len(traces)} sensor traces from {traces_path}")
+    else:
+        is_dht11 = core_configuration.config is not None and \
+                   core_configuration.core_config().get('sensor_type', '').lower().strip() == "dht11"
+        traces = default_traces(is_dht11)
+    return SimulatedGPIO(traces, speed=speed)
+
+
+def get_gpio():
+    """Returns the GPIO backend of this process, i.e., the RPi.GPIO module or a SimulatedGPIO."""
+    global _gpio
+    with _gpio_lock:
+        if _gpio is None:
+            _gpio = _create_simulator() if get_backend_name() == "simulator" else lazy_import("RPi.GPIO")
+        return _gpio
+
+
+def set_gpio(gpio) -> None:
+    """Replaces the GPIO backend of this process, e.g., with a SimulatedGPIO using specific traces."""
+    global _gpio
+    with _gpio_lock:
+        _gpio = gpio
+
+
+def get_clock(gpio) -> Callable[[], int]:
+    return gpio.clock_ns if isinstance(gpio, SimulatedGPIO) else time.perf_counter_ns
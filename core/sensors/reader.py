@@ -0,0 +1,189 @@
+import atexit
+import gc
+import multiprocessing
+import os
+from multiprocessing.connection import Connection
+from threading import Lock
+from typing import Dict, Optional, Tuple
+
+from core import core_configuration
+from core.core_log import get_logger, setup_logging
+from core.sensors.dht_decoder import DHTResult
+from core.sensors.gpio import SimulatedGPIO, get_gpio, set_gpio
+
+log = get_logger(__name__)
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Isolated sensor reader. The timing critical capture of the DHT answer runs in a small dedicated process, so it does
+# not compete for the GIL with the endpoints, the metric polling or the plotting of the instance process.
+# - The process is pinned to one cpu with sched_setaffinity and gets a real-time or higher priority where permitted
+# - Requests (pin, is_dht11) and DHTResults are exchanged over a pipe, one read at a time
+# - The process is started with the first read and restarted if it died or did not answer within timeout_s
+# - A simulated GPIO backend is handed over to the process, so the reader works off-device as well
+# The reader is enabled with reader_process in the optional section sensor. Otherwise sensors are read in-process.
+# ----------------------------------------------------------------------------------------------------------------
+
+class SensorReaderProcess:
+
+    def __init__(self, cpu: Optional[int] = None, priority: int = 0, timeout_s: float = 5.0) -> None:
+        self.cpu = cpu
+        self.priority = priority
+        self.timeout_s = timeout_s
+        self.restarts = 0
+        self._process: Optional[multiprocessing.Process] = None
+        self._conn: Optional[Connection] = None
+        self._lock = Lock()
+
+    def __str__(self):
+        return f"SensorReaderProcess[cpu: {self.cpu}, priority: {self.priority}, timeout: {self.timeout_s}s]"
+
+    def is_alive(self) -> bool:
+        return self._process is not None and self._process.is_alive()
+
+    def start(self) -> None:
+        """Spawn is used because the instance process is threaded."""
+        with self._lock:
+            self._start()
+
+    def _start(self) -> None:
+        if self.is_alive():
+            return None
+        if self._process is not None:
+            log.warning(f"Sensor reader exited with code {self._process.exitcode}, restarting it")
+            self._conn.close()
+            self.restarts += 1
+        gpio = get_gpio()
+        simulator = (gpio.traces, gpio.speed, gpio.shuffle) if isinstance(gpio, SimulatedGPIO) else None
+        ctx = multiprocessing.get_context("spawn")
+        self._conn, child_conn = ctx.Pipe()
+        self._process = ctx.Process(target=_reader_main, args=(child_conn, self.cpu, self.priority, simulator),
+                                    name="sensor-reader", daemon=True)
+        self._process.start()
+        child_conn.close()
+        log.info(f"Started {self} with pid {self._process.pid}")
+
+    def stop(self) -> None:
+        with self._lock:
+            self._stop()
+
+    def _stop(self) -> None:
+        if self._process is None:
+            return None
+        try:
+            self._conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self._process.join(self.timeout_s)
+        if self._process.is_alive():
+            self._process.kill()
+            self._process.join()
+        self._conn.close()
+        self._process, self._conn = None, None
+        log.info(f"Stopped {self}")
+
+    def read(self, pin: int, is_dht11: bool) -> DHTResult:
+        """Reads the sensor once in the reader process. Returns ERR_NOT_FOUND if the process did not answer."""
+        with self._lock:
+            self._start()
+            try:
+                self._conn.send((pin, is_dht11))
+                if self._conn.poll(self.timeout_s):
+                    return self._conn.recv()
+                log.error(f"Sensor reader did not answer within {self.timeout_s}s, restarting it")
+            except (EOFError, OSError) as e:
+                log.error(f"Sensor reader died, restarting it: {str(e)}")
+            self._stop()
+            self.restarts += 1
+            return DHTResult(DHTResult.ERR_NOT_FOUND, 0, 0)
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Reader side. These functions are executed inside the reader process.
+# ----------------------------------------------------------------------------------------------------------------
+
+def _isolate(cpu: Optional[int], priority: int) -> None:
+    if cpu is not None:
+        try:
+            os.sched_setaffinity(0, {cpu})
+            log.info(f"Sensor reader pinned to cpu {cpu}")
+        except (AttributeError, OSError) as e:
+            log.warning(f"Could not pin sensor reader to cpu {cpu}: {str(e)}")
+    if priority <= 0:
+        return None
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+        log.info(f"Sensor reader runs with real-time priority {priority}")
+    except (AttributeError, OSError):
+        # real-time scheduling requires CAP_SYS_NICE, a lower nice value is the next best thing
+        try:
+            os.nice(-min(priority, 20))
+            log.info(f"Sensor reader runs with nice value {os.nice(0)}")
+        except OSError:
+            log.info("Sensor reader runs with normal priority, elevated priorities are not permitted")
+
+
+def _reader_main(conn: Connection, cpu: Optional[int], priority: int,
+                 simulator: Optional[Tuple[list, float, bool]]) -> None:
+    setup_logging()
+    _isolate(cpu, priority)
+    if simulator is not None:
+        set_gpio(SimulatedGPIO(*simulator))
+    # imported here, core.sensors.dht uses this module
+    from core.sensors.dht import DHT
+    # the objects of the setup are never collected, which keeps later collections short
+    gc.freeze()
+    sensors: Dict[Tuple[int, bool], DHT] = {}
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, OSError):
+            break
+        if request is None:
+            break
+        try:
+            if request not in sensors:
+                sensors[request] = DHT(*request)
+            # the collector can not pause a capture, cycles of the error paths are collected between reads
+            gc.disable()
+            try:
+                result = sensors[request].read()
+            finally:
+                gc.enable()
+        except Exception as e:
+            log.error(f"Error while reading sensor on pin {request[0]}: {str(e)}")
+            result = DHTResult(DHTResult.ERR_NOT_FOUND, 0, 0)
+        conn.send(result)
+    conn.close()
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Static utility methods
+# ----------------------------------------------------------------------------------------------------------------
+
+_reader: Optional[SensorReaderProcess] = None
+_reader_lock = Lock()
+
+
+def get_sensor_reader() -> Optional[SensorReaderProcess]:
+    """Returns the reader process configured by the optional section sensor or None if sensors are read in-process."""
+    global _reader
+    with _reader_lock:
+        if _reader is None:
+            cfg = None if core_configuration.config is None else core_configuration.sensor_config()
+            if cfg is None or not cfg.getboolean('reader_process', False):
+                return None
+            cpu = cfg.getint('reader_cpu', -1)
+            _reader = SensorReaderProcess(cpu=None if cpu < 0 else cpu, priority=cfg.getint('reader_priority', 0),
+                                          timeout_s=cfg.getfloat('reader_timeout_s', 5.0))
+            atexit.register(_reader.stop)
+        return _reader
+
+
+def set_sensor_reader(reader: Optional[SensorReaderProcess]) -> None:
+    """Replaces the reader of this process, None reads sensors in-process."""
+    global _reader
+    with _reader_lock:
+        if _reader is not None and _reader is not reader:
+            _reader.stop()
+        _reader = reader
@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import time
+from threading import Event, Lock, Thread
+from typing import Dict, List, Optional, Tuple
+
+from core import core_configuration
+from core.core_log import get_logger
+from core.sensors.dht import SensorDefinition, get_sensor_data
+from core.sensors.filtering import ReadingFilter
+from core.startup import lazy_import
+
+log = get_logger(__name__)
+np = lazy_import("numpy")
+
+# ----------------------------------------------------------------------------------------------------------------
+# Background sampling of a sensor. The SensorSampler reads the sensor at a fixed interval in a daemon thread and keeps
+# the last readings in a fixed-size NumPy ring buffer.
+# - Scheduled database writes store an aggregate (median or trimmed mean) of the readings of the last window
+# - Endpoints and Prometheus use the latest reading from memory and never wait for the GPIO
+# - Every successful read updates the room metrics, see get_sensor_data
+# The sampler is configured in the optional section sensor and disabled if sampler_interval_s is 0.
+# With multiple sensors, there is one sampler per sensor. Their first reads are staggered over the interval, so the
+# sensors are read one after another and not in bursts, see create_samplers.
+# High frequency mode: with aggregation_period_s > 0, every reading is also added to a BucketAggregator. The database
+# then stores a row with min/mean/max/count per period instead of one aggregate of the window per scheduled write,
+# so sampling every few seconds does not multiply the rows. The raw readings are only kept in the ring buffer.
+# ----------------------------------------------------------------------------------------------------------------
+
+SUPPORTED_AGGREGATIONS = ["median", "trimmed_mean"]
+
+
+class BucketAggregator:
+    """
+    Aggregates readings into buckets of period_s seconds with constant memory. A bucket is closed by the first reading of
+    a later bucket and kept until drain() is called. Readings pass the filter before they are aggregated.
+    """
+
+    def __init__(self, period_s: float = 60, reading_filter: Optional[ReadingFilter] = None,
+                 max_pending: int = 1440) -> None:
+        self.period_s = period_s
+        self.reading_filter = reading_filter
+        # bounds the memory if the database is not reachable for a long time, oldest buckets are dropped first
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._bucket: Optional[float] = None
+        self._stats: Dict[str, float] = {}
+        self._pending: List[dict] = []
+        self._lock = Lock()
+
+    def __str__(self):
+        return f"BucketAggregator[period: {self.period_s}s, pending: {len(self._pending)}]"
+
+    def add(self, temperature: float, humidity: float, timestamp: float) -> None:
+        if self.reading_filter is None:
+            filtered_temperature, filtered_humidity = temperature, humidity
+        else:
+            filtered_temperature, filtered_humidity = self.reading_filter.update(temperature, humidity)
+        bucket = timestamp - timestamp % self.period_s
+        with self._lock:
+            if bucket != self._bucket:
+                self._close()
+                self._bucket = bucket
+                self._stats = {'count': 0, 'room_temp': 0.0, 'humidity': 0.0, 'room_temp_raw': 0.0,
+                               'humidity_raw': 0.0, 'room_temp_min': filtered_temperature,
+                               'room_temp_max': filtered_temperature, 'humidity_min': filtered_humidity,
+                               'humidity_max': filtered_humidity}
+            stats = self._stats
+            stats['count'] += 1
+            # sums until the bucket is closed
+            stats['room_temp'] += filtered_temperature
+            stats['humidity'] += filtered_humidity
+            stats['room_temp_raw'] += temperature
+            stats['humidity_raw'] += humidity
+            stats['room_temp_min'] = min(stats['room_temp_min'], filtered_temperature)
+            stats['room_temp_max'] = max(stats['room_temp_max'], filtered_temperature)
+            stats['humidity_min'] = min(stats['humidity_min'], filtered_humidity)
+            stats['humidity_max'] = max(stats['humidity_max'], filtered_humidity)
+
+    def _close(self) -> None:
+        if self._bucket is None or self._stats['count'] == 0:
+            return None
+        stats, count = self._stats, self._stats['count']
+        row = {'timestamp': self._bucket, 'sample_count': count}
+        for key in ['room_temp', 'humidity', 'room_temp_raw', 'humidity_raw']:
+            row[key] = round(stats[key] / count, 2)
+        for key in ['room_temp_min', 'room_temp_max', 'humidity_min', 'humidity_max']:
+            row[key] = stats[key]
+        self._pending.append(row)
+        if len(self._pending) > self.max_pending:
+            self._pending.pop(0)
+            self.dropped += 1
+        self._bucket, self._stats = None, {}
+
+    def drain(self, include_open: bool = False) -> List[dict]:
+        """
+        Returns and forgets the closed buckets, oldest first. The timestamp of a bucket is the wall clock time of its
+        start. With include_open, the current bucket is closed as well, e.g., on shutdown.
+        """
+        with self._lock:
+            if include_open:
+                self._close()
+            out, self._pending = self._pending, []
+        return out
+
+    def restore(self, rows: List[dict]) -> None:
+        """Puts drained buckets back, e.g., if they could not be written."""
+        with self._lock:
+            self._pending = (rows + self._pending)[-self.max_pending:]
+
+
+class SensorSampler:
+    # columns of the ring buffer
+    _TIMESTAMP, _TEMPERATURE, _HUMIDITY = 0, 1, 2
+
+    def __init__(self, pin: int, is_dht11: bool, interval_s: float = 30, window: int = 20,
+                 aggregation: str = "median", trim: float = 0.2, sensor: Optional[SensorDefinition] = None,
+                 aggregator: Optional[BucketAggregator] = None) -> None:
+        if aggregation not in SUPPORTED_AGGREGATIONS:
+            log.error(f"Unsupported aggregation {aggregation}, using {SUPPORTED_AGGREGATIONS[0]}")
+            aggregation = SUPPORTED_AGGREGATIONS[0]
+        self.pin = pin
+        self.is_dht11 = is_dht11
+        self.interval_s = interval_s
+        self.window = max(1, window)
+        self.aggregation = aggregation
+        self.trim = min(max(trim, 0.0), 0.49)
+        self.sensor = sensor
+        self.aggregator = aggregator
+        # wall clock timestamp, temperature and humidity of a reading
+        self._buffer = np.full((self.window, 3), np.nan)
+        self._next = 0
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread: Optional[Thread] = None
+
+    def __str__(self):
+        return f"SensorSampler[pin: {self.pin}, interval: {self.interval_s}s, window: {self.window}, {self.aggregation}]"
+
+    def start(self, offset_s: float = 0) -> None:
+        """Starts sampling in the background. The first read happens after offset_s seconds."""
+        if self._thread is not None and self._thread.is_alive():
+            return None
+        self._stop.clear()
+        self._thread = Thread(target=self._run, args=(offset_s,), name=f"sampler-{self.pin}", daemon=True)
+        self._thread.start()
+        log.info(f"Started {self}")
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            log.info(f"Stopped {self}")
+
+    def _run(self, offset_s: float) -> None:
+        self._stop.wait(offset_s)
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                temperature, humidity = get_sensor_data(self.pin, self.is_dht11, sensor=self.sensor)
+                if temperature is not None and humidity is not None:
+                    self.add(temperature, humidity)
+            except Exception as e:
+                log.error(f"Error while sampling sensor on pin {self.pin}: {str(e)}")
+            self._stop.wait(max(0.0, self.interval_s - (time.monotonic() - started)))
+
+    def add(self, temperature: float, humidity: float, timestamp: Optional[float] = None) -> None:
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            self._buffer[self._next] = (timestamp, temperature, humidity)
+            self._next = (self._next + 1) % self.window
+        if self.aggregator is not None:
+            self.aggregator.add(temperature, humidity, timestamp)
+
+    def latest(self) -> Optional[Tuple[float, float, float]]:
+        """Returns timestamp, temperature and humidity of the latest reading or None if there is none yet."""
+        with self._lock:
+            timestamp, temperature, humidity = self._buffer[self._next - 1]
+        if np.isnan(timestamp):
+            return None
+        return float(timestamp), float(temperature), float(humidity)
+
+    def aggregate(self, max_age_s: Optional[float] = None) -> Optional[Tuple[float, float]]:
+        """
+        Returns temperature and humidity aggregated over the readings of the last max_age_s seconds, default is the
+        duration of the window. Returns None if there is no such reading.
+        """
+        max_age_s = self.window * self.interval_s if max_age_s is None else max_age_s
+        with self._lock:
+            readings = self._buffer.copy()
+        readings = readings[readings[:, self._TIMESTAMP] >= time.time() - max_age_s]
+        if len(readings) == 0:
+            return None
+        values = readings[:, [self._TEMPERATURE, self._HUMIDITY]]
+        if self.aggregation == "median":
+            aggregated = np.median(values, axis=0)
+        else:
+            aggregated = _trimmed_mean(values, self.trim)
+        log.debug(f"Aggregated {len(values)} readings to {aggregated}")
+        return round(float(aggregated[0]), 1), round(float(aggregated[1]), 1)
+
+
+def _trimmed_mean(values: np.ndarray, trim: float) -> np.ndarray:
+    """Mean per column without the lowest and highest trim share of the values."""
+    cut = int(len(values) * trim)
+    return np.sort(values, axis=0)[cut:len(values) - cut].mean(axis=0)
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Static utility methods
+# ----------------------------------------------------------------------------------------------------------------
+
+def create_sampler(pin: int, is_dht11: bool, sensor: Optional[SensorDefinition] = None,
+                   reading_filter: Optional[ReadingFilter] = None) -> Optional[SensorSampler]:
+    """Returns a sampler configured by the optional section sensor or None if sampling is disabled."""
+    cfg = core_configuration.sensor_config()
+    if cfg is None or cfg.getfloat('sampler_interval_s', 0) <= 0:
+        return None
+    period_s = cfg.getfloat('aggregation_period_s', 0)
+    aggregator = BucketAggregator(period_s, reading_filter) if period_s > 0 else None
+    return SensorSampler(pin, is_dht11, interval_s=cfg.getfloat('sampler_interval_s'),
+                         window=cfg.getint('sampler_window', 20),
+                         aggregation=cfg.get('sampler_aggregation', SUPPORTED_AGGREGATIONS[0]).lower().strip(),
+                         trim=cfg.getfloat('sampler_trim', 0.2), sensor=sensor, aggregator=aggregator)
+
+
+def create_samplers(sensors: List[SensorDefinition],
+                    filters: Optional[Dict[str, ReadingFilter]] = None) -> Dict[str, SensorSampler]:
+    """
+    Returns a sampler per sensor id or an empty dict if sampling is disabled. In high frequency mode, the filter of a
+    sensor is applied to every reading before it is aggregated.
+    """
+    filters = {} if filters is None else filters
+    samplers = {}
+    for sensor in sensors:
+        sampler = create_sampler(sensor.pin, sensor.is_dht11, sensor, filters.get(sensor.sensor_id))
+        if sampler is not None:
+            samplers[sensor.sensor_id] = sampler
+    return samplers
+
+
+def start_samplers(samplers: Dict[str, SensorSampler]) -> None:
+    """Starts the samplers with their first reads spread evenly over the sampling interval."""
+    for i, sampler in enumerate(samplers.values()):
+        sampler.start(offset_s=i * sampler.interval_s / len(samplers))
@@ -0,0 +1,87 @@
+import importlib
+import time
+from contextlib import contextmanager
+from threading import Lock
+from types import ModuleType
+from typing import Any, Iterator, List, Optional, Tuple
+
+from core.core_log import get_logger
+
+log = get_logger(__name__)
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Startup module. Keeps the cold start of an instance small after reboots and watchdog restarts.
+# - Use lazy_import for heavy frameworks (matplotlib, pandas, cv2, selenium, docker, RPi.GPIO, ...) so they are only
+#   loaded when the subsystem using them is used for the first time
+# - Use startup_report.phase(name) to measure a startup phase. Lazily loaded modules are recorded automatically
+# - Use startup_report.log_report(budget_s) once the instance is started to log the timings and check the budget
+# This module must only depend on the standard library and core_log because it is imported first.
+# ----------------------------------------------------------------------------------------------------------------
+
+class StartupReport:
+
+    def __init__(self) -> None:
+        self.start_time = time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+        self.imports: List[Tuple[str, float]] = []
+        self._lock = Lock()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases.append((name, time.perf_counter() - start))
+
+    def record_import(self, module_name: str, duration_s: float) -> None:
+        with self._lock:
+            self.imports.append((module_name, duration_s))
+        log.debug(f"Loaded {module_name} in {duration_s:.3f}s")
+
+    def total_s(self) -> float:
+        return time.perf_counter() - self.start_time
+
+    def log_report(self, budget_s: Optional[float] = None) -> float:
+        """Logs the duration of every phase and lazy import and warns if the startup exceeded the budget."""
+        total = self.total_s()
+        with self._lock:
+            lines = [f"  phase  {name:<30} {duration:7.3f}s" for name, duration in self.phases]
+            lines += [f"  import {name:<30} {duration:7.3f}s" for name, duration in
+                      sorted(self.imports, key=lambda i: i[1], reverse=True)]
+        log.info("Startup report:\n" + "\n".join(lines + [f"  total  {'':<30} {total:7.3f}s"]))
+        if budget_s is not None and budget_s > 0 and total > budget_s:
+            log.warning(f"Startup took {total:.3f}s which exceeds the budget of {budget_s:.3f}s")
+        return total
+
+
+class LazyModule(ModuleType):
+    """Placeholder for a module which is imported on first attribute access."""
+
+    def __init__(self, module_name: str) -> None:
+        super().__init__(module_name)
+        self._lazy_module: Optional[ModuleType] = None
+
+    def _load(self) -> ModuleType:
+        if self._lazy_module is None:
+            start = time.perf_counter()
+            self._lazy_module = importlib.import_module(self.__name__)
+            startup_report.record_import(self.__name__, time.perf_counter() - start)
+        return self._lazy_module
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._load(), name)
+
+
+startup_report = StartupReport()
+
+
+def lazy_import(module_name: str) -> ModuleType:
+    """
+    Returns a placeholder for the module which imports it when an attribute is accessed the first time, e.g.,
+    plt = lazy_import("matplotlib.pyplot") and the first plt.subplots(...) loads matplotlib.
+    Annotations using lazy modules require 'from __future__ import annotations'.
+    """
+    return LazyModule(module_name)
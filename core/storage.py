@@ -0,0 +1,212 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from threading import Lock, Thread
+from typing import Dict, Optional
+
+from core import core_configuration
+from core.catalog import PICTURE_COMMANDED, PICTURE_TIMED, PLOT_COMMANDED, PLOT_TIMED, SUPPORTED_KINDS, \
+    CatalogEntry, PictureCatalog, get_catalog
+from core.core_log import get_logger
+from core.monitoring import PrometheusManager
+from core.previews import PREVIEW_FORMATS, PreviewPyramid, get_preview_pyramid
+from core.startup import lazy_import
+
+log = get_logger(__name__)
+Image = lazy_import("PIL.Image")
+psutil = lazy_import("psutil")
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Storage maintenance of pictures and plots. Full resolution PNGs fill the SD card, so a daily maintenance run reclaims
+# space in the order of the least loss:
+# 1. Pictures older than transcode_after_days are transcoded to JPEG or WebP
+# 2. Timed pictures older than thin_after_days are thinned to one picture per thin_interval_min
+# 3. Plots older than plot_retention_days are deleted
+# 4. If the pictures and plots still use more than budget_mb, the oldest timed pictures are deleted
+# Files are found with the catalog, see core.catalog, and previews of deleted pictures are deleted as well.
+# The run happens in a background thread with idle IO priority and the lowest CPU priority. Used and reclaimed bytes
+# are published to Prometheus. The maintenance is enabled with maintenance in the optional section storage.
+# ----------------------------------------------------------------------------------------------------------------
+
+PICTURE_KINDS = [PICTURE_TIMED, PICTURE_COMMANDED]
+
+
+class StorageManager:
+
+    def __init__(self, catalog: PictureCatalog, budget_mb: int = 0, transcode_after_days: int = 7,
+                 transcode_encoding: str = "jpg", transcode_quality: int = 85, thin_after_days: int = 30,
+                 thin_interval_min: int = 60, plot_retention_days: int = 90,
+                 pyramid: Optional[PreviewPyramid] = None) -> None:
+        if transcode_encoding not in PREVIEW_FORMATS:
+            log.error(f"Unsupported transcode encoding {transcode_encoding}, using jpg")
+            transcode_encoding = "jpg"
+        self.catalog = catalog
+        # 0 disables the corresponding step
+        self.budget_bytes = budget_mb * 1024 * 1024
+        self.transcode_after_days = transcode_after_days
+        self.transcode_encoding = transcode_encoding
+        self.transcode_quality = transcode_quality
+        self.thin_after_days = thin_after_days
+        self.thin_interval_s = thin_interval_min * 60
+        self.plot_retention_days = plot_retention_days
+        self.pyramid = pyramid
+        self._thread: Optional[Thread] = None
+        self._lock = Lock()
+
+    def __str__(self):
+        return f"StorageManager[budget: {self.budget_bytes // (1024 * 1024)}MB, transcode: {self.transcode_after_days}d, " \
+               f"thin: {self.thin_after_days}d, plots: {self.plot_retention_days}d]"
+
+    def _delete(self, entry: CatalogEntry) -> int:
+        """Deletes the file, its previews and its entry. Returns the reclaimed bytes."""
+        try:
+            entry.path.unlink(missing_ok=True)
+        except OSError as e:
+            log.error(f"Failed to delete {entry.path}: {str(e)}")
+            return 0
+        if self.pyramid is not None and entry.kind in PICTURE_KINDS:
+            for width in self.pyramid.widths:
+                self.pyramid.preview_path(str(entry.path), width).unlink(missing_ok=True)
+        self.catalog.remove(str(entry.path))
+        return entry.size
+
+    def transcode(self) -> int:
+        """Transcodes the old pictures which are not in the target encoding. Returns the reclaimed bytes."""
+        if self.transcode_after_days <= 0:
+            return 0
+        reclaimed = 0
+        end = datetime.now() - timedelta(days=self.transcode_after_days)
+        for kind in PICTURE_KINDS:
+            for entry in self.catalog.query(kind, end=end):
+                if entry.path.suffix == f".{self.transcode_encoding}":
+                    continue
+                target = entry.path.with_suffix(f".{self.transcode_encoding}")
+                tmp_path = target.with_name(f".{target.name}.tmp")
+                try:
+                    with Image.open(entry.path) as image:
+                        image.convert("RGB").save(tmp_path, format=PREVIEW_FORMATS[self.transcode_encoding],
+                                                  quality=self.transcode_quality)
+                    os.replace(tmp_path, target)
+                except Exception as e:
+                    log.error(f"Failed to transcode {entry.path}: {str(e)}")
+                    tmp_path.unlink(missing_ok=True)
+                    continue
+                entry.path.unlink(missing_ok=True)
+                self.catalog.remove(str(entry.path))
+                new_entry = self.catalog.add(str(target), kind)
+                reclaimed += entry.size - (0 if new_entry is None else new_entry.size)
+        return reclaimed
+
+    def thin(self) -> int:
+        """Keeps the first old timed picture per thin interval and deletes the others. Returns the reclaimed bytes."""
+        if self.thin_after_days <= 0 or self.thin_interval_s <= 0:
+            return 0
+        reclaimed = 0
+        last_bucket = None
+        end = datetime.now() - timedelta(days=self.thin_after_days)
+        for entry in self.catalog.query(PICTURE_TIMED, end=end):
+            bucket = entry.timestamp // self.thin_interval_s
+            if bucket == last_bucket:
+                reclaimed += self._delete(entry)
+            last_bucket = bucket
+        return reclaimed
+
+    def delete_plots(self) -> int:
+        if self.plot_retention_days <= 0:
+            return 0
+        end = datetime.now() - timedelta(days=self.plot_retention_days)
+        return sum(self._delete(entry) for kind in [PLOT_TIMED, PLOT_COMMANDED] for entry in self.catalog.query(kind, end=end))
+
+    def used_bytes(self) -> Dict[str, int]:
+        return {kind: self.catalog.total_size(kind) for kind in SUPPORTED_KINDS}
+
+    def enforce_budget(self) -> int:
+        """Deletes the oldest timed pictures until the budget is kept. Returns the reclaimed bytes."""
+        if self.budget_bytes <= 0:
+            return 0
+        excess = sum(self.used_bytes().values()) - self.budget_bytes
+        reclaimed = 0
+        for entry in self.catalog.query(PICTURE_TIMED):
+            if reclaimed >= excess:
+                break
+            reclaimed += self._delete(entry)
+        if reclaimed < excess:
+            log.warning(f"Storage budget of {self.budget_bytes} bytes exceeded by {excess - reclaimed} bytes without "
+                        f"timed pictures left to delete")
+        return reclaimed
+
+    def run(self) -> Dict[str, int]:
+        """Runs all steps and returns the reclaimed bytes per step."""
+        started = time.monotonic()
+        publisher = PrometheusManager()
+        reclaimed = {}
+        for step, method in [("transcode", self.transcode), ("thin", self.thin), ("plots", self.delete_plots),
+                             ("budget", self.enforce_budget)]:
+            try:
+                reclaimed[step] = method()
+            except Exception as e:
+                log.error(f"Storage maintenance step {step} failed: {str(e)}")
+                reclaimed[step] = 0
+            publisher.inc_storage_reclaimed(step, reclaimed[step])
+        for kind, used in self.used_bytes().items():
+            publisher.set_storage_used(kind, used)
+        log.info(f"Storage maintenance reclaimed {sum(reclaimed.values())} bytes {reclaimed} in "
+                 f"{time.monotonic() - started:.1f}s")
+        return reclaimed
+
+    def _run_with_low_priority(self) -> None:
+        _lower_priority()
+        self.run()
+
+    def start(self) -> bool:
+        """Runs the maintenance in the background. Returns False if a run is still in progress."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                log.warning("Storage maintenance is still running")
+                return False
+            self._thread = Thread(target=self._run_with_low_priority, name="storage-maintenance", daemon=True)
+            self._thread.start()
+            return True
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Static utility methods
+# ----------------------------------------------------------------------------------------------------------------
+
+_manager: Optional[StorageManager] = None
+_manager_lock = Lock()
+
+
+def _lower_priority() -> None:
+    """Lowers the CPU and IO priority of the calling thread, Linux schedules threads like processes."""
+    tid = threading.get_native_id()
+    try:
+        os.setpriority(os.PRIO_PROCESS, tid, 19)
+    except (AttributeError, OSError) as e:
+        log.warning(f"Could not lower the CPU priority of storage maintenance: {str(e)}")
+    try:
+        psutil.Process(tid).ionice(psutil.IOPRIO_CLASS_IDLE)
+    except (AttributeError, psutil.Error, OSError) as e:
+        log.warning(f"Could not lower the IO priority of storage maintenance: {str(e)}")
+
+
+def get_storage_manager() -> Optional[StorageManager]:
+    """Returns the storage manager configured by the optional section storage or None if storage is not maintained."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            cfg = None if core_configuration.config is None else core_configuration.storage_config()
+            if cfg is None or not cfg.getboolean('maintenance', False):
+                return None
+            _manager = StorageManager(get_catalog(), budget_mb=cfg.getint('budget_mb', 0),
+                                      transcode_after_days=cfg.getint('transcode_after_days', 7),
+                                      transcode_encoding=cfg.get('transcode_encoding', 'jpg').lower().strip(),
+                                      transcode_quality=cfg.getint('transcode_quality', 85),
+                                      thin_after_days=cfg.getint('thin_after_days', 30),
+                                      thin_interval_min=cfg.getint('thin_interval_min', 60),
+                                      plot_retention_days=cfg.getint('plot_retention_days', 90),
+                                      pyramid=get_preview_pyramid())
+            log.info(f"Created {_manager}")
+        return _manager
@@ -1,17 +1,29 @@
+from __future__ import annotations
+
+import atexit
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
+from pathlib import Path
+from threading import Lock
 import time
-import pandas as pd
-from typing import Optional, Tuple, Type
+from typing import Dict, List, Optional, Tuple, Type
 from configparser import SectionProxy
-from gpiozero import CPUTemperature
-from core.sensors.dht import get_sensor_data
+from core.catalog import PICTURE_COMMANDED, PICTURE_TIMED, catalog_file, get_catalog
+from core.sensors.dht import SensorDefinition, get_sensor_data
 from core.database import PostgresHandler, SensorDataHandler, TIME_FORMAT
 from core.plotting import SupportedDataFrames
-from core.sensors.camera import RpiCamController
+from core.sensors.camera import RpiCamController, downscale_picture
+from core.sensors.filtering import ReadingFilter
+from core.sensors.sampler import SensorSampler
+from core.util import create_timelapse
 from core.virtualization import init_postgres_container
 from core.core_log import get_logger
+from core.startup import lazy_import
 
 log = get_logger(__name__)
+pd = lazy_import("pandas")
+gpiozero = lazy_import("gpiozero")
+THERMAL_ZONE = "/sys/class/thermal/thermal_zone0/temp"
 
 
 # ----------------------------------------------------------------------------------------------------------------
@@ -20,8 +32,18 @@ log = get_logger(__name__)
 # ----------------------------------------------------------------------------------------------------------------
 
 def get_cpu_temperature() -> float:
-    cpu = CPUTemperature()
-    return float(cpu.temperature)
+    try:
+        cpu = gpiozero.CPUTemperature()
+        return float(cpu.temperature)
+    except Exception as e:
+        # not on a raspberry, e.g., with the GPIO simulator
+        log.debug(f"gpiozero unavailable ({e}), reading thermal zone")
+    try:
+        with open(THERMAL_ZONE) as f:
+            return int(f.read().strip()) / 1000
+    except (OSError, ValueError) as e:
+        log.warning(f"Failed to read CPU temperature: {e}")
+        return float('nan')
 
 
 def init_database(handler_type: Type[PostgresHandler], database_auth: SectionProxy, table_name: str,
@@ -69,36 +91,172 @@ def init_database(handler_type: Type[PostgresHandler], database_auth: SectionPro
 def take_picture(name, encoding):
     rpi_cam = RpiCamController()
     # file name is set in capture_image to filepath.encoding which is png on default
-    return rpi_cam.capture_image(file_path=name, encoding=encoding)
+    if rpi_cam.capture_image(file_path=name, encoding=encoding):
+        catalog_file(f"{name}.{encoding}")
+        return True
+    return False
+
+
+_archive_writer: Optional[ThreadPoolExecutor] = None
+_archive_writer_lock = Lock()
+
+
+def _get_archive_writer() -> ThreadPoolExecutor:
+    global _archive_writer
+    with _archive_writer_lock:
+        if _archive_writer is None:
+            # one thread keeps the writes of pictures in order, pending writes are finished at exit
+            _archive_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="picture-archive")
+            atexit.register(_archive_writer.shutdown)
+        return _archive_writer
+
+
+def _write_picture(path: str, content: bytes) -> bool:
+    try:
+        Path(path).write_bytes(content)
+        log.info(f"Archived picture {path}")
+        catalog_file(path)
+        return True
+    except OSError as e:
+        log.error(f"Error while archiving picture {path}: {str(e)}")
+        return False
+
+
+def archive_picture(path: str, content: bytes) -> Future:
+    """Writes the picture in the background. The future returns whether the picture was written."""
+    return _get_archive_writer().submit(_write_picture, path, content)
+
+
+def take_picture_to_memory(encoding) -> Optional[bytes]:
+    """Returns the encoded picture from the camera without waiting for the disk, see archive_picture."""
+    return RpiCamController().capture_image_bytes(encoding=encoding)
+
+
+def create_picture_timelapse(output_video_path: str, timed: bool = True, start: Optional[datetime] = None,
+                             end: Optional[datetime] = None, fps: int = 2, incremental: bool = False) -> None:
+    """
+    Creates a timelapse of the timed or commanded pictures of the catalog taken between start and end. The segments of
+    incremental mode cover all pictures of the folder, so a range is always encoded completely.
+    """
+    if incremental and (start is not None or end is not None):
+        log.warning("Incremental timelapses cover all pictures, encoding the pictures between start and end instead")
+        incremental = False
+    kind = PICTURE_TIMED if timed else PICTURE_COMMANDED
+    entries = get_catalog().query(kind, start, end)
+    if len(entries) == 0:
+        log.info(f"No {kind} pictures found in catalog")
+        return None
+    input_folder = str(entries[0].path.parent)
+    # old pictures may be transcoded, see core.storage, the encoding of the latest picture identifies the segments
+    encoding = entries[-1].path.suffix[1:]
+    create_timelapse(input_folder, output_video_path, encoding, fps, incremental,
+                     image_files=[str(e.path) for e in entries])
+
+
+def email_picture(file_name: str, content: bytes, max_width: int = 0) -> Tuple[str, bytes]:
+    """Returns file name and content of the picture attachment, scaled down to a JPEG if it is wider than max_width."""
+    if max_width <= 0:
+        return file_name, content
+    downscaled = downscale_picture(content, max_width)
+    if downscaled is None:
+        return file_name, content
+    return f"{Path(file_name).stem}.jpg", downscaled
 
 
 def get_data_for_plotting(database_auth: SectionProxy, handler_type: Type[PostgresHandler],
-                          transformer: SupportedDataFrames) -> pd.DataFrame:
+                          transformer: SupportedDataFrames, sensor_id: Optional[str] = None,
+                          primary: bool = False) -> pd.DataFrame:
+    """
+    With a sensor id, only the rows of this sensor are used and the rows without sensor id if it is the primary sensor,
+    see SensorDataHandler.read_sensor_data_into_dataframe.
+    """
     handler: PostgresHandler = handler_type(database_auth['db_port'], database_auth['db_host'],
                                             database_auth['db_user'], database_auth['db_pw'], transformer.table_name)
     handler.init_db_connection(check_table=False)
-    data = handler.read_data_into_dataframe()
+    if sensor_id is not None and isinstance(handler, SensorDataHandler):
+        data = handler.read_sensor_data_into_dataframe(sensor_id, primary)
+    else:
+        data = handler.read_data_into_dataframe()
     return transformer.prepare_data(data)
 
-def retrieve_temp_data(sensor_pin: int ,is_dht11_sensor: bool) ->  Optional[Tuple]:
-    return get_sensor_data(sensor_pin, is_dht11_sensor)
+def retrieve_temp_data(sensor_pin: int ,is_dht11_sensor: bool, sensor: Optional[SensorDefinition] = None) ->  Optional[Tuple]:
+    return get_sensor_data(sensor_pin, is_dht11_sensor, sensor=sensor)
 
-def retrieve_and_save_sensor_data(database_auth: SectionProxy, sensor_pin: int,
-                                  is_dht11_sensor: bool) -> Optional[Tuple]:
+def read_sensors(sensors: List[SensorDefinition],
+                 samplers: Optional[Dict[str, SensorSampler]] = None) -> Dict[str, Tuple]:
+    """
+    Returns temperature and humidity per sensor id. The sensors are read one after another, so their captures never
+    overlap. Sensors with a sampler use the aggregate of its last window instead.
+    """
+    samplers = {} if samplers is None else samplers
+    out = {}
+    for sensor in sensors:
+        sampler = samplers.get(sensor.sensor_id)
+        # the sampler has no readings right after the start
+        values = None if sampler is None else sampler.aggregate()
+        out[sensor.sensor_id] = values or get_sensor_data(sensor.pin, sensor.is_dht11, sensor=sensor)
+    return out
+
+
+def retrieve_and_save_sensor_data(database_auth: SectionProxy, sensors: List[SensorDefinition],
+                                  samplers: Optional[Dict[str, SensorSampler]] = None,
+                                  filters: Optional[Dict[str, ReadingFilter]] = None,
+                                  flush: bool = False) -> Optional[Tuple]:
+    """
+    Reads all sensors and saves their values in one transaction. Values of sensors with a filter are stored filtered
+    besides the raw values. Sensors sampled in high frequency mode store the buckets aggregated since the last call
+    instead. With flush, e.g., on shutdown, only the buckets are stored, including the ones which are still open.
+    Returns timestamp, cpu temperature, temperature and humidity of the primary sensor or None if it could not be read.
+    """
+    samplers = {} if samplers is None else samplers
+    filters = {} if filters is None else filters
     log.info("Start Measurement Data Collection")
     handler = SensorDataHandler(database_auth['db_port'], database_auth['db_host'], database_auth['db_user'],
                                 database_auth['db_pw'], SupportedDataFrames.Main.table_name)
     handler.init_db_connection()
     cpu_temp = get_cpu_temperature()
 
-    room_temp, humidity = retrieve_temp_data(sensor_pin, is_dht11_sensor)
+    # sensors sampled in high frequency mode store the buckets aggregated since the last write
+    aggregated = [s for s in sensors if s.sensor_id in samplers and samplers[s.sensor_id].aggregator is not None]
+    if flush:
+        sensors = aggregated
+    values = read_sensors([s for s in sensors if s not in aggregated], samplers)
     timestamp = datetime.now().strftime(TIME_FORMAT)
-    if room_temp is not None and humidity is not None:
-        log.info("[Measurement {0}] CPU={1:f}*C, Room={2:f}*C, Humidity={3:f}%".format(timestamp, cpu_temp, room_temp,
-                                                                                       humidity))
-        handler.insert_measurements_into_db(timestamp=timestamp, humidity=humidity, room_temp=room_temp,
-                                            cpu_temp=cpu_temp)
-        return timestamp, cpu_temp, room_temp, humidity
-
-    log.debug("There was an error in the data to retrieve!")
+    rows, out, drained, snapshots = [], None, {}, {}
+    for sensor in sensors:
+        if sensor in aggregated:
+            drained[sensor.sensor_id] = samplers[sensor.sensor_id].aggregator.drain(include_open=flush)
+            for bucket in drained[sensor.sensor_id]:
+                rows.append(dict(bucket, timestamp=datetime.fromtimestamp(bucket['timestamp']).strftime(TIME_FORMAT),
+                                 cpu_temp=cpu_temp, sensor_id=sensor.sensor_id))
+            log.info(f"[Measurement {timestamp}] {sensor.sensor_id}: {len(drained[sensor.sensor_id])} aggregated rows")
+            if sensor.primary and len(drained[sensor.sensor_id]) > 0:
+                out = timestamp, cpu_temp, rows[-1]['room_temp'], rows[-1]['humidity']
+            continue
+        room_temp_raw, humidity_raw = values[sensor.sensor_id]
+        if room_temp_raw is None or humidity_raw is None:
+            log.debug(f"There was an error in the data of sensor {sensor.sensor_id} to retrieve!")
+            continue
+        reading_filter = filters.get(sensor.sensor_id)
+        if reading_filter is None:
+            room_temp, humidity = room_temp_raw, humidity_raw
+        else:
+            snapshots[sensor.sensor_id] = reading_filter.snapshot()
+            room_temp, humidity = reading_filter.update(room_temp_raw, humidity_raw)
+        log.info("[Measurement {0}] {1}: CPU={2:f}*C, Room={3:f}*C, Humidity={4:f}%".format(timestamp, sensor.sensor_id,
+                                                                                           cpu_temp, room_temp,
+                                                                                           humidity))
+        rows.append({'timestamp': timestamp, 'humidity': humidity, 'room_temp': room_temp, 'cpu_temp': cpu_temp,
+                     'sensor_id': sensor.sensor_id, 'humidity_raw': humidity_raw, 'room_temp_raw': room_temp_raw})
+        if sensor.primary:
+            out = timestamp, cpu_temp, room_temp, humidity
+
+    if len(rows) > 0 and handler.insert_measurements_batch(rows):
+        return out
+    for sensor_id, buckets in drained.items():
+        # written with the next batch
+        samplers[sensor_id].aggregator.restore(buckets)
+    for sensor_id, snapshot in snapshots.items():
+        # a cycle which is not stored does not change the filters
+        filters[sensor_id].restore(snapshot)
     return None
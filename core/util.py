@@ -1,15 +1,23 @@
+import json
 import os, socket
+import shutil
+import subprocess
+import time
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from functools import wraps
-from typing import Callable, Any
-
-import cv2
+from pathlib import Path
+from typing import Callable, Any, Dict, List, Optional, Tuple
 
 from core.core_configuration import PICTURE_NAME_FORMAT
 from core.core_log import get_logger
 from core.monitoring import PrometheusManager
+from core.startup import lazy_import
 
 log = get_logger(__name__)
+cv2 = lazy_import("cv2")
 
 
 # ----------------------------------------------------------------------------------------------------------------
@@ -17,8 +25,8 @@ log = get_logger(__name__)
 # Should only be used for imported python frameworks.
 # ----------------------------------------------------------------------------------------------------------------
 
-def create_timelapse(input_folder: str, output_video_path: str, image_encoding="png", fps: int = 2) -> None:
-    # List to store the image file paths
+def _picture_files(input_folder: str, image_encoding: str) -> List[str]:
+    """Returns the pictures named in PICTURE_NAME_FORMAT, sorted by their timestamp."""
     image_files = []
     image_encoding = "." + image_encoding
     for filename in os.listdir(input_folder):
@@ -30,25 +38,205 @@ def create_timelapse(input_folder: str, output_video_path: str, image_encoding="
                 log.info(f"Skipping file: {filename}, invalid date format")
     # Sort based on the timestamp
     image_files.sort()
+    return image_files
+
+
+def _decode_frame(image_file: str, size: Tuple[int, int]):
+    width, height = size
+    img = cv2.imread(image_file)
+    if img is not None and (img.shape[0] != height or img.shape[1] != width):
+        # Resize image to match the first frame's dimensions
+        img = cv2.resize(img, (width, height))
+    return img
+
 
-    if len(image_files) > 0:
-        # Read the first image to get the dimensions
-        frame = cv2.imread(image_files[0])
-        height, width, layers = frame.shape
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        video = cv2.VideoWriter(output_video_path, fourcc, fps, (width, height))
-        for image_file in image_files:
-            img = cv2.imread(image_file)
-            if img.shape[0] != height or img.shape[1] != width:
-                # Resize image to match the first frame's dimensions
-                img = cv2.resize(img, (width, height))
+def _write_frames(image_files: List[str], output_video_path: str, fps: int, size: Tuple[int, int],
+                  workers: Optional[int] = None) -> int:
+    """
+    Encodes the pictures into a video with the size (width, height). Returns the number of written frames.
+    Pictures are decoded and resized ahead by a pool of worker threads, OpenCV releases the GIL while doing so. At most
+    two frames per worker are decoded ahead, which bounds the memory. The calling thread writes the frames in order.
+    """
+    workers = max(1, os.cpu_count() or 1) if workers is None else max(1, workers)
+    prefetch = 2 * workers
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    video = cv2.VideoWriter(output_video_path, fourcc, fps, size)
+    frames = 0
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="timelapse") as executor:
+        files = iter(image_files)
+        pending = deque((f, executor.submit(_decode_frame, f, size)) for f in islice(files, prefetch))
+        while len(pending) > 0:
+            image_file, future = pending.popleft()
+            next_file = next(files, None)
+            if next_file is not None:
+                pending.append((next_file, executor.submit(_decode_frame, next_file, size)))
+            img = future.result()
+            if img is None:
+                log.warning(f"Skipping file: {image_file}, could not be decoded")
+                continue
             video.write(img)
-        video.release()
+            frames += 1
+    video.release()
+    duration = time.monotonic() - started
+    log.info(f"Encoded {frames} frames with {workers} decode workers in {duration:.1f}s, "
+             f"{frames / max(duration, 1e-6):.1f} frames/s")
+    return frames
+
+
+def _frame_size(image_files: List[str]) -> Optional[Tuple[int, int]]:
+    """Returns the size (width, height) of the first picture which can be decoded or None if none can be decoded."""
+    for image_file in image_files:
+        frame = cv2.imread(image_file)
+        if frame is not None:
+            return frame.shape[1], frame.shape[0]
+        log.warning(f"Skipping file: {image_file}, could not be decoded")
+    return None
+
+
+def create_timelapse(input_folder: str, output_video_path: str, image_encoding="png", fps: int = 2,
+                     incremental: bool = False, workers: Optional[int] = None,
+                     image_files: Optional[List[str]] = None) -> None:
+    """
+    With incremental, only pictures which are new since the last run are encoded, see TimelapseBuilder. The segments
+    are kept in the folder .timelapse of the input folder. workers is the number of decode threads, default is one per
+    cpu. image_files are the sorted pictures, e.g., from the catalog, otherwise the input folder is listed.
+    """
+    if incremental:
+        builder = TimelapseBuilder(input_folder, os.path.join(input_folder, ".timelapse"), image_encoding, fps,
+                                   workers, image_files)
+        builder.build(output_video_path)
+        return None
+    image_files = _picture_files(input_folder, image_encoding) if image_files is None else image_files
+
+    # the dimensions of the first picture which can be decoded
+    size = _frame_size(image_files)
+    if size is not None:
+        _write_frames(image_files, output_video_path, fps, size, workers)
         log.info(f"Timelapse video saved as {output_video_path}")
     else:
         log.info("No valid images found.")
 
 
+class TimelapseBuilder:
+    """
+    Builds a timelapse from per-day segments. A run encodes only the pictures which are newer than the last picture in
+    the manifest into a new segment per day and concatenates all segments into the video. With ffmpeg, the segments are
+    concatenated without re-encoding. Otherwise OpenCV decodes and re-encodes all frames of all segments on every run,
+    which only saves decoding and resizing the pictures. If fps or frame size change, all segments are encoded again.
+    """
+    _manifest_file = "manifest.json"
+
+    def __init__(self, input_folder: str, segments_folder: str, image_encoding: str = "png", fps: int = 2,
+                 workers: Optional[int] = None, image_files: Optional[List[str]] = None) -> None:
+        self.input_folder = input_folder
+        self.segments_folder = Path(segments_folder)
+        self.image_encoding = image_encoding
+        self.fps = fps
+        self.workers = workers
+        self.image_files = image_files
+
+    def __str__(self):
+        return f"TimelapseBuilder[{self.input_folder}, fps: {self.fps}]"
+
+    def _load_manifest(self) -> dict:
+        path = self.segments_folder / self._manifest_file
+        try:
+            manifest = json.loads(path.read_text())
+            if manifest.get('fps') == self.fps and manifest.get('encoding') == self.image_encoding:
+                # segments which were deleted are dropped, their pictures are not encoded again
+                manifest['segments'] = [s for s in manifest['segments'] if (self.segments_folder / s['file']).exists()]
+                return manifest
+            log.info(f"Timelapse settings changed, encoding all segments of {self.input_folder} again")
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError) as e:
+            log.warning(f"Ignoring broken timelapse manifest {path}: {str(e)}")
+        return {'fps': self.fps, 'encoding': self.image_encoding, 'size': None, 'segments': []}
+
+    def _save_manifest(self, manifest: dict) -> None:
+        path = self.segments_folder / self._manifest_file
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(manifest, indent=1))
+        os.replace(tmp_path, path)
+
+    def update(self) -> dict:
+        """Encodes the new pictures into segments and returns the manifest."""
+        self.segments_folder.mkdir(parents=True, exist_ok=True)
+        manifest = self._load_manifest()
+        last = manifest['segments'][-1]['last'] if len(manifest['segments']) > 0 else ""
+        image_files = _picture_files(self.input_folder, self.image_encoding) if self.image_files is None \
+            else self.image_files
+        # the timestamp in the name counts, pictures may be transcoded to another encoding
+        new_files = [f for f in image_files if Path(f).stem > Path(last).stem]
+        if len(new_files) == 0:
+            return manifest
+        if manifest['size'] is None:
+            size = _frame_size(new_files)
+            if size is None:
+                log.warning(f"None of the {len(new_files)} new pictures could be decoded, no segment is encoded")
+                return manifest
+            manifest['size'] = list(size)
+        # names start with the date of the picture, see PICTURE_NAME_FORMAT
+        days: Dict[str, List[str]] = {}
+        for image_file in new_files:
+            days.setdefault(Path(image_file).name[:10], []).append(image_file)
+        for day, image_files in days.items():
+            part = sum(1 for s in manifest['segments'] if s['day'] == day)
+            segment = f"{day}_{part:03d}.mp4"
+            frames = _write_frames(image_files, str(self.segments_folder / segment), self.fps, tuple(manifest['size']),
+                                   self.workers)
+            manifest['segments'].append({'file': segment, 'day': day, 'first': Path(image_files[0]).name,
+                                         'last': Path(image_files[-1]).name, 'frames': frames})
+            # saved after every segment, so an interrupted run does not encode the segment again
+            self._save_manifest(manifest)
+            log.info(f"Encoded {frames} new frames of {day} into segment {segment}")
+        return manifest
+
+    def build(self, output_video_path: str) -> bool:
+        manifest = self.update()
+        segments = [str(self.segments_folder / s['file']) for s in manifest['segments']]
+        if len(segments) == 0:
+            log.info("No valid images found.")
+            return False
+        if _concat_segments(segments, output_video_path, self.fps, tuple(manifest['size'])):
+            log.info(f"Timelapse video of {len(segments)} segments saved as {output_video_path}")
+            return True
+        return False
+
+
+def _concat_segments(segments: List[str], output_video_path: str, fps: int, size: Tuple[int, int]) -> bool:
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is not None:
+        list_path = f"{output_video_path}.segments.txt"
+        with open(list_path, "w") as f:
+            f.writelines(f"file '{os.path.abspath(segment)}'\n" for segment in segments)
+        try:
+            # the concat demuxer copies the encoded streams of the segments
+            result = subprocess.run([ffmpeg, '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_path,
+                                     '-c', 'copy', output_video_path], capture_output=True, timeout=600)
+            if result.returncode == 0:
+                return True
+            log.warning(f"ffmpeg could not concatenate segments: {result.stderr.decode()}")
+        except subprocess.TimeoutExpired:
+            log.warning("ffmpeg did not concatenate segments within 600s")
+        finally:
+            os.remove(list_path)
+    if ffmpeg is None:
+        log.warning("ffmpeg is not installed, incremental timelapses save only the decoding of the pictures")
+    log.info("Concatenating segments with OpenCV, all frames are encoded again")
+    video = cv2.VideoWriter(output_video_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    for segment in segments:
+        capture = cv2.VideoCapture(segment)
+        ok, frame = capture.read()
+        while ok:
+            video.write(frame)
+            ok, frame = capture.read()
+        capture.release()
+    video.release()
+    return True
+
+
 def web_access_available(host: str = "8.8.8.8", port: int = 53, timeout_s: float = 3.0) -> bool:
     available = False
     try:
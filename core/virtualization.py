@@ -1,9 +1,9 @@
-import docker
-from docker import errors as de
-
 from core.core_log import get_logger
+from core.startup import lazy_import
 
 log = get_logger(__name__)
+docker = lazy_import("docker")
+de = lazy_import("docker.errors")
 
 
 # ----------------------------------------------------------------------------------------------------------------
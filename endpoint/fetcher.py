@@ -1,21 +1,20 @@
 import urllib.parse
 from datetime import datetime
 
-import requests
-from bs4 import BeautifulSoup as bs
-from pyvirtualdisplay import Display
-from selenium import webdriver
-from selenium.common.exceptions import WebDriverException
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import WebDriverWait
-
 from core.core_log import get_logger
 from core.database import TIME_FORMAT
+from core.startup import lazy_import
 
 log = get_logger(__name__)
+# Browser based fetching is only loaded when it is used the first time
+requests = lazy_import("requests")
+bs4 = lazy_import("bs4")
+pyvirtualdisplay = lazy_import("pyvirtualdisplay")
+webdriver = lazy_import("selenium.webdriver")
+selenium_exceptions = lazy_import("selenium.common.exceptions")
+by = lazy_import("selenium.webdriver.common.by")
+EC = lazy_import("selenium.webdriver.support.expected_conditions")
+selenium_ui = lazy_import("selenium.webdriver.support.ui")
 
 
 # ----------------------------------------------------------------------------------------------------------------
@@ -39,7 +38,7 @@ class UlmDeFetcher:
             return None
 
         if response.status_code == 200:
-            soup = bs(response.text, 'html.parser')
+            soup = bs4.BeautifulSoup(response.text, 'html.parser')
             temperature_element = soup.find('p', class_='temp')
             if temperature_element:
                 try:
@@ -80,7 +79,7 @@ class WetterComFetcher:
             return None
 
         if response.status_code == 200:
-            soup = bs(response.text, 'html.parser')
+            soup = bs4.BeautifulSoup(response.text, 'html.parser')
             temperature_element = soup.find('div', class_='delta rtw_temp')
             if temperature_element:
                 try:
@@ -101,9 +100,9 @@ class WetterComFetcher:
 
         Fetches the dynamic temperature data from Wetter.com link for a city/region
         """
-        display = Display(visible=False, size=(1600, 1200))
+        display = pyvirtualdisplay.Display(visible=False, size=(1600, 1200))
         display.start()
-        options = Options()
+        options = webdriver.ChromeOptions()
         options.add_argument('--disable-blink-features=AutomationControlled')
         service = webdriver.ChromeService(executable_path='/usr/bin/chromedriver')
         driver = webdriver.Chrome(service=service, options=options)
@@ -113,9 +112,9 @@ class WetterComFetcher:
         out = None
         try:
             driver.get(url)
-            found_temp = driver.find_element(By.XPATH, '//div[@class="delta rtw_temp"]')
+            found_temp = driver.find_element(by.By.XPATH, '//div[@class="delta rtw_temp"]')
             out = int(found_temp.text.replace('°C', ''))
-        except (WebDriverException, Exception) as e:
+        except (selenium_exceptions.WebDriverException, Exception) as e:
             log.error(f"An error occurred while dynamically fetching temperature data: {str(e)}")
             out = None
         finally:
@@ -136,12 +135,12 @@ class GoogleFetcher:
         """
 
         url = "https://www.google.com/search?lr=lang_en&ie=UTF-8&q=weather%20" + location
-        display = Display(visible=False, size=(1600, 1200))
+        display = pyvirtualdisplay.Display(visible=False, size=(1600, 1200))
         display.start()
-        options = Options()
+        options = webdriver.ChromeOptions()
         options.add_argument('--disable-blink-features=AutomationControlled')
         try:
-            service = Service('/usr/bin/chromedriver')
+            service = webdriver.ChromeService('/usr/bin/chromedriver')
             driver = webdriver.Chrome(service=service, options=options)
             driver.get(url)
             timeout_s = 15
@@ -150,11 +149,11 @@ class GoogleFetcher:
             driver.implicitly_wait(timeout_s)
 
             # print(driver.page_source)
-            WebDriverWait(driver, web_wait_timeout).until(
-                EC.presence_of_element_located((By.ID, "wob_loc"))
+            selenium_ui.WebDriverWait(driver, web_wait_timeout).until(
+                EC.presence_of_element_located((by.By.ID, "wob_loc"))
             )
 
-            soup = bs(driver.page_source, "html.parser")
+            soup = bs4.BeautifulSoup(driver.page_source, "html.parser")
 
             weather_data = {
                 "region": soup.find("div", attrs={"id": "wob_loc"}).text,
@@ -25,6 +25,14 @@ class FetchTemp(CoreSkeleton):
     def __init__(self, instance_name: str,  core_instance_validation: List[str] = SUPPORTED_INSTANCES):
         super().__init__(instance_name=instance_name, core_instance_validation=core_instance_validation)
         
+    # overwrite, FetchTemp has no sensor
+    def _init_sensors(self) -> None:
+        pass
+
+    # overwrite
+    def _init_sampler(self) -> None:
+        pass
+
     def _setup_scheduling(self) -> None:
         self.scheduler.every(10).minutes.do(lambda: self.collect_and_save_to_db())
 
@@ -52,7 +52,7 @@ Section: base
 Priority: optional
 Architecture: armhf
 Maintainer: Wurstbroteater <you@example.com>
-Depends: docker-compose, docker.io, python3, python3-pip, ufw, screen, libpq-dev, xvfb, chromium-chromedriver
+Depends: docker-compose, docker.io, python3, python3-pip, ufw, screen, libpq-dev, xvfb, ffmpeg, chromium-chromedriver
 Description: $appName v$releaseVersion - Application to measure temperature and humdity of a room, 
   retrieve online weather data, visualize it, analyse it. Connect a camera to take pictures, too!
 EOF
@@ -61,7 +61,7 @@ cat > "$debFolder/postinst" <<EOF
 #!/bin/bash
 set -e
 apt-get update
-apt-get install -y screen libpq-dev xvfb chromium-chromedriver
+apt-get install -y screen libpq-dev xvfb ffmpeg chromium-chromedriver
 # Fix permissions for chromedriver
 if [ -d /usr/lib/chromium-browser ]; then
     chmod -R 755 /usr/lib/chromium-browser
@@ -1,14 +1,18 @@
 import argparse
-import uvicorn
 from threading import Thread
 from typing import Optional, Type
-from fastapi import FastAPI, Response
-from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
-from core.core_configuration import get_instance_name, initialize, FileManager
-from core.core_log import setup_logging
-from core.instance import BaseTemp, CoreSkeleton, get_supported_instance_type
-from core.monitoring import PrometheusManager
-from endpoint.instance import SUPPORTED_INSTANCES, FetchTemp
+# Heavy frameworks are imported lazily by the modules using them, see core.startup
+from core.startup import startup_report
+
+with startup_report.phase("import web"):
+    import uvicorn
+    from fastapi import FastAPI, Response
+    from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+with startup_report.phase("import core"):
+    from core.core_configuration import get_instance_name, initialize, FileManager
+    from core.core_log import setup_logging
+    from core.instance import BaseTemp, CoreSkeleton, get_supported_instance_type
+    from core.monitoring import PrometheusManager
 
 setup_logging()
 app = FastAPI()
@@ -62,7 +66,8 @@ def start_fastapi(instance_name: str, port: int) -> None:
 def init(port:int, instance_name: Optional[str] = None):
     # Ensure PrometheusManager singleton is initialized
     prom_manager = PrometheusManager(instance_name) if instance_name else None
-    fm: FileManager = initialize()
+    with startup_report.phase("initialize"):
+        fm: FileManager = initialize()
     instance_type: Optional[Type[CoreSkeleton]] = None
 
     if instance_name is None:
@@ -72,15 +77,20 @@ def init(port:int, instance_name: Optional[str] = None):
         prom_manager = PrometheusManager(instance_name)
         instance_type = get_supported_instance_type(instance_name)
 
-    elif instance_name.lower() == SUPPORTED_INSTANCES[0].lower():
-        instance_type = FetchTemp
+    else:
+        # only FetchTemp requires the endpoint modules
+        with startup_report.phase("import endpoint"):
+            from endpoint.instance import SUPPORTED_INSTANCES, FetchTemp
+        if instance_name.lower() == SUPPORTED_INSTANCES[0].lower():
+            instance_type = FetchTemp
 
     # Start FastAPI thread
     fastapi_thread = Thread(target=start_fastapi, args=(instance_name, port), daemon=True)
     fastapi_thread.start()
 
     if instance_type is not None:
-        instance: CoreSkeleton = instance_type(instance_name)
+        with startup_report.phase("create instance"):
+            instance: CoreSkeleton = instance_type(instance_name)
         # Store in FastAPI app state and access with getattr(app.state, "instance", None)
         app.state.instance = instance
         instance.start()
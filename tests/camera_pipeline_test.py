@@ -0,0 +1,77 @@
+import io
+import time
+from threading import Event
+
+import numpy as np
+from PIL import Image
+
+from core.monitoring import PrometheusManager
+from core.sensors.camera import CaptureQueue, RpiCamController, downscale_picture, split_rotation
+
+# ----------------------------------------------------------------------------------------------------------------
+# Tests for the camera pipeline which run without camera
+# ----------------------------------------------------------------------------------------------------------------
+
+
+def raw_capture(width: int, height: int, stride: int) -> bytes:
+    """Raw RGB with padded rows and a white marker in the top left corner."""
+    image = np.zeros((height, stride), np.uint8)
+    image[:2, :6] = 255
+    return image.tobytes()
+
+
+def test_split_rotation():
+    assert split_rotation(0) == (0, 0) and split_rotation(360) == (0, 0)
+    assert split_rotation(180) == (180, 0)
+    assert split_rotation(90) == (0, 90) and split_rotation(270) == (0, 270)
+
+
+def test_save_rotated(tmp_path):
+    path = str(tmp_path / "rotated.png")
+    assert RpiCamController()._save_rotated(raw_capture(30, 20, 128), (30, 20), 90, path)
+    image = np.asarray(Image.open(path))
+    assert image.shape == (30, 20, 3)
+    # counterclockwise, the top left corner is now the bottom left one
+    assert image[-1, 0].min() == 255 and image[0, 0].max() == 0
+
+
+def test_save_rotated_incomplete_capture(tmp_path):
+    assert not RpiCamController()._save_rotated(b"\0" * 100, (30, 20), 90, str(tmp_path / "rotated.png"))
+
+
+def test_save_rotated_into_memory():
+    buffer = io.BytesIO()
+    assert RpiCamController()._save_rotated(raw_capture(30, 20, 128), (30, 20), 270, buffer, "jpg")
+    assert Image.open(io.BytesIO(buffer.getvalue())).size == (20, 30)
+
+
+def test_downscale_picture():
+    buffer = io.BytesIO()
+    Image.new("RGB", (400, 300)).save(buffer, format="PNG")
+    downscaled = downscale_picture(buffer.getvalue(), 100)
+    assert Image.open(io.BytesIO(downscaled)).size == (100, 75)
+    assert downscale_picture(buffer.getvalue(), 400) is None
+
+
+def test_command_timeout():
+    started = time.monotonic()
+    result = RpiCamController(timeout_s=0.5)._run_command(['sleep', '10'])
+    assert time.monotonic() - started < 5
+    assert result['returncode'] != 0 and "killed" in result['error']
+
+
+def test_capture_queue():
+    PrometheusManager("test")
+    queue = CaptureQueue(max_jobs=2)
+    release = Event()
+    running = queue.submit("timed", lambda: release.wait(5))
+    queued = queue.submit("timed", lambda: True)
+    # the queue is full while the first job waits for the camera
+    assert queue.submit("commanded", lambda: True) is None
+    queued.cancel()
+    release.set()
+    assert running.result(5) and queued.cancelled()
+    assert queue.submit("commanded", lambda: False).result(5) is False
+    # the result of a capture is passed on, e.g., to send it after the job
+    assert queue.submit("commanded", lambda: ("picture.png", b"content")).result(5) == ("picture.png", b"content")
+    queue.stop()
@@ -0,0 +1,73 @@
+from datetime import datetime
+
+import cv2
+from PIL import Image
+
+import core.catalog
+from core.catalog import PICTURE_COMMANDED, PICTURE_TIMED, PLOT_TIMED, PictureCatalog
+from core.core_configuration import FileManager, set_file_manager
+from core.usage_util import create_picture_timelapse
+
+# ----------------------------------------------------------------------------------------------------------------
+# Tests for the catalog of pictures and plots
+# ----------------------------------------------------------------------------------------------------------------
+
+
+def save_picture(folder, name: str, size=(64, 48)) -> str:
+    folder.mkdir(parents=True, exist_ok=True)
+    Image.new("RGB", size).save(folder / name)
+    return str(folder / name)
+
+
+def frame_count(path) -> int:
+    capture = cv2.VideoCapture(str(path))
+    count = 0
+    while capture.read()[0]:
+        count += 1
+    capture.release()
+    return count
+
+
+def test_add_and_query(tmp_path):
+    catalog = PictureCatalog(str(tmp_path / "catalog.sqlite"), str(tmp_path))
+    pictures = tmp_path / FileManager.TIMED_PICTURES
+    for hour in [20, 8, 14]:
+        catalog.add(save_picture(pictures, f"2025-04-06-{hour:02d}:00:00.png"))
+    catalog.add(save_picture(tmp_path / FileManager.COMMANDED_PICTURES, "2025-04-06-09:00:00.jpg", (32, 24)))
+    assert catalog.add(save_picture(tmp_path, "unrelated.png")) is None
+
+    entries = catalog.query(PICTURE_TIMED, start=datetime(2025, 4, 6, 10), end=datetime(2025, 4, 7))
+    assert [e.path.name for e in entries] == ["2025-04-06-14:00:00.png", "2025-04-06-20:00:00.png"]
+    assert (entries[0].width, entries[0].height) == (64, 48) and entries[0].datetime == datetime(2025, 4, 6, 14)
+    assert catalog.latest(PICTURE_COMMANDED).width == 32
+    catalog.remove(str(entries[1].path))
+    assert catalog.latest(PICTURE_TIMED).path.name == "2025-04-06-14:00:00.png"
+    catalog.close()
+
+
+def test_rebuild(tmp_path):
+    save_picture(tmp_path / FileManager.TIMED_PICTURES, "2025-04-06-08:00:00.png")
+    plots = tmp_path / FileManager.TIMED_PLOTS
+    plots.mkdir()
+    (plots / "06-04-2025.pdf").write_bytes(b"%PDF")
+    catalog = PictureCatalog(str(tmp_path / "catalog.sqlite"), str(tmp_path))
+    assert catalog.rebuild() == 2 and len(catalog) == 2
+    assert catalog.latest(PLOT_TIMED).datetime == datetime(2025, 4, 6)
+    assert catalog.total_size(PLOT_TIMED) == 4
+    catalog.close()
+
+
+def test_picture_timelapse(tmp_path):
+    set_file_manager(FileManager(str(tmp_path)))
+    core.catalog._catalog = None
+    for hour in [8, 12, 16]:
+        save_picture(tmp_path / FileManager.TIMED_PICTURES, f"2025-04-06-{hour:02d}:00:00.png")
+    create_picture_timelapse(str(tmp_path / "timelapse.mp4"), start=datetime(2025, 4, 6, 10))
+    assert frame_count(tmp_path / "timelapse.mp4") == 2
+    # the segments of incremental mode do not depend on the range
+    create_picture_timelapse(str(tmp_path / "all.mp4"), incremental=True)
+    create_picture_timelapse(str(tmp_path / "range.mp4"), end=datetime(2025, 4, 6, 10), incremental=True)
+    assert frame_count(tmp_path / "all.mp4") == 3 and frame_count(tmp_path / "range.mp4") == 1
+    assert len(core.catalog.get_catalog()) == 3
+    core.catalog.get_catalog().close()
+    core.catalog._catalog = None
@@ -0,0 +1,37 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from core.change_detection import ChangeDetector
+from core.monitoring import PrometheusManager
+
+# ----------------------------------------------------------------------------------------------------------------
+# Tests for the change detection of timed pictures
+# ----------------------------------------------------------------------------------------------------------------
+
+
+def picture(brightness: int = 100, box: bool = False, encoding: str = "PNG") -> bytes:
+    pixels = np.full((480, 640, 3), brightness, np.uint8)
+    pixels[:, :320] //= 2
+    if box:
+        pixels[100:300, 200:400] = 255
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format=encoding)
+    return buffer.getvalue()
+
+
+def test_change_decisions():
+    PrometheusManager("test")
+    detector = ChangeDetector(threshold=0.02, keep_every=3)
+    decisions = [detector.check(p)[1] for p in [picture(), picture(), picture(110, encoding="JPEG"), picture(),
+                                                 picture(box=True), picture(box=True)]]
+    # a brighter exposure is no change, every third unchanged picture is kept
+    assert decisions == ["first", "skipped", "skipped", "thinned", "changed", "skipped"]
+
+
+def test_score():
+    detector = ChangeDetector()
+    detector.load_reference(io.BytesIO(picture()))
+    assert detector.score(detector.signature(picture())) == 0
+    assert detector.score(detector.signature(picture(box=True))) > 0.1
@@ -0,0 +1,93 @@
+import time
+from typing import List, Tuple
+
+import numpy as np
+
+from core.sensors.dht_decoder import DHTResult, decode_edges, decode_pull_ups
+from core.sensors.gpio import synthesize_trace
+
+# ----------------------------------------------------------------------------------------------------------------
+# Tests for the DHT decoder with synthetic traces. Run with pytest or as script for a small benchmark:
+# python -m tests.dht_decoder_test
+# ----------------------------------------------------------------------------------------------------------------
+
+
+def dht22_bytes(temperature: float, humidity: float) -> List[int]:
+    t, h = int(round(abs(temperature) * 10)), int(round(humidity * 10))
+    data = [h >> 8, h & 255, (t >> 8) | (0x80 if temperature < 0 else 0), t & 255]
+    return data + [sum(data) & 255]
+
+
+def trace(the_bytes: List[int], zero_us: float = 27, one_us: float = 70, jitter_us: float = 0,
+          seed: int = 0) -> Tuple[List[int], List[int]]:
+    """Edges as recorded by EdgeCapture: pull up when capturing starts, answer of the sensor, release at the end."""
+    rng = np.random.default_rng(seed)
+    periods = [(1, 20), (0, 80), (1, 80)]
+    for byte in the_bytes:
+        for i in range(8):
+            periods += [(0, 50), (1, one_us if (byte >> (7 - i)) & 1 else zero_us)]
+    periods += [(0, 50), (1, 0)]
+    timestamps, levels, t = [], [], 1_000_000_000
+    for level, length_us in periods:
+        timestamps.append(t)
+        levels.append(level)
+        t += int((length_us + rng.normal(0, jitter_us)) * 1000)
+    return timestamps, levels
+
+
+def test_dht22():
+    result = decode_edges(*trace(dht22_bytes(21.3, 55.8)), is_dht11=False)
+    assert result.is_valid() and result.temperature == 21.3 and result.humidity == 55.8
+    assert result.confidence == 1.0 and result.pull_ups == 40
+
+
+def test_dht22_negative():
+    result = decode_edges(*trace(dht22_bytes(-5.1, 65.2)), is_dht11=False)
+    assert result.is_valid() and result.temperature == -5.1 and result.humidity == 65.2
+
+
+def test_dht11():
+    result = decode_edges(*trace([40, 0, 23, 4, 67]), is_dht11=True)
+    assert result.is_valid() and result.temperature == 23.4 and result.humidity == 40
+
+
+def test_noisy():
+    result = decode_edges(*trace(dht22_bytes(21.3, 55.8), jitter_us=3, seed=1), is_dht11=False)
+    assert result.is_valid() and 0 < result.confidence < 1
+
+
+def test_low_confidence():
+    # a pull up of 45us cannot be told apart reliably
+    timestamps, levels = trace(dht22_bytes(21.3, 55.8), zero_us=45)
+    assert decode_edges(timestamps, levels, is_dht11=False).error_code == DHTResult.ERR_LOW_CONFIDENCE
+
+
+def test_synthesized_trace():
+    # the traces of the GPIO simulator decode like the ones of a sensor
+    result = decode_edges(*synthesize_trace(23.4, 40, is_dht11=True), is_dht11=True)
+    assert result.is_valid() and result.temperature == 23.4 and result.humidity == 40
+    result = decode_edges(*synthesize_trace(21.3, 55.8, is_dht11=False, truncate_bits=25), is_dht11=False)
+    assert result.error_code == DHTResult.ERR_MISSING_DATA and result.pull_ups == 25
+
+
+def test_crc():
+    the_bytes = dht22_bytes(21.3, 55.8)
+    the_bytes[4] ^= 1
+    assert decode_edges(*trace(the_bytes), is_dht11=False).error_code == DHTResult.ERR_CRC
+
+
+def test_truncated():
+    timestamps, levels = trace(dht22_bytes(21.3, 55.8))
+    result = decode_edges(timestamps[:50], levels[:50], is_dht11=False)
+    assert result.error_code == DHTResult.ERR_MISSING_DATA and result.error_name() == "missing_data"
+    assert decode_edges(timestamps[:1], levels[:1], is_dht11=False).error_code == DHTResult.ERR_NOT_FOUND
+    assert decode_pull_ups([], is_dht11=False).error_code == DHTResult.ERR_NOT_FOUND
+
+
+if __name__ == "__main__":
+    edges = trace(dht22_bytes(21.3, 55.8), jitter_us=3)
+    runs = 10000
+    start = time.perf_counter()
+    for _ in range(runs):
+        decode_edges(*edges, is_dht11=False)
+    print(f"decode_edges: {(time.perf_counter() - start) / runs * 1e6:.1f}us per frame")
@@ -0,0 +1,46 @@
+from core.sensors.filtering import HampelFilter, KalmanFilter, create_filter
+
+# ----------------------------------------------------------------------------------------------------------------
+# Tests for the streaming filters of stored readings
+# ----------------------------------------------------------------------------------------------------------------
+
+
+def test_hampel_replaces_spike():
+    hampel = HampelFilter(window=5, n_sigmas=3, min_deviation=1.0)
+    filtered = [hampel.update(v) for v in [21.0, 21.1, 21.0, 21.2, 35.4, 21.1, 21.3]]
+    assert [outlier for _, outlier in filtered] == [False, False, False, False, True, False, False]
+    assert filtered[4][0] == 21.1
+    # regular readings are not changed
+    assert [v for v, _ in filtered[:4]] == [21.0, 21.1, 21.0, 21.2]
+
+
+def test_hampel_follows_steps():
+    hampel = HampelFilter(window=5, min_deviation=1.0)
+    filtered = [hampel.update(v)[0] for v in [20.0] * 5 + [23.0] * 5]
+    # a real change is replaced until it dominates the window
+    assert filtered[-1] == 23.0 and filtered[-3] == 23.0
+
+
+def test_kalman_smooths():
+    kalman = KalmanFilter(process_variance=0.01, measurement_variance=0.25)
+    filtered = [kalman.update(v)[0] for v in [21.0, 21.0, 21.0, 25.0]]
+    assert filtered[:3] == [21.0, 21.0, 21.0]
+    assert 21.0 < filtered[3] < 23.0
+
+
+def test_reading_filter():
+    reading_filter = create_filter("hampel", window=5)
+    for temperature, humidity in [(21.0, 50.0), (21.1, 50.2), (21.0, 50.1), (21.1, 50.0)]:
+        assert reading_filter.update(temperature, humidity) == (temperature, humidity)
+    assert reading_filter.update(21.1, 95.0) == (21.1, 50.1)
+    assert reading_filter.outliers == 1
+    assert create_filter("none") is None
+
+
+def test_reading_filter_restore():
+    reading_filter = create_filter("kalman")
+    reading_filter.update(21.0, 50.0)
+    snapshot = reading_filter.snapshot()
+    first = reading_filter.update(22.0, 52.0)
+    reading_filter.restore(snapshot)
+    assert reading_filter.update(22.0, 52.0) == first
@@ -0,0 +1,90 @@
+import time
+
+from prometheus_client import REGISTRY
+
+from core.monitoring import PrometheusManager
+from core.sensors.dht import DHT, DHTResult, RetryPolicy, get_sensor_data
+from core.sensors.gpio import SimulatedGPIO, default_traces, set_gpio, synthesize_trace
+from core.sensors.reader import SensorReaderProcess, set_sensor_reader
+
+# ----------------------------------------------------------------------------------------------------------------
+# Tests for reading a DHT sensor with the GPIO simulator. Traces are replayed ten times slower, so the polling loop
+# keeps up on slow machines. A read may still fail if the process is descheduled while capturing, so tests expect
+# that a read is either correct or invalid, but never wrong.
+# ----------------------------------------------------------------------------------------------------------------
+
+
+def read_until_valid(sensor: DHT, attempts: int = 10) -> DHTResult:
+    result = sensor.read()
+    for _ in range(attempts - 1):
+        if result.is_valid():
+            break
+        result = sensor.read()
+    return result
+
+
+def test_read_dht22():
+    set_gpio(SimulatedGPIO([synthesize_trace(21.3, 55.8, is_dht11=False, jitter_us=1)], speed=0.1))
+    result = read_until_valid(DHT(4, False))
+    assert result.is_valid() and result.temperature == 21.3 and result.humidity == 55.8
+
+
+def test_read_dht11():
+    set_gpio(SimulatedGPIO([synthesize_trace(19.5, 61, is_dht11=True)], speed=0.1))
+    result = read_until_valid(DHT(4, True))
+    assert result.is_valid() and result.temperature == 19.5 and result.humidity == 61
+
+
+def test_truncated():
+    set_gpio(SimulatedGPIO([synthesize_trace(21.3, 55.8, is_dht11=False, truncate_bits=20)], speed=0.1))
+    sensor = DHT(4, False)
+    assert all(sensor.read().error_code == DHTResult.ERR_MISSING_DATA for _ in range(5))
+
+
+def test_default_traces():
+    gpio = SimulatedGPIO(default_traces(is_dht11=False), speed=0.1)
+    set_gpio(gpio)
+    sensor = DHT(4, False)
+    results = [sensor.read() for _ in range(len(gpio.traces))]
+    assert gpio.replays == len(gpio.traces)
+    assert any(r.is_valid() for r in results) and any(not r.is_valid() for r in results)
+
+
+def test_retry_policy():
+    policy = RetryPolicy(is_dht11=False, max_backoff_s=6)
+    assert policy.backoff_s(DHTResult.ERR_CRC, 3) == policy.min_interval_s == 2
+    assert [policy.backoff_s(DHTResult.ERR_NOT_FOUND, i) for i in range(1, 5)] == [2, 4, 6, 6]
+
+
+def test_retry_after_corrupted_read():
+    PrometheusManager("test")
+    set_gpio(SimulatedGPIO([synthesize_trace(21.3, 55.8, is_dht11=True, truncate_bits=20),
+                            synthesize_trace(21.3, 55.8, is_dht11=True)], speed=0.1))
+    assert get_sensor_data(5, True, RetryPolicy(is_dht11=True, deadline_s=10)) == (21.3, 55.8)
+    # the instance name is set by the first test creating the manager
+    labels = {'instance': PrometheusManager.get_instance_name(), 'sensor_id': 'pin5'}
+    assert REGISTRY.get_sample_value('sensor_read_errors_by_code_total', {**labels, 'error': 'missing_data'}) >= 1
+    assert REGISTRY.get_sample_value('sensor_pull_ups_bucket', {**labels, 'le': '20.0'}) >= 1
+    assert REGISTRY.get_sample_value('sensor_retries_per_success_sum', labels) >= 1
+    assert REGISTRY.get_sample_value('sensor_read_duration_seconds_count', labels) == 1
+
+
+def test_deadline_if_sensor_does_not_answer():
+    PrometheusManager("test")
+    set_gpio(SimulatedGPIO([([0], [SimulatedGPIO.HIGH])], speed=0.1))
+    start = time.monotonic()
+    assert get_sensor_data(6, True, RetryPolicy(is_dht11=True, deadline_s=3)) == (None, None)
+    assert time.monotonic() - start <= 3
+
+
+def test_reader_process():
+    PrometheusManager("test")
+    set_gpio(SimulatedGPIO([synthesize_trace(22.4, 47.1, is_dht11=False)], speed=0.1))
+    reader = SensorReaderProcess(cpu=0, priority=10, timeout_s=30)
+    set_sensor_reader(reader)
+    try:
+        assert get_sensor_data(4, False, RetryPolicy(False, deadline_s=30)) == (22.4, 47.1)
+        assert reader.is_alive() and reader.restarts == 0
+    finally:
+        set_sensor_reader(None)
+    assert not reader.is_alive()
@@ -0,0 +1,157 @@
+import argparse
+import csv
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+import warnings
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from core.core_log import setup_logging
+from core.plotting import DefaultPlotCategory, PlotData, SupportedDataFrames, draw_complete_summary, last_24h_df, \
+    _save_to_pdf
+
+# ----------------------------------------------------------------------------------------------------------------
+# Benchmark for the plotting module. Generates synthetic data for all SupportedDataFrames, shaped like the result
+# of PostgresHandler.read_data_into_dataframe, and times every stage of creating the report separately.
+# Every dataset size runs in its own process, so the peak RSS of one size does not influence the next one.
+#
+# Usage: python -m tests.plotting_benchmark [--sizes 1m 1y 5y] [--output bench.csv]
+# ----------------------------------------------------------------------------------------------------------------
+
+SIZES = {"1m": timedelta(days=30), "1y": timedelta(days=365), "5y": timedelta(days=5 * 365)}
+
+# sampling interval of the tables in production
+CADENCE = {
+    SupportedDataFrames.Main: timedelta(minutes=10),
+    SupportedDataFrames.DWD_DE: timedelta(hours=1),
+    SupportedDataFrames.GOOGLE_COM: timedelta(minutes=10),
+    SupportedDataFrames.WETTER_COM: timedelta(minutes=10),
+    SupportedDataFrames.ULM_DE: timedelta(minutes=10),
+}
+
+
+def _temperature_curve(timestamps: pd.DatetimeIndex, mean: float, rng: np.random.Generator) -> np.ndarray:
+    days = (timestamps - timestamps[0]).total_seconds().to_numpy() / 86400
+    seasonal = 10 * np.sin(2 * np.pi * (days - 110) / 365)
+    daily = 4 * np.sin(2 * np.pi * (days % 1 - 0.375))
+    return np.round(mean + seasonal + daily + rng.normal(0, 0.5, len(days)), 1)
+
+
+def generate_table(support: SupportedDataFrames, span: timedelta, end: datetime,
+                   rng: np.random.Generator) -> pd.DataFrame:
+    """Synthetic table as it is returned by pandas.read_sql, i.e., with id column and timezone aware timestamps."""
+    timestamps = pd.date_range(end=end, periods=int(span / CADENCE[support]), freq=CADENCE[support], tz="UTC")
+    outside = _temperature_curve(timestamps, 11, rng)
+    n = len(timestamps)
+    data = {"id": np.arange(1, n + 1), "timestamp": timestamps}
+    if support is SupportedDataFrames.Main:
+        data["humidity"] = np.round(np.clip(55 + rng.normal(0, 6, n), 20, 95), 1)
+        data["room_temp"] = np.round(21 + (outside - 11) * 0.15 + rng.normal(0, 0.2, n), 1)
+        data["cpu_temp"] = np.round(48 + rng.normal(0, 3, n), 1)
+    elif support is SupportedDataFrames.DWD_DE:
+        data["temp"] = outside
+        data["temp_dev"] = np.round(np.abs(rng.normal(0, 1, n)), 1)
+    elif support is SupportedDataFrames.GOOGLE_COM:
+        # google timestamps contain microseconds
+        data["timestamp"] = timestamps + pd.to_timedelta(rng.integers(0, 10 ** 6, n), unit="us")
+        data["temp"] = np.round(outside + rng.normal(0, 1, n))
+        data["humidity"] = np.round(np.clip(70 + rng.normal(0, 10, n), 10, 100))
+        data["precipitation"] = rng.integers(0, 100, n).astype(float)
+        data["wind"] = rng.integers(0, 40, n).astype(float)
+    elif support is SupportedDataFrames.WETTER_COM:
+        data["temp_stat"] = np.round(outside + rng.normal(0, 1, n))
+        temp_dyn = np.round(outside + rng.normal(0, 1, n))
+        temp_dyn[rng.random(n) < 0.1] = np.nan
+        data["temp_dyn"] = temp_dyn
+    elif support is SupportedDataFrames.ULM_DE:
+        data["temp"] = np.round(outside + rng.normal(0, 1, n))
+    return pd.DataFrame(data)
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _timed(results: List[dict], size: str, stage: str, fun: Callable, rows: int = 0):
+    start = time.perf_counter()
+    out = fun()
+    results.append({"size": size, "stage": stage, "rows": rows, "wall_s": round(time.perf_counter() - start, 4),
+                    "peak_rss_mb": round(_peak_rss_mb(), 1), "output_bytes": 0})
+    return out
+
+
+def run_size(size: str) -> List[dict]:
+    setup_logging()
+    # rows without any outside temperature in the tolerance are expected and create all-NaN warnings
+    warnings.filterwarnings("ignore", category=RuntimeWarning)
+    rng = np.random.default_rng(42)
+    end = datetime.now().replace(second=0, microsecond=0)
+    results: List[dict] = []
+    tables: Dict[SupportedDataFrames, pd.DataFrame] = {s: generate_table(s, SIZES[size], end, rng)
+                                                       for s in SupportedDataFrames}
+    results.append({"size": size, "stage": "generate", "rows": sum(len(t) for t in tables.values()), "wall_s": 0,
+                    "peak_rss_mb": round(_peak_rss_mb(), 1), "output_bytes": 0})
+
+    plot_data = []
+    for support, table in tables.items():
+        prepared = _timed(results, size, f"prepare_data[{support.name}]", lambda: support.prepare_data(table),
+                          len(table))
+        plot_data.append(PlotData(support, prepared, support is SupportedDataFrames.Main))
+    main = plot_data[0]
+
+    _timed(results, size, "merge_temperature_by_timestamp",
+           lambda: DefaultPlotCategory._merge_temperature_by_timestamp(main, plot_data), len(main.data))
+    _timed(results, size, "merge_temperature_by_timestamp[24h]",
+           lambda: DefaultPlotCategory._merge_temperature_by_timestamp(main, plot_data, df_filter_fun=last_24h_df),
+           len(main.data))
+    fig = _timed(results, size, "draw_complete_summary",
+                 lambda: draw_complete_summary(plot_data, merge_subplots_for=plot_data), len(main.data))
+
+    with tempfile.TemporaryDirectory() as folder:
+        save_path = os.path.join(folder, f"benchmark-{size}.pdf")
+        _timed(results, size, "save_pdf", lambda: _save_to_pdf([fig], save_path), len(main.data))
+        results[-1]["output_bytes"] = os.path.getsize(save_path)
+    return results
+
+
+def run_benchmark(sizes: List[str]) -> List[dict]:
+    results = []
+    ctx = multiprocessing.get_context("spawn")
+    for size in sizes:
+        # fresh process per size to measure its own peak RSS
+        with ctx.Pool(1) as pool:
+            results += pool.apply(run_size, (size,))
+    return results
+
+
+def print_results(results: List[dict]) -> None:
+    header: Tuple[str, ...] = ("size", "stage", "rows", "wall_s", "peak_rss_mb", "output_bytes")
+    print(f"{header[0]:<5} {header[1]:<40} {header[2]:>9} {header[3]:>9} {header[4]:>12} {header[5]:>12}")
+    for r in results:
+        print(f"{r['size']:<5} {r['stage']:<40} {r['rows']:>9} {r['wall_s']:>9.3f} {r['peak_rss_mb']:>12.1f} "
+              f"{r['output_bytes']:>12}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the plotting module with synthetic data.")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=list(SIZES), help="Dataset sizes to run")
+    parser.add_argument("--output", type=str, help="Optional csv file to append the results to")
+    args = parser.parse_args()
+
+    benchmark_results = run_benchmark(args.sizes)
+    print_results(benchmark_results)
+    if args.output:
+        write_header = not os.path.exists(args.output)
+        with open(args.output, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(benchmark_results[0].keys()) + ["date"])
+            if write_header:
+                writer.writeheader()
+            for row in benchmark_results:
+                writer.writerow(row | {"date": datetime.now().isoformat(timespec="seconds")})
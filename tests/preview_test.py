@@ -0,0 +1,78 @@
+import io
+import time
+from threading import Event
+
+from PIL import Image
+
+from core.previews import PreviewPyramid
+
+# ----------------------------------------------------------------------------------------------------------------
+# Tests for the previews of pictures
+# ----------------------------------------------------------------------------------------------------------------
+
+
+def save_picture(path, size=(800, 600), encoding="PNG") -> str:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Image.new("RGB", size, (200, 10, 10)).save(path, format=encoding)
+    return str(path)
+
+
+def test_create_previews(tmp_path):
+    pyramid = PreviewPyramid(str(tmp_path), widths=[320, 160])
+    picture = save_picture(tmp_path / "commanded" / "picture.png")
+    created = pyramid.create(picture)
+    assert [Image.open(p).size for p in created] == [(320, 240), (160, 120)]
+    assert pyramid.relative_name(created[0]) == "previews/320/commanded/picture.jpg"
+    assert pyramid.has_previews(picture)
+
+
+def test_create_previews_from_memory(tmp_path):
+    pyramid = PreviewPyramid(str(tmp_path), widths=[320], encoding="webp")
+    buffer = io.BytesIO()
+    Image.new("RGB", (640, 480)).save(buffer, format="JPEG")
+    # the picture is not written yet
+    created = pyramid.create(str(tmp_path / "picture.jpg"), buffer.getvalue())
+    assert Image.open(created[0]).size == (320, 240) and created[0].suffix == ".webp"
+
+
+def test_best_variant(tmp_path):
+    pyramid = PreviewPyramid(str(tmp_path), widths=[1280, 320])
+    picture = save_picture(tmp_path / "picture.png", size=(2000, 1000))
+    assert pyramid.best_variant(picture, 300) == tmp_path / "picture.png"
+    pyramid.submit(picture).result(5)
+    assert pyramid.best_variant(picture, 300).parent.name == "320"
+    assert pyramid.best_variant(picture, 640).parent.name == "1280"
+    assert pyramid.best_variant(picture, 1600) == tmp_path / "picture.png"
+    pyramid.close()
+
+
+def test_backfill(tmp_path):
+    pyramid = PreviewPyramid(str(tmp_path), widths=[320], max_pending=1)
+    pictures = [save_picture(tmp_path / f"{i}.png") for i in range(3)] + [save_picture(tmp_path / "commanded" / "c.png")]
+    (tmp_path / "notes.txt").write_text("no picture")
+    assert len(pyramid.missing()) == 4
+    assert pyramid.backfill() == 4
+    pyramid.close()
+    assert pyramid.missing() == [] and all(pyramid.has_previews(p) for p in pictures)
+
+
+def test_backfill_leaves_slots_for_new_pictures(tmp_path):
+    pyramid = PreviewPyramid(str(tmp_path), widths=[320], max_pending=2)
+    release = Event()
+    pyramid.create = lambda picture_path, content=None: release.wait(5)
+    pictures = [save_picture(tmp_path / f"{i}.png") for i in range(3)]
+    thread = pyramid.start_backfill(pictures)
+    time.sleep(0.2)
+    # the backfill waits for its slot, the other one is left for a new picture
+    assert pyramid.submit(pictures[0]) is not None
+    release.set()
+    thread.join(5)
+    pyramid.close()
+
+
+def test_close(tmp_path):
+    pyramid = PreviewPyramid(str(tmp_path), widths=[320])
+    picture = save_picture(tmp_path / "picture.png")
+    pyramid.close()
+    assert pyramid.submit(picture) is None and pyramid.backfill() == 0
+    assert pyramid._executor is None and not pyramid.has_previews(picture)
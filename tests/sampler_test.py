@@ -0,0 +1,106 @@
+import time
+
+import pytest
+
+from core.monitoring import PrometheusManager
+from core.sensors.dht import parse_sensor_definitions
+from core.sensors.gpio import SimulatedGPIO, set_gpio, synthesize_trace
+from core.sensors.filtering import create_filter
+from core.sensors.sampler import BucketAggregator, SensorSampler
+from core.usage_util import read_sensors
+
+# ----------------------------------------------------------------------------------------------------------------
+# Tests for the background sensor sampler
+# ----------------------------------------------------------------------------------------------------------------
+
+
+def test_ring_buffer():
+    sampler = SensorSampler(4, False, window=3)
+    assert sampler.latest() is None and sampler.aggregate() is None
+    for i in range(5):
+        sampler.add(20 + i, 50 + i)
+    assert sampler.latest()[1:] == (24, 54)
+    # only the last 3 readings are kept
+    assert sampler.aggregate() == (23, 53)
+
+
+def test_aggregation_ignores_outliers():
+    readings = [(21.0, 50.0), (21.2, 51.0), (85.0, 99.0), (21.1, 50.5), (21.3, 50.0)]
+    for aggregation in ["median", "trimmed_mean"]:
+        sampler = SensorSampler(4, False, window=5, aggregation=aggregation, trim=0.2)
+        for temperature, humidity in readings:
+            sampler.add(temperature, humidity)
+        temperature, humidity = sampler.aggregate()
+        assert 21.0 <= temperature <= 21.3 and 50 <= humidity <= 51
+
+
+def test_old_readings_are_ignored():
+    sampler = SensorSampler(4, False, interval_s=10, window=5)
+    sampler.add(30, 70, timestamp=time.time() - 3600)
+    sampler.add(21, 50)
+    assert sampler.aggregate() == (21, 50)
+
+
+def test_sampling_with_simulator():
+    PrometheusManager("test")
+    set_gpio(SimulatedGPIO([synthesize_trace(21.3, 55.8, is_dht11=True)], speed=0.1))
+    sampler = SensorSampler(7, True, interval_s=1, window=5)
+    sampler.start()
+    deadline = time.monotonic() + 10
+    while sampler.latest() is None and time.monotonic() < deadline:
+        time.sleep(0.1)
+    sampler.stop()
+    assert sampler.latest()[1:] == (21.3, 55.8)
+    assert sampler.aggregate() == (21.3, 55.8)
+
+
+def test_parse_sensor_definitions():
+    sensors = parse_sensor_definitions("living:dht22:4, shelf:DHT11:17")
+    assert [str(s) for s in sensors] == ["living:dht22:4", "shelf:dht11:17"]
+    assert sensors[0].primary and not sensors[1].primary
+    assert sensors[1].is_dht11 and not sensors[0].is_dht11
+    assert parse_sensor_definitions("") == []
+    for invalid in ["living:dht22", "living:dht22:x", "a b:dht22:4", "a:dht22:4, a:dht22:5"]:
+        with pytest.raises(ValueError):
+            parse_sensor_definitions(invalid)
+    with pytest.raises(TypeError):
+        parse_sensor_definitions("living:bme280:4")
+
+
+def test_read_multiple_sensors():
+    PrometheusManager("test")
+    set_gpio(SimulatedGPIO([synthesize_trace(21.3, 55.8, is_dht11=True)], speed=0.1))
+    sensors = parse_sensor_definitions("a:dht11:5, b:dht11:6")
+    sampler = SensorSampler(6, True, window=3, sensor=sensors[1])
+    sampler.add(19.5, 40.0)
+    values = read_sensors(sensors, {"b": sampler})
+    assert set(values) == {"a", "b"}
+    # a failed read of the simulator returns None, None but never wrong values
+    assert values["a"] in [(21.3, 55.8), (None, None)]
+    assert values["b"] == (19.5, 40.0)
+
+
+def test_bucket_aggregation():
+    aggregator = BucketAggregator(period_s=60)
+    sampler = SensorSampler(4, False, interval_s=5, window=4, aggregator=aggregator)
+    for i, (temperature, humidity) in enumerate([(21.0, 50.0), (21.4, 52.0), (20.8, 51.0), (22.0, 49.0)]):
+        sampler.add(temperature, humidity, timestamp=6000 + i * 20)
+    # the last reading opened the next bucket
+    rows = aggregator.drain()
+    assert rows == [{'timestamp': 6000, 'sample_count': 3, 'room_temp': 21.07, 'humidity': 51.0,
+                     'room_temp_raw': 21.07, 'humidity_raw': 51.0, 'room_temp_min': 20.8, 'room_temp_max': 21.4,
+                     'humidity_min': 50.0, 'humidity_max': 52.0}]
+    assert aggregator.drain() == []
+    aggregator.restore(rows)
+    assert aggregator.drain(include_open=True) == rows + [
+        {'timestamp': 6060, 'sample_count': 1, 'room_temp': 22.0, 'humidity': 49.0, 'room_temp_raw': 22.0,
+         'humidity_raw': 49.0, 'room_temp_min': 22.0, 'room_temp_max': 22.0, 'humidity_min': 49.0,
+         'humidity_max': 49.0}]
+
+
+def test_bucket_aggregation_is_filtered():
+    aggregator = BucketAggregator(period_s=60, reading_filter=create_filter("hampel", window=5))
+    for i, temperature in enumerate([21.0, 21.1, 21.0, 21.1, 38.0, 21.0]):
+        aggregator.add(temperature, 50.0, timestamp=6000 + i)
+    row = aggregator.drain(include_open=True)[0]
+    assert row['room_temp_max'] == 21.1 and row['room_temp_raw'] > row['room_temp']
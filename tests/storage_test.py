@@ -0,0 +1,71 @@
+import os
+from datetime import datetime, timedelta
+
+from PIL import Image
+
+from core.catalog import PICTURE_TIMED, PLOT_TIMED, PictureCatalog
+from core.core_configuration import FileManager, PICTURE_NAME_FORMAT, PLOT_NAME_FORMAT
+from core.monitoring import PrometheusManager
+from core.previews import PreviewPyramid
+from core.storage import StorageManager
+
+# ----------------------------------------------------------------------------------------------------------------
+# Tests for the storage maintenance of pictures and plots
+# ----------------------------------------------------------------------------------------------------------------
+
+
+def setup_files(tmp_path, days_ago, minutes=(0,)):
+    catalog = PictureCatalog(str(tmp_path / "catalog.sqlite"), str(tmp_path))
+    pictures = tmp_path / FileManager.TIMED_PICTURES
+    pictures.mkdir(parents=True)
+    for day in days_ago:
+        for minute in minutes:
+            taken = datetime.now().replace(hour=12, minute=0, second=0) - timedelta(days=day, minutes=minute)
+            path = pictures / f"{taken.strftime(PICTURE_NAME_FORMAT)}.png"
+            Image.effect_noise((200, 150), 60).convert("RGB").save(path)
+            catalog.add(str(path))
+    return catalog
+
+
+def test_transcode(tmp_path):
+    catalog = setup_files(tmp_path, [1, 10])
+    manager = StorageManager(catalog, transcode_after_days=7, thin_after_days=0)
+    assert manager.transcode() > 0
+    assert sorted(e.path.suffix for e in catalog.query(PICTURE_TIMED)) == [".jpg", ".png"]
+    assert len(list((tmp_path / FileManager.TIMED_PICTURES).iterdir())) == 2
+    catalog.close()
+
+
+def test_thin_and_previews(tmp_path):
+    catalog = setup_files(tmp_path, [1, 40], minutes=(0, 20, 40, 80))
+    pyramid = PreviewPyramid(str(tmp_path / FileManager.TIMED_PICTURES), widths=[64])
+    for entry in catalog.query(PICTURE_TIMED):
+        pyramid.create(str(entry.path))
+    manager = StorageManager(catalog, transcode_after_days=0, thin_after_days=30, thin_interval_min=60,
+                             pyramid=pyramid)
+    assert manager.thin() > 0
+    # 10:40, 11:20 and 12:00 are left of the old day, the new day is untouched
+    assert len(catalog.query(PICTURE_TIMED)) == 3 + 4
+    assert len(pyramid.missing([str(e.path) for e in catalog.query(PICTURE_TIMED)])) == 0
+    assert len(list((tmp_path / FileManager.TIMED_PICTURES / "previews" / "64").iterdir())) == 7
+    catalog.close()
+
+
+def test_plots_and_budget(tmp_path):
+    PrometheusManager("test")
+    catalog = setup_files(tmp_path, [3, 2, 1])
+    plots = tmp_path / FileManager.TIMED_PLOTS
+    plots.mkdir()
+    for day in [100, 1]:
+        path = plots / f"{(datetime.now() - timedelta(days=day)).strftime(PLOT_NAME_FORMAT)}.pdf"
+        path.write_bytes(b"%PDF" * 100)
+        catalog.add(str(path))
+    budget = (catalog.total_size(PICTURE_TIMED) - catalog.query(PICTURE_TIMED)[0].size + 400) / (1024 * 1024)
+    manager = StorageManager(catalog, transcode_after_days=0, thin_after_days=0, plot_retention_days=90)
+    manager.budget_bytes = int(budget * 1024 * 1024)
+    reclaimed = manager.run()
+    assert reclaimed["plots"] == 400 and reclaimed["budget"] > 0
+    assert len(catalog.query(PLOT_TIMED)) == 1 and len(catalog.query(PICTURE_TIMED)) == 2
+    assert sum(manager.used_bytes().values()) <= manager.budget_bytes
+    assert len(os.listdir(tmp_path / FileManager.TIMED_PICTURES)) == 2
+    catalog.close()
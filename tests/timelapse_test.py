@@ -0,0 +1,71 @@
+import json
+
+import cv2
+import numpy as np
+
+from core.util import TimelapseBuilder, create_timelapse
+
+# ----------------------------------------------------------------------------------------------------------------
+# Tests for the creation of timelapse videos
+# ----------------------------------------------------------------------------------------------------------------
+
+
+def save_pictures(folder, names):
+    for i, name in enumerate(names):
+        cv2.imwrite(str(folder / f"{name}.png"), np.full((48, 64, 3), i * 20, np.uint8))
+
+
+def frame_count(path) -> int:
+    capture = cv2.VideoCapture(str(path))
+    count = 0
+    while capture.read()[0]:
+        count += 1
+    capture.release()
+    return count
+
+
+def test_incremental_timelapse(tmp_path):
+    save_pictures(tmp_path, ["2025-04-06-08:00:00", "2025-04-06-20:00:00", "2025-04-07-08:00:00"])
+    (tmp_path / "broken.png").write_bytes(b"no picture")
+    builder = TimelapseBuilder(str(tmp_path), str(tmp_path / "segments"))
+    assert builder.build(str(tmp_path / "timelapse.mp4"))
+    assert frame_count(tmp_path / "timelapse.mp4") == 3
+    # only the new picture is encoded into another segment of the day
+    save_pictures(tmp_path, ["2025-04-07-20:00:00"])
+    manifest = builder.update()
+    assert [s['file'] for s in manifest['segments']] == ["2025-04-06_000.mp4", "2025-04-07_000.mp4",
+                                                         "2025-04-07_001.mp4"]
+    assert json.loads((tmp_path / "segments" / "manifest.json").read_text()) == manifest
+    assert builder.build(str(tmp_path / "timelapse.mp4"))
+    assert frame_count(tmp_path / "timelapse.mp4") == 4
+
+
+def test_timelapse(tmp_path):
+    save_pictures(tmp_path, ["2025-04-06-08:00:00", "2025-04-06-20:00:00"])
+    create_timelapse(str(tmp_path), str(tmp_path / "timelapse.mp4"), incremental=True)
+    create_timelapse(str(tmp_path), str(tmp_path / "full.mp4"))
+    assert frame_count(tmp_path / "timelapse.mp4") == frame_count(tmp_path / "full.mp4") == 2
+
+
+def test_broken_first_picture(tmp_path):
+    builder = TimelapseBuilder(str(tmp_path), str(tmp_path / "segments"))
+    (tmp_path / "2025-04-06-06:00:00.png").write_bytes(b"no picture")
+    assert not builder.build(str(tmp_path / "timelapse.mp4"))
+    # the size is taken from the first picture which can be decoded
+    save_pictures(tmp_path, ["2025-04-06-08:00:00", "2025-04-06-20:00:00"])
+    assert builder.build(str(tmp_path / "timelapse.mp4"))
+    assert builder.update()['size'] == [64, 48]
+    assert frame_count(tmp_path / "timelapse.mp4") == 2
+
+
+def test_frame_order(tmp_path):
+    names = [f"2025-04-06-{h:02d}:00:00" for h in range(12)]
+    save_pictures(tmp_path, names)
+    # a broken picture is skipped and does not shift the other frames
+    (tmp_path / f"{names[3]}.png").write_bytes(b"no picture")
+    create_timelapse(str(tmp_path), str(tmp_path / "timelapse.mp4"), workers=3)
+    capture = cv2.VideoCapture(str(tmp_path / "timelapse.mp4"))
+    brightness = []
+    while (frame := capture.read())[0]:
+        brightness.append(int(frame[1].mean()))
+    assert len(brightness) == 11 and brightness == sorted(brightness)